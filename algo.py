@@ -1,7 +1,20 @@
 import random
 import copy
 import time
-from copy import deepcopy
+import itertools
+import json
+import mmap
+import os
+import struct
+import threading
+import uuid
+from collections import namedtuple, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, wait
+try:
+    import numpy as np
+except ImportError: # Only the batched leaf evaluation needs it, the scalar search doesn't
+    np = None
+
 def board_into_int(state):
     return [None if x == 'None' or x is None else x for x in state["board"]]
 
@@ -23,25 +36,11 @@ def piece():
     return pieces
 
 def conversion_piece(piecen):
-    # Standardizes a given piece 'piecen' into the canonical 4-character string format
-    if piecen in piece(): # Checks if it's already in the standard list
-        return piecen
+    # Standardizes a given piece 'piecen' (its letters in any order) into the canonical 4-character string format
+    # Raises KeyError if 'piecen' isn't a piece
     if piecen is None:
         return None
-    else:
-        piecen = list(piecen) # Converts input to a list of characters
-        # The following variables will store the identified attribute characters
-        for i in piecen: # Iterates through characters to identify attributes
-            if i in ['B', 'S']:
-                tailles = i 
-            if i in ['L', 'D']:
-                couleurs = i
-            if i in ['E', 'F']:
-                remplissages = i
-            if i in ['P', 'C']:
-                formes = i
-        piece_final = tailles + couleurs + remplissages + formes # Reconstructs the piece string
-    return piece_final
+    return PIECES[PIECE_CODES[piecen]]
 
 def same(L):
     # Checks if all pieces in a list L (a line) share at least one common attribute
@@ -117,9 +116,10 @@ def isFull(board): # Checks if the game board has no empty (None) spots
 
 def apply(state, move):
     position, piece, next_piece = move
-    res = deepcopy(state)
-    if not (0 <= position < 16 and res["board"][position] is None):
+    if not (0 <= position < 16 and state["board"][position] is None):
         raise ValueError("Position invalide ou déjà occupée")
+    res = dict(state) # Only the board is changed in place, the rest can be shared
+    res["board"] = list(state["board"])
     res["board"][position] = piece
     res["current"] = str(1 - int(res["current"]))
     res["piece"] = next_piece
@@ -160,185 +160,1621 @@ def evaluate_heuristic(state, player):
     score += center_control * 3 # Weight center control
     return score           
 
-def negamax(state, player, depth, alpha=-float('inf'), beta=float('inf')):
-    # Implements Negamax with alpha-beta pruning to find the best score for player_at_node
-    def winnerF(board): # Winner def bur return Truf if win and False if lose
-        for i in range(4):
-            if same(getLine(board, i)):
-                return True
-            if same(getColumn(board, i)):
-                return True
-        if same(getDiagonal(board, 1)):
-            return True
-        return same(getDiagonal(board, -1))
-
-
-    if winner(state) is int or isFull(state["board"]):
-        return utility(state, player) # Use utility for true terminal states.
+# ---------------------------------------------------------------------------
+# Bitboard engine used by the search.
+# A piece is a 4-bit id (its index in piece()): bit 3 = size, bit 2 = colour,
+# bit 1 = filling, bit 0 = shape. The board is a 64-bit word holding the id of
+# the piece on square i in bits 4*i..4*i+3, with a separate 16-bit occupancy
+# mask. The pieces still to be given are a 16-bit mask of ids.
+# ---------------------------------------------------------------------------
+BitState = namedtuple("BitState", ["board", "occupied", "available", "piece", "current"])
+
+PIECES = tuple(piece()) # id -> canonical name
+PIECE_IDS = {name: i for i, name in enumerate(PIECES)} # canonical name -> id
+PIECE_CODES = {''.join(letters): i for i, name in enumerate(PIECES) # name in any letter order, as the server
+               for letters in itertools.permutations(name)}         # sends them (e.g. 'CSLF') -> id
+FULL = 0xFFFF # Every square occupied / every piece available
+CENTER = (1 << 5) | (1 << 6) | (1 << 9) | (1 << 10)
+
+LINES = tuple(
+    [tuple(range(r * 4, r * 4 + 4)) for r in range(4)] # Rows
+    + [tuple(range(c, 16, 4)) for c in range(4)] # Columns
+    + [(0, 5, 10, 15), (3, 6, 9, 12)] # Diagonals
+)
+LINE_MASKS = tuple(sum(1 << sq for sq in line) for line in LINES) # Occupancy mask of each line
+# For each line and attribute, the board bits holding that attribute on the line's four squares
+LINE_ATTR_MASKS = tuple(
+    tuple(sum(1 << (4 * sq + b) for sq in line) for b in range(4)) for line in LINES
+)
+# Lines going through each square, as (occupancy mask, attribute masks)
+LINES_BY_SQUARE = tuple(
+    tuple((LINE_MASKS[l], LINE_ATTR_MASKS[l]) for l, line in enumerate(LINES) if sq in line)
+    for sq in range(16)
+)
+POPCOUNT = bytes(bin(i).count("1") for i in range(1 << 16))
+
+_BIT_INDICES = {}
+def bit_indices(mask):
+    # Returns the indices of the set bits of a 16-bit mask (memoized, masks repeat a lot)
+    res = _BIT_INDICES.get(mask)
+    if res is None:
+        res = _BIT_INDICES[mask] = tuple(i for i in range(16) if mask >> i & 1)
+    return res
 
+def to_bitstate(state):
+    # Converts a server/dict state into a BitState (the only place strings are parsed)
+    board = 0
+    occupied = 0
+    available = FULL
+    for i, p in enumerate(board_into_int(state)):
+        if p is not None:
+            pid = PIECE_CODES[p]
+            board |= pid << (4 * i)
+            occupied |= 1 << i
+            available &= ~(1 << pid)
+    hand = state.get("piece")
+    hand = None if hand is None or hand == 'None' else PIECE_CODES[hand]
+    if hand is not None:
+        available &= ~(1 << hand)
+    return BitState(board, occupied, available, hand, int(state.get("current", 0)))
+
+def from_bitstate(bits, players=None):
+    # Converts a BitState back into the dict format used by the server
+    board, occupied, _, hand, current = bits
+    return {
+        "players": players,
+        "current": current,
+        "board": [PIECES[board >> (4 * i) & 15] if occupied >> i & 1 else None for i in range(16)],
+        "piece": None if hand is None else PIECES[hand],
+    }
+
+def wins_at(board, occupied, sq):
+    # True if one of the lines through 'sq' is full and its pieces share an attribute
+    for line_mask, attr_masks in LINES_BY_SQUARE[sq]:
+        if occupied & line_mask == line_mask:
+            for m in attr_masks:
+                common = board & m
+                if common == m or not common: # Attribute all set (AND) or all unset (NOT)
+                    return True
+    return False
 
-    if depth == 0 and isFull(state["board"]) is False: # heuristic call if depth is 0 
-        return evaluate_heuristic(state, player) 
+def has_winner(board, occupied):
+    # True if any full line on the board shares an attribute
+    for l, line_mask in enumerate(LINE_MASKS):
+        if occupied & line_mask == line_mask:
+            for m in LINE_ATTR_MASKS[l]:
+                common = board & m
+                if common == m or not common:
+                    return True
+    return False
 
+def evaluate_bits(board, occupied):
+    # Bitboard version of evaluate_heuristic: 15 per threatened line, 3 per center piece
+    threat_count = 0
+    for l, line_mask in enumerate(LINE_MASKS):
+        line_occ = occupied & line_mask
+        if POPCOUNT[line_occ] == 3:
+            all_set = 15
+            any_set = 0
+            for sq in bit_indices(line_occ):
+                p = board >> (4 * sq) & 15
+                all_set &= p
+                any_set |= p
+            if all_set or any_set != 15:
+                threat_count += 1
+    return threat_count * 15 + POPCOUNT[occupied & CENTER] * 3
+
+# Pieces having at least one of the attributes of a 4-bit mask set (resp. unset)
+PIECES_WITH_SET = tuple(sum(1 << p for p in range(16) if p & m) for m in range(16))
+PIECES_WITH_UNSET = tuple(sum(1 << p for p in range(16) if ~p & m) for m in range(16))
+
+def unsafe_pieces(board, occupied):
+    # Mask of the piece ids that complete a line of three sharing an attribute
+    # (giving one of them hands the opponent an immediate win)
+    mask = 0
+    for line_mask in LINE_MASKS:
+        line_occ = occupied & line_mask
+        if POPCOUNT[line_occ] == 3:
+            all_set = 15
+            any_set = 0
+            for sq in bit_indices(line_occ):
+                p = board >> (4 * sq) & 15
+                all_set &= p
+                any_set |= p
+            mask |= PIECES_WITH_SET[all_set] | PIECES_WITH_UNSET[15 & ~any_set]
+    return mask
+
+# Incremental line counters. A line is summarized by one int: 3 bits counting its pieces, then
+# 3 bits per attribute counting the pieces having it set. Placing a piece adds PIECE_LINE_WORD[p],
+# removing it subtracts the same value, so nothing has to be rebuilt when the search backs up.
+LINE_IDS_BY_SQUARE = tuple(tuple(l for l, line in enumerate(LINES) if sq in line) for sq in range(16))
+PIECE_LINE_WORD = tuple(1 | sum((p >> b & 1) << (3 * (b + 1)) for b in range(4)) for p in range(16))
+# For a line of three, indexed by its attribute counters (word >> 3): pieces completing it
+LINE_THREAT_PIECES = tuple(
+    PIECES_WITH_SET[sum(1 << b for b in range(4) if key >> (3 * b) & 7 == 3)]
+    | PIECES_WITH_UNSET[sum(1 << b for b in range(4) if not key >> (3 * b) & 7)]
+    for key in range(1 << 12)
+)
+
+class LineTracker:
+    # Counters of the ten lines of a board, updated by place()/remove() during the search,
+    # with the number of threatened lines (three pieces sharing an attribute) kept up to date
+    __slots__ = ("words", "threats")
+
+    def __init__(self, board, occupied):
+        self.words = [0] * len(LINES)
+        self.threats = 0
+        for sq in bit_indices(occupied):
+            self.place(sq, board >> (4 * sq) & 15)
+
+    def place(self, sq, p):
+        words = self.words
+        inc = PIECE_LINE_WORD[p]
+        for l in LINE_IDS_BY_SQUARE[sq]:
+            w = words[l]
+            if w & 7 == 3 and LINE_THREAT_PIECES[w >> 3]: # Threat filled
+                self.threats -= 1
+            w += inc
+            words[l] = w
+            if w & 7 == 3 and LINE_THREAT_PIECES[w >> 3]:
+                self.threats += 1
+
+    def remove(self, sq, p):
+        words = self.words
+        dec = PIECE_LINE_WORD[p]
+        for l in LINE_IDS_BY_SQUARE[sq]:
+            w = words[l]
+            if w & 7 == 3 and LINE_THREAT_PIECES[w >> 3]:
+                self.threats -= 1
+            w -= dec
+            words[l] = w
+            if w & 7 == 3 and LINE_THREAT_PIECES[w >> 3]: # Threat reopened
+                self.threats += 1
+
+    def evaluate(self, occupied):
+        # Same value as evaluate_bits for the tracked board
+        return self.threats * 15 + POPCOUNT[occupied & CENTER] * 3
+
+    def unsafe(self):
+        # Same mask as unsafe_pieces for the tracked board
+        mask = 0
+        for w in self.words:
+            if w & 7 == 3:
+                mask |= LINE_THREAT_PIECES[w >> 3]
+        return mask
+
+# Zobrist keys (fixed seed so hashes are stable between runs)
+_zobrist_rng = random.Random(23383)
+ZOBRIST_SQUARE = tuple(tuple(_zobrist_rng.getrandbits(64) for p in range(16)) for sq in range(16))
+ZOBRIST_HAND = tuple(_zobrist_rng.getrandbits(64) for p in range(17)) # Index 16: no piece in hand
+ZOBRIST_SIDE = _zobrist_rng.getrandbits(64) # Xored in when player 1 is to move
+
+def zobrist_hash(state):
+    # Full Zobrist hash of a BitState: board + piece in hand + side to move
+    board, occupied, _, hand, current = state
+    key = ZOBRIST_HAND[16 if hand is None else hand]
+    if current:
+        key ^= ZOBRIST_SIDE
+    for sq in bit_indices(occupied):
+        key ^= ZOBRIST_SQUARE[sq][board >> (4 * sq) & 15]
+    return key
+
+class SearchState:
+    # Mutable position used by the search: moves are made and unmade in place, with the
+    # Zobrist key and the line counters kept up to date, so a node allocates almost nothing.
+    # A move is place(sq) (the piece in hand goes to 'sq') then give(p) (None: no piece left).
+    __slots__ = ("board", "occupied", "available", "piece", "current", "key", "lines")
+
+    def __init__(self, state):
+        self.board, self.occupied, self.available, self.piece, self.current = state
+        self.key = zobrist_hash(state)
+        self.lines = LineTracker(self.board, self.occupied)
+
+    def bits(self):
+        # Immutable copy of the position
+        return BitState(self.board, self.occupied, self.available, self.piece, self.current)
+
+    def place(self, sq):
+        p = self.piece
+        self.board |= p << (4 * sq)
+        self.occupied |= 1 << sq
+        self.lines.place(sq, p)
+        self.key ^= ZOBRIST_SQUARE[sq][p] ^ ZOBRIST_HAND[p] ^ ZOBRIST_HAND[16]
+        self.piece = None
+
+    def unplace(self, sq):
+        p = self.board >> (4 * sq) & 15
+        self.board &= ~(15 << (4 * sq))
+        self.occupied &= ~(1 << sq)
+        self.lines.remove(sq, p)
+        self.key ^= ZOBRIST_SQUARE[sq][p] ^ ZOBRIST_HAND[p] ^ ZOBRIST_HAND[16]
+        self.piece = p
+
+    def give(self, p):
+        if p is None:
+            self.key ^= ZOBRIST_SIDE
+        else:
+            self.available &= ~(1 << p)
+            self.key ^= ZOBRIST_HAND[16] ^ ZOBRIST_HAND[p] ^ ZOBRIST_SIDE
+        self.piece = p
+        self.current ^= 1
+
+    def take_back(self, p):
+        if p is None:
+            self.key ^= ZOBRIST_SIDE
+        else:
+            self.available |= 1 << p
+            self.key ^= ZOBRIST_HAND[16] ^ ZOBRIST_HAND[p] ^ ZOBRIST_SIDE
+        self.piece = None
+        self.current ^= 1
+
+    def make(self, move):
+        sq, p = move
+        self.place(sq)
+        self.give(p)
+
+    def unmake(self, move):
+        sq, p = move
+        self.take_back(p)
+        self.unplace(sq)
+
+# ---------------------------------------------------------------------------
+# Optional NumPy leaf batching. Below a depth-1 node every leaf is the board
+# after one placement, so all of them are scored at once from the node's line
+# words: one row of ten words per placement, looked up in status tables.
+# ---------------------------------------------------------------------------
+LEAF_BATCHING = False # New contexts score their depth-1 nodes with batch_leaf_value (needs NumPy)
+LEAF_WON = 1 << 24 # Bits of a leaf table entry: won line, threatened line, pieces completing it
+LEAF_THREAT = 1 << 20 # (ten summed piece masks stay below it)
+_leaf_tables = None
+_leaf_squares = {} # empty squares mask -> NumPy index array
+
+def leaf_tables():
+    # NumPy tables of the batched evaluation, built on first use:
+    # square -> line incidence, line word -> LEAF_* bits, square -> 1 if central
+    global _leaf_tables
+    if _leaf_tables is None:
+        incidence = np.zeros((16, len(LINES)), dtype=np.int64)
+        for sq in range(16):
+            incidence[sq, list(LINE_IDS_BY_SQUARE[sq])] = 1
+        table = np.zeros(1 << 15, dtype=np.int64)
+        for w in range(1 << 15):
+            count, key = w & 7, w >> 3
+            if count == 4 and any(key >> (3 * b) & 7 in (0, 4) for b in range(4)):
+                table[w] = LEAF_WON
+            elif count == 3 and LINE_THREAT_PIECES[key & 0xFFF]:
+                table[w] = LEAF_THREAT | LINE_THREAT_PIECES[key & 0xFFF]
+        center = np.array([CENTER >> sq & 1 for sq in range(16)], dtype=np.int64)
+        _leaf_tables = (incidence, table, center)
+    return _leaf_tables
+
+def batch_leaf_value(state):
+    # Value of a depth-1 node (SearchState) with all its placements scored at once,
+    # same as the scalar negamax: a win, 0 for the last piece, a loss if every piece is poisoned
+    incidence, table, center = leaf_tables()
+    empty = FULL & ~state.occupied
+    squares = _leaf_squares.get(empty)
+    if squares is None:
+        squares = _leaf_squares[empty] = np.array(bit_indices(empty), dtype=np.intp)
+    lines = table[incidence[squares] * PIECE_LINE_WORD[state.piece] + state.lines.words]
+    totals = lines.sum(axis=1) # Won lines from LEAF_WON up, threat count in the LEAF_THREAT bits
+    if totals.max() >= LEAF_WON:
+        return float('inf')
+    if not state.available:
+        return 0
+    playable = (state.available & ~np.bitwise_or.reduce(lines, axis=1) & FULL) != 0
+    if not playable.any():
+        return -float('inf')
+    scores = totals // LEAF_THREAT * 15 + center[squares] * 3
+    return -int(scores[playable].min()) - POPCOUNT[state.occupied & CENTER] * 3
+
+EXACT, LOWER, UPPER = 0, 1, 2 # Bound type of a stored value
+TT_SIZE = 1 << 17 # Default number of entries kept by a transposition table
+TT_MIN_DEPTH = 2 # Remaining depth below which negamax doesn't use the table
+
+class TranspositionTable:
+    # Bounded hash table of search results. Every index has two slots: a depth-preferred
+    # one that keeps the deepest result, and an always-replace one for the most recent.
+    def __init__(self, size=None):
+        size = size or TT_SIZE # Read here, so a TT_SIZE set after import is used
+        buckets = 1
+        while buckets * 2 < size: # Power of two number of buckets, two slots each
+            buckets *= 2
+        self.mask = buckets - 1
+        self.slots = [None] * (2 * buckets)
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0 # Probes where the bucket was used by other positions
+
+    def probe(self, key):
+        # Returns (key, depth, value, flag, move) stored for 'key', or None
+        i = (key & self.mask) << 1
+        slots = self.slots
+        for entry in (slots[i], slots[i + 1]):
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                return entry
+        self.misses += 1
+        if slots[i] is not None or slots[i + 1] is not None:
+            self.collisions += 1
+        return None
 
+    def store(self, key, depth, value, flag, move):
+        i = (key & self.mask) << 1
+        slots = self.slots
+        deep = slots[i]
+        entry = (key, depth, value, flag, move)
+        if deep is None or deep[0] == key or depth >= deep[1]:
+            slots[i] = entry # Depth-preferred slot
+        else:
+            slots[i + 1] = entry # Always-replace slot
+
+    def clear(self):
+        self.slots = [None] * len(self.slots)
+        self.hits = self.misses = self.collisions = 0
+
+    def stats(self):
+        # Counters as a dict, handy for logs
+        used = sum(1 for entry in self.slots if entry is not None)
+        return {"size": len(self.slots), "used": used, "hits": self.hits,
+                "misses": self.misses, "collisions": self.collisions}
+
+# ---------------------------------------------------------------------------
+# Symmetries. The 32 board maps below keep the set of winning lines, and any
+# attribute permutation combined with attribute complements keeps "share an
+# attribute", so all positions obtained this way have the same game value.
+# The heuristic also scores the centre squares, which half of the maps send
+# to the border: the depth-limited search only uses the 16 that keep them.
+# ---------------------------------------------------------------------------
+def _square_map(f):
+    # Square permutation from a (row, col) -> (row, col) function
+    return tuple(4 * r2 + c2 for r in range(4) for c in range(4) for r2, c2 in [f(r, c)])
+
+def _board_symmetries():
+    # Closure of rotation, mirror, middle rows/cols swap and inner/outer swap (identity first)
+    middle = (0, 2, 1, 3)
+    inside_out = (1, 0, 3, 2)
+    generators = (
+        _square_map(lambda r, c: (c, 3 - r)),
+        _square_map(lambda r, c: (r, 3 - c)),
+        _square_map(lambda r, c: (middle[r], middle[c])),
+        _square_map(lambda r, c: (inside_out[r], inside_out[c])),
+    )
+    group = [tuple(range(16))]
+    for g in group: # The list grows while we walk it
+        for h in generators:
+            composed = tuple(h[g[sq]] for sq in range(16))
+            if composed not in group:
+                group.append(composed)
+    return tuple(group)
+
+BOARD_SYMMETRIES = _board_symmetries() # sym[sq] = square where sq is sent
+BOARD_SYMMETRIES_INV = tuple(tuple(sym.index(sq) for sq in range(16)) for sym in BOARD_SYMMETRIES)
+# Occupancy masks through each symmetry, one table per byte
+_OCC_SYMMETRIES = tuple(
+    tuple(tuple(sum(1 << sym[8 * half + b] for b in range(8) if m >> b & 1) for m in range(256)) for half in range(2))
+    for sym in BOARD_SYMMETRIES
+)
+ATTR_PERMS = tuple(itertools.permutations(range(4))) # 24 attribute permutations, identity first
+PERM_TABLES = tuple(tuple(sum((p >> b & 1) << perm[b] for b in range(4)) for p in range(16)) for perm in ATTR_PERMS)
+PERM_TABLES_INV = tuple(tuple(table.index(p) for p in range(16)) for table in PERM_TABLES)
+ALL_SYMMETRIES = tuple(range(len(BOARD_SYMMETRIES))) # Indices of BOARD_SYMMETRIES
+SEARCH_SYMMETRIES = tuple(s for s, sym in enumerate(BOARD_SYMMETRIES) # ... that keep the centre (heuristic values)
+                          if all(CENTER >> sym[sq] & 1 for sq in bit_indices(CENTER)))
+SYMMETRY_MAX_PIECES = 8 # Positions with more pieces are too rarely symmetric to be worth it
+
+def uses_symmetry(occupied):
+    # Whether positions with this occupancy are folded by SEARCH_SYMMETRIES (TT keys, root moves)
+    return POPCOUNT[occupied] <= SYMMETRY_MAX_PIECES
+
+def canonical_form(state, symmetries=ALL_SYMMETRIES):
+    # Returns (canonical BitState, transform) where transform = (symmetry, xor, permutation)
+    # sends 'state' to the smallest equivalent position: a piece p becomes PERM_TABLES[perm][p ^ xor]
+    # 'symmetries' are the board maps allowed (SEARCH_SYMMETRIES where heuristic values are shared)
+    board, occupied, available, hand, current = state
+    mapped_occ = {s: _OCC_SYMMETRIES[s][0][occupied & 255] | _OCC_SYMMETRIES[s][1][occupied >> 8] for s in symmetries}
+    best_occ = min(mapped_occ.values())
+    target_squares = bit_indices(best_occ)
+    best = None
+    for s, occ in mapped_occ.items():
+        if occ != best_occ:
+            continue
+        inv = BOARD_SYMMETRIES_INV[s]
+        seq = [] if hand is None else [hand] # Piece in hand first, then the board in square order
+        seq.extend(board >> (4 * inv[t]) & 15 for t in target_squares)
+        xor = seq[0] if seq else 0 # The first piece always becomes 0
+        seq = [p ^ xor for p in seq]
+        candidates = range(24)
+        for p in seq[1:]: # Keep the permutations giving the smallest sequence
+            if len(candidates) == 1:
+                break
+            smallest = min(PERM_TABLES[k][p] for k in candidates)
+            candidates = [k for k in candidates if PERM_TABLES[k][p] == smallest]
+        table = PERM_TABLES[candidates[0]]
+        mapped = [table[p] for p in seq]
+        if best is None or mapped < best[0]:
+            best = (mapped, s, xor, candidates[0])
+
+    mapped, s, xor, k = best
+    table = PERM_TABLES[k]
+    pieces_on_board = mapped if hand is None else mapped[1:]
+    new_board = 0
+    for t, p in zip(target_squares, pieces_on_board):
+        new_board |= p << (4 * t)
+    new_available = 0
+    for p in bit_indices(available):
+        new_available |= 1 << table[p ^ xor]
+    new_hand = None if hand is None else mapped[0]
+    return BitState(new_board, best_occ, new_available, new_hand, current), (s, xor, k)
+
+def canonical_hash(state, symmetries=ALL_SYMMETRIES):
+    # Zobrist hash shared by all the symmetric versions of 'state'
+    return zobrist_hash(canonical_form(state, symmetries)[0])
+
+def transform_move(move, transform):
+    # Maps a (square, piece) move of a position into its canonical frame
+    sq, p = move
+    s, xor, k = transform
+    return (None if sq is None else BOARD_SYMMETRIES[s][sq],
+            None if p is None else PERM_TABLES[k][p ^ xor])
+
+def untransform_move(move, transform):
+    # Maps a (square, piece) move of the canonical frame back to the original position
+    sq, p = move
+    s, xor, k = transform
+    return (None if sq is None else BOARD_SYMMETRIES_INV[s][sq],
+            None if p is None else PERM_TABLES_INV[k][p] ^ xor)
+
+SEARCH_TIME_BUDGET = 2.5 # Seconds we allow ourselves per move (the server gives 3)
+MAX_SEARCH_DEPTH = 15
+SEARCH_ALGORITHMS = ("alphabeta", "pvs", "mtdf")
+SEARCH_ALGORITHM = "alphabeta" # Default of game(), one of SEARCH_ALGORITHMS
+NODE_CHECK_MASK = 255 # The clock is read every 256 nodes
+PONDER_CHECK_MASK = 7 # ... every 8 nodes when pondering, so a request stops it at once
+PONDER_TIME_LIMIT = 10.0 # Seconds a ponder search runs without a request (the match may be over)
+
+class SearchTimeout(Exception):
+    # Raised inside the search when the context's deadline is reached
+    pass
+
+class SearchContext:
+    # Search data kept between our consecutive moves of one match
+    def __init__(self, tt_size=None):
+        self.tt = TranspositionTable(tt_size) # TT_SIZE entries by default
+        self.history = [[0] * 16 for _ in range(16)] # [square][piece given] -> cutoff score
+        self.pv = [] # Principal variation of the last search, as (square, piece given) moves
+        self.pieces_on_board = 0 # Pieces on the board at our last move of the match
+        self.last_used = time.monotonic()
+        self.match_id = uuid.uuid4().hex[:12] # Names the match in the logs
+        self.deadline = float('inf') # time.monotonic() value at which the search gives up
+        self.check_mask = NODE_CHECK_MASK
+        self.nodes = 0
+        self.aborted = False # True if the last find_best_negamax_move ran out of time
+        self.best_score = None # Score of the last find_best_negamax_move
+        self.root_scores = {} # (square, piece given) -> score at the last searched depth
+        self.iterations = [] # One dict per depth of the last iterative deepening
+        self.endgame_tt = TranspositionTable(ENDGAME_CACHE_SIZE) # Exact values, see solve()
+        self.proof_table = ProofTable(PROOF_TABLE_SIZE) # Proof numbers, see prove_win()
+        self.proof = None # Result and sizes of the last prove_win
+        self.killers = [[None, None] for _ in range(17)] # [pieces on board] -> last two cutoff moves
+        self.square_history = [0] * 16 # history summed over the pieces given, orders the placements
+        self.cutoffs = 0 # Beta cutoffs in negamax
+        self.first_move_cutoffs = 0 # ... of which on the first move searched (measures the ordering)
+        self.leaf_batching = LEAF_BATCHING and np is not None
+        self.algorithm = SEARCH_ALGORITHM # See SEARCH_ALGORITHMS; "pvs" makes negamax use null windows
+
+    def new_search(self):
+        # Called once per move: our last move and the opponent's reply are now played,
+        # and the history is aged so old cutoffs count less than new ones
+        self.pv = self.pv[2:]
+        self.root_scores = {}
+        self.best_score = None
+        self.proof = None
+        for row in self.history:
+            for p in range(16):
+                row[p] >>= 1
+        self.square_history = [sum(row) for row in self.history]
+
+    def ponder_context(self):
+        # Context of a ponder search: shares the tables, history and killers, keeps its own root data
+        ponder = copy.copy(self)
+        ponder.pv = []
+        ponder.root_scores = {}
+        ponder.iterations = []
+        ponder.best_score = None
+        ponder.deadline = time.monotonic() + PONDER_TIME_LIMIT
+        ponder.check_mask = PONDER_CHECK_MASK
+        return ponder
+
+MATCH_CONTEXTS = OrderedDict() # players tuple -> SearchContext, least recently used first
+MAX_MATCH_CONTEXTS = 4 # Matches played at the same time that keep their context
+MATCH_IDLE_TIMEOUT = 120.0 # Seconds without a request after which a match is considered over
+_match_contexts_lock = threading.Lock()
+
+def match_context(state, bits):
+    # Returns the SearchContext of the match of 'state', creating it if needed
+    players = tuple(state.get("players") or ())
+    pieces_on_board = POPCOUNT[bits.occupied]
+    now = time.monotonic()
+    with _match_contexts_lock:
+        for key in [key for key, ctx in MATCH_CONTEXTS.items() if now - ctx.last_used > MATCH_IDLE_TIMEOUT]:
+            del MATCH_CONTEXTS[key]
+        ctx = MATCH_CONTEXTS.pop(players, None)
+        if ctx is None or pieces_on_board < ctx.pieces_on_board: # Fewer pieces: new match, same players
+            ctx = SearchContext()
+        ctx.pieces_on_board = pieces_on_board
+        ctx.last_used = now
+        MATCH_CONTEXTS[players] = ctx
+        while len(MATCH_CONTEXTS) > MAX_MATCH_CONTEXTS:
+            MATCH_CONTEXTS.popitem(last=False)
+    return ctx
+
+def end_match(players):
+    # Forgets the context of a finished match
+    with _match_contexts_lock:
+        MATCH_CONTEXTS.pop(tuple(players or ()), None)
+
+def order_placements(squares, tt_move, killers, square_history):
+    # Table move's square first, then the killers' squares, then by history
+    first = []
+    for move in (tt_move, killers[0], killers[1]):
+        if move is not None and move[0] in squares and move[0] not in first:
+            first.append(move[0])
+    rest = sorted((sq for sq in squares if sq not in first), key=square_history.__getitem__, reverse=True)
+    return first + rest
+
+def order_pieces(pieces, sq, tt_move, killers, history):
+    # Pieces to give after placing on 'sq': table and killer moves first, then by history
+    first = []
+    for move in (tt_move, killers[0], killers[1]):
+        if move is not None and move[0] == sq and move[1] in pieces and move[1] not in first:
+            first.append(move[1])
+    rest = sorted((p for p in pieces if p not in first), key=history.__getitem__, reverse=True)
+    return first + rest
+
+def negamax(state, player, depth, alpha=-float('inf'), beta=float('inf'), ctx=None):
+    # Implements Negamax with alpha-beta pruning, score seen by the side to move
+    # 'state' is a SearchState, changed in place and restored before returning (a BitState
+    # is copied into one first), 'ctx' an optional SearchContext
+    if not isinstance(state, SearchState):
+        state = SearchState(state)
+    occupied = state.occupied
+    available = state.available
+
+    if ctx is not None:
+        ctx.nodes += 1
+        if not ctx.nodes & ctx.check_mask and time.monotonic() >= ctx.deadline:
+            raise SearchTimeout()
+
+    if occupied == FULL: # Full board: wins are caught when placing, so it's a draw
+        return 0
+
+    lines = state.lines
+    if depth == 0: # heuristic call if depth is 0
+        return lines.evaluate(occupied)
+    if depth == 1 and ctx is not None and ctx.leaf_batching:
+        return batch_leaf_value(state)
+
+    alpha_orig = alpha
+    tt = None if ctx is None or depth < TT_MIN_DEPTH else ctx.tt # Cheap subtrees are not worth a table slot
+    transform = None
+    tt_move = None
+    if tt is not None:
+        tt_key = state.key
+        if uses_symmetry(occupied): # Symmetric positions share their entry
+            canonical, transform = canonical_form(state.bits(), SEARCH_SYMMETRIES)
+            tt_key = zobrist_hash(canonical)
+        entry = tt.probe(tt_key)
+        if entry is not None:
+            _, tt_depth, tt_value, tt_flag, tt_move = entry
+            if tt_depth >= depth:
+                if tt_flag == EXACT:
+                    return tt_value
+                if tt_flag == LOWER:
+                    alpha = max(alpha, tt_value)
+                else:
+                    beta = min(beta, tt_value)
+                if alpha >= beta:
+                    return tt_value
+            if tt_move is not None and transform is not None:
+                tt_move = untransform_move(tt_move, transform)
 
     value = -float('inf') # Stores the maximum score found for player_at_node.
+    best_move = None
+    pvs = ctx is not None and ctx.algorithm == "pvs"
+    searched = False # PVS: the first child gets the full window, the others a null window
+    opponent = 1 - state.current
+    available_to_give = bit_indices(available)
+    ply = POPCOUNT[occupied]
+
+    win = winning_square(state) # Nothing can do better than a win, whatever the order
+    if win is not None:
+        value = float('inf')
+        best_move = (win, None)
+        placements = ()
+    elif ctx is None:
+        placements = bit_indices(FULL & ~occupied)
+    else:
+        placements = order_placements(bit_indices(FULL & ~occupied), tt_move, ctx.killers[ply], ctx.square_history)
 
-    piece_to_place = state["piece"] # Piece player_at_node must place.
-    board = deepcopy(state["board"]) # Work on a copy of the board.
-    current_player_index_str = str(state["current"]) # Should be same as player_at_node.
-    opponent_player_index_str = str(1 - int(current_player_index_str))
-
-
-    placed_pieces_fs = {p for p in board if p is not None}
-    if piece_to_place:
-         placed_pieces_fs.add(piece_to_place) 
-
-    # Determine available pieces to give to the opponent and position unused
-    pieces = piece()
-    res = []
-    for i, elem in enumerate(state["board"]):
-        if elem is None:
-            res.append(i)
-        if elem in pieces:
-            pieces.remove(elem)
-    empty_positions = res
-    available_to_give = pieces 
-
-
-    for i in empty_positions: # Iterate over possible placement positions
-        new_board = list(board) # Create a aonther board for this move
-        new_board[i] = piece_to_place # Place the piece
-
-
-        if winnerF(new_board) is True: # If this placement wins for player_at_node
-
-            value = max(value, float('inf'))
-
-            alpha = max(alpha, value)
-            if alpha >= beta:
-                 return value # Pruning if win is found and good enough
-            continue # Try next placement if not pruning
-
-
-        # If not an immediate win, consider pieces to give to opponent
+    for n, i in enumerate(placements): # Iterate over possible placement positions
+        # Not an immediate win (see winning_square), consider pieces to give to opponent
         if not available_to_give: # No pieces left to give.
-             current_eval = 0 # Draw
+            current_eval = 0 # Draw
+            current_piece = None
+            pieces = ()
         else:
-             best_recursive_score = -float('inf')
-
-             for next_piece_to_give in available_to_give:
-                next_state = {
-                    "players": state["players"],
-                    "current": opponent_player_index_str, 
-                    "board": tuple(new_board),
-                    "piece": next_piece_to_give 
-                }
+            current_eval = -float('inf')
+            current_piece = None
+            state.place(i)
+            safe = available & ~lines.unsafe()
+            if not safe: # Every piece lets the opponent win on the spot
+                current_piece = available_to_give[0]
+                pieces = ()
+            elif depth == 1: # The leaves only look at the board: same value whatever the piece given
+                current_piece = bit_indices(safe)[0]
+                current_eval = -lines.evaluate(state.occupied)
+                pieces = ()
+            else: # Poisoned pieces are never searched: they lose at once
+                pieces = bit_indices(safe)
+                if ctx is not None and len(pieces) > 1:
+                    pieces = order_pieces(pieces, i, tt_move, ctx.killers[ply], ctx.history[i])
+            for next_piece_to_give in pieces:
+                state.give(next_piece_to_give)
                 # Recursive call for opponent. Score is from opponent's view. Negate for player_at_node's view
-                eval_opponent = -negamax(next_state, opponent_player_index_str, depth - 1, -beta, -alpha)
-                best_recursive_score = max(best_recursive_score, eval_opponent)
-
-             current_eval = best_recursive_score # Update best score for player_at_node.
-
-        value = max(value, current_eval)
-
+                if pvs and searched and alpha > -float('inf') and alpha + 1 < beta:
+                    eval_opponent = -negamax(state, opponent, depth - 1, -alpha - 1, -alpha, ctx)
+                    if alpha < eval_opponent < beta: # Better than alpha after all: exact value needed
+                        eval_opponent = -negamax(state, opponent, depth - 1, -beta, -alpha, ctx)
+                else:
+                    eval_opponent = -negamax(state, opponent, depth - 1, -beta, -alpha, ctx)
+                searched = True
+                state.take_back(next_piece_to_give)
+                if eval_opponent > current_eval:
+                    current_eval = eval_opponent
+                    current_piece = next_piece_to_give
+                    if current_eval >= beta: # The other pieces can't make this placement worse
+                        break
+                    # Each (placement, piece) is a move of its own: the next pieces get the tighter window
+                    alpha = max(alpha, current_eval)
+            state.unplace(i)
+
+        if current_eval > value:
+            value = current_eval
+            best_move = (i, current_piece)
         alpha = max(alpha, value)
         if alpha >= beta:
-            break 
+            if ctx is not None:
+                ctx.cutoffs += 1
+                if n == 0 and (not pieces or current_piece == pieces[0]):
+                    ctx.first_move_cutoffs += 1
+                if current_piece is not None:
+                    ctx.history[i][current_piece] += depth * depth
+                    ctx.square_history[i] += depth * depth
+                    killers = ctx.killers[ply]
+                    if killers[0] != best_move:
+                        killers[1] = killers[0]
+                        killers[0] = best_move
+            break
+
+    if tt is not None:
+        if value <= alpha_orig:
+            flag = UPPER
+        elif value >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        if transform is not None and best_move is not None:
+            best_move = transform_move(best_move, transform) # Stored in the canonical frame
+        tt.store(tt_key, depth, value, flag, best_move)
+    return value
+
+def table_move(state, tt, key=None):
+    # Best move stored in 'tt' for 'state', in the frame of 'state' (None if unknown)
+    if key is None:
+        key = zobrist_hash(state)
+    transform = None
+    if uses_symmetry(state[1]):
+        canonical, transform = canonical_form(state, SEARCH_SYMMETRIES)
+        key = zobrist_hash(canonical)
+    entry = tt.probe(key)
+    if entry is None or entry[4] is None:
+        return None
+    return entry[4] if transform is None else untransform_move(entry[4], transform)
+
+def principal_variation(state, move, tt, max_length=16):
+    # Follows the best moves stored in 'tt' from the root move 'move'
+    pv = []
+    board, occupied, available, piece_to_place, current = state
+    while move is not None and len(pv) < max_length:
+        sq, given = move
+        if sq is None or occupied >> sq & 1 or given is None or not available >> given & 1:
+            break # Stale or foreign entry
+        pv.append(move)
+        board |= piece_to_place << (4 * sq)
+        occupied |= 1 << sq
+        if wins_at(board, occupied, sq):
+            break
+        available &= ~(1 << given)
+        piece_to_place = given
+        current = 1 - current
+        move = table_move((board, occupied, available, piece_to_place, current), tt)
+    return pv
+
+def winning_square(state):
+    # First square where the piece in hand wins on the spot, or None (BitState or SearchState)
+    board, occupied, piece_to_place = state.board, state.occupied, state.piece
+    for i in bit_indices(FULL & ~occupied):
+        if wins_at(board | (piece_to_place << (4 * i)), occupied | (1 << i), i):
+            return i
+    return None
+
+def root_moves(state):
+    # Lists the (square, piece to give) moves of the root, one per symmetry class early on
+    # (a placement that wins on the spot is not listed, see winning_square, nor are the
+    # poisoned pieces letting the opponent win, unless all the pieces are)
+    board, occupied, available, piece_to_place, current = state
+    opponent = 1 - current
+    available_to_give = bit_indices(available)
+    dedupe = uses_symmetry(occupied)
+    seen_placements = set()
+    seen_children = set()
+    moves = []
+    for i in bit_indices(FULL & ~occupied):
+        new_board = board | (piece_to_place << (4 * i))
+        new_occupied = occupied | (1 << i)
+        if dedupe:
+            placement_key = canonical_hash((new_board, new_occupied, available, None, opponent), SEARCH_SYMMETRIES)
+            if placement_key in seen_placements:
+                continue
+            seen_placements.add(placement_key)
+        if not available_to_give: # Last piece placed
+            moves.append((i, None))
+        safe = available & ~unsafe_pieces(new_board, new_occupied)
+        for next_piece in bit_indices(safe) if safe else available_to_give: # Poisoned pieces only if all are
+            if dedupe:
+                child_key = canonical_hash((new_board, new_occupied, available & ~(1 << next_piece), next_piece, opponent),
+                                           SEARCH_SYMMETRIES)
+                if child_key in seen_children:
+                    continue
+                seen_children.add(child_key)
+            moves.append((i, next_piece))
+    return moves
+
+def search_root_moves(state, depth, moves, ctx, alpha=-float('inf'), beta=float('inf')):
+    # Searches the root 'moves' in order with a shared alpha
+    # Returns ({move: score}, timed_out); scores outside the window are bounds
+    search_state = SearchState(state) # Every root move is made and unmade on this one
+    opponent = 1 - search_state.current
+    pvs = ctx is not None and ctx.algorithm == "pvs"
+    scores = {}
+    best_score = -float('inf')
+    try:
+        for move in moves:
+            if move[1] is None: # Last piece placed without winning: draw
+                eval_opponent = 0
+            else:
+                search_state.make(move)
+                # eval_opponent is score from opponent's view. Negate for player's view
+                bound = max(alpha, best_score)
+                if pvs and bound > -float('inf') and bound + 1 < beta: # Only has to prove it's no better
+                    eval_opponent = -negamax(search_state, opponent, depth - 1, -bound - 1, -bound, ctx)
+                    if bound < eval_opponent < beta:
+                        eval_opponent = -negamax(search_state, opponent, depth - 1, -beta, -bound, ctx)
+                else:
+                    eval_opponent = -negamax(search_state, opponent, depth - 1, -beta, -bound, ctx)
+                search_state.unmake(move)
+            scores[move] = eval_opponent
+            if eval_opponent > best_score:
+                best_score = eval_opponent
+                if best_score >= beta: # Fail high, the caller widens the window
+                    break
+    except SearchTimeout: # search_state is left mid-line, it isn't used again
+        return scores, True
+    return scores, False
+
+# ---------------------------------------------------------------------------
+# Root-parallel search: the root moves are dealt between worker processes
+# started once with start_search_pool(). Each worker keeps one context (and
+# transposition table) per match between searches, and stops at the same
+# deadline: a chunk that waited in the queue only gets the time left.
+# ---------------------------------------------------------------------------
+SEARCH_POOL = None # Started by start_search_pool()
+SEARCH_POOL_WORKERS = 0
+POOL_GRACE = 0.1 # Seconds we wait for the workers after the deadline
+_worker_contexts = OrderedDict() # match id -> SearchContext of a worker process, least recently used first
+
+def _worker_ready():
+    return os.getpid()
+
+def start_search_pool(workers=None):
+    # Starts the search worker processes (once, at program start) and returns the pool
+    global SEARCH_POOL, SEARCH_POOL_WORKERS
+    if SEARCH_POOL is None:
+        workers = workers or os.cpu_count() or 1
+        SEARCH_POOL = ProcessPoolExecutor(max_workers=workers)
+        SEARCH_POOL_WORKERS = workers
+        wait([SEARCH_POOL.submit(_worker_ready) for _ in range(workers)]) # Spawn them now, not during a move
+    return SEARCH_POOL
+
+def stop_search_pool():
+    global SEARCH_POOL
+    if SEARCH_POOL is not None:
+        SEARCH_POOL.shutdown(cancel_futures=True)
+        SEARCH_POOL = None
+
+def _worker_match_context(match_id):
+    # The worker's context for the match 'match_id', evicted like MATCH_CONTEXTS
+    now = time.monotonic()
+    for key in [key for key, ctx in _worker_contexts.items() if now - ctx.last_used > MATCH_IDLE_TIMEOUT]:
+        del _worker_contexts[key]
+    ctx = _worker_contexts.pop(match_id, None) or SearchContext()
+    ctx.last_used = now
+    _worker_contexts[match_id] = ctx
+    while len(_worker_contexts) > MAX_MATCH_CONTEXTS:
+        _worker_contexts.popitem(last=False)
+    return ctx
+
+def _search_root_chunk(state, depth, moves, deadline, alpha, beta, algorithm="alphabeta", match_id=None):
+    # Runs in a worker process: search_root_moves with the worker's context of the match
+    # 'deadline' is a time.time() value, the same for every process whenever the chunk starts
+    # Returns (scores, timed out, counters, principal variation of the chunk's best move)
+    ctx = _worker_match_context(match_id)
+    ctx.deadline = time.monotonic() + deadline - time.time()
+    ctx.algorithm = algorithm
+    counters = search_counters(ctx)
+    if time.monotonic() >= ctx.deadline: # Waited in the queue until the end
+        return [], True, (0, 0, 0, 0, 0), []
+    scores, timed_out = search_root_moves(state, depth, moves, ctx, alpha, beta)
+    best = max(scores, key=scores.get, default=None) # The first of the best ones, in search order
+    pv = [] if best is None else principal_variation(state, best, ctx.tt)
+    return list(scores.items()), timed_out, tuple(b - a for a, b in zip(counters, search_counters(ctx))), pv
+
+def parallel_root_search(pool, state, depth, moves, ctx, alpha=-float('inf'), beta=float('inf'), workers=None):
+    # search_root_moves spread over the pool. Moves are dealt round-robin so every worker
+    # starts with some of the best ones; returns ({move: score}, timed_out, {move: pv}), with
+    # the principal variation of the best move of each worker (the main table doesn't have them)
+    workers = workers or SEARCH_POOL_WORKERS or os.cpu_count() or 1
+    chunks = [moves[k::workers] for k in range(workers) if moves[k::workers]]
+    time_left = ctx.deadline - time.monotonic()
+    if time_left <= 0:
+        raise SearchTimeout()
+    state = tuple(state)
+    deadline = time.time() + time_left
+    futures = [pool.submit(_search_root_chunk, state, depth, chunk, deadline, alpha, beta, ctx.algorithm, ctx.match_id)
+               for chunk in chunks]
+    done, not_done = wait(futures, timeout=None if time_left == float('inf') else time_left + POOL_GRACE)
+    scores = {}
+    pvs = {}
+    timed_out = bool(not_done)
+    for future in done:
+        chunk_scores, chunk_timed_out, (nodes, cutoffs, first_move_cutoffs, hits, probes), pv = future.result()
+        scores.update(chunk_scores)
+        if pv:
+            pvs[pv[0]] = pv
+        timed_out = timed_out or chunk_timed_out
+        ctx.nodes += nodes # The workers' counters are added to ours, so the trace covers the whole search
+        ctx.cutoffs += cutoffs
+        ctx.first_move_cutoffs += first_move_cutoffs
+        ctx.tt.hits += hits
+        ctx.tt.misses += probes - hits
+    return scores, timed_out, pvs
+
+def search_counters(ctx):
+    # (nodes, cutoffs, first move cutoffs, table hits, table probes) so far, differences give one search
+    tt = ctx.tt
+    return ctx.nodes, ctx.cutoffs, ctx.first_move_cutoffs, tt.hits, tt.hits + tt.misses
+
+def find_best_negamax_move(state, player, depth, ctx=None, alpha=-float('inf'), beta=float('inf'), pool=None):
+    # Finds the best (position to place, piece id to give) of a BitState using Negamax evaluation
+    # With a context, root moves are ordered by the previous depth's scores, and running out of
+    # time returns the best fully searched root move (ctx.aborted is set) or raises SearchTimeout.
+    # With a process pool (see start_search_pool) the root moves are shared between the workers.
+    board, occupied, available, piece_to_place, current = state
+    empty_positions = bit_indices(FULL & ~occupied)
+    available_to_give = bit_indices(available)
+
+    if not occupied and piece_to_place is None: # Starting game useless to use AI
+        return None, random.choice(available_to_give)
+
+    if not occupied: # Second move useless to use AI
+        return random.choice(empty_positions), random.choice(available_to_give)
+
+    if not empty_positions: return None, None # No place to move
 
-    return value 
+    win = winning_square(state)
+    if win is not None:
+        best_piece = random.choice(available_to_give) if available_to_give else None
+        if ctx is not None:
+            ctx.aborted = False
+            ctx.best_score = float('inf')
+            ctx.pv = [(win, best_piece)]
+        return win, best_piece
+
+    moves = root_moves(state)
+
+    if ctx is not None:
+        ctx.aborted = False
+        # Previous best first, then by the score each move got at the previous depth
+        scores = ctx.root_scores
+        pv_move = tuple(ctx.pv[0]) if ctx.pv else None
+        moves.sort(key=lambda m: (m != pv_move, -scores.get(m, -float('inf'))))
+        ctx.root_scores = scores = {}
+    else:
+        scores = {}
 
-def find_best_negamax_move(state, player, depth):
-    # Finds the best (position to place, piece to give) using Negamax evaluation
+    pvs = {}
+    if pool is not None and ctx is not None and len(moves) > 1:
+        searched, timed_out, pvs = parallel_root_search(pool, state, depth, moves, ctx, alpha, beta)
+    else:
+        searched, timed_out = search_root_moves(state, depth, moves, ctx, alpha, beta)
+    scores.update(searched)
+    if timed_out:
+        if moves[0] not in scores: # Without the previous best, the partial result can't be trusted
+            raise SearchTimeout()
+        ctx.aborted = True # Keep the best of the root moves searched so far
+
+    # Best score, the earliest move in the search order on ties (whatever the completion order)
     best_score = -float('inf')
     best_move_pos = None
     best_piece_to_give = None
+    for move in moves:
+        if move in scores and (scores[move] > best_score or best_move_pos is None):
+            best_score = scores[move]
+            best_move_pos, best_piece_to_give = move
 
-    piece_to_place = state["piece"] # Piece current `player` must place
-    board = state["board"]
-    current_player_index_str = str(state["current"])
-    opponent_player_index_str = str(1 - int(current_player_index_str))
-    # Determine available pieces to give and empty positions
-    pieces = piece()
-    res = []
-    for i, elem in enumerate(state["board"]):
-        if elem is None:
-            res.append(i) # Add empty pos
-        if elem in pieces:
-            pieces.remove(elem) # Remove on-board pieces 
-    try:
-        pieces.remove(state["piece"]) # Check before removing
-    except:
-        random.choice(pieces)
-    empty_positions = res
-    available_to_give = pieces 
-
-    if state["board"] == [None]*16 and state["piece"] is None: # Startint game useless to use AI
-        return None, random.choice(pieces)
-    
-    if state["board"] == [None]*16 and state["piece"] is not None: # Second move useless to use AI
-        return random.choice(res), random.choice(pieces)
-    
-    def winnerF(board):
-        for i in range(4):
-            if same(getLine(board, i)):
-                return True
-            if same(getColumn(board, i)):
-                return True
-        if same(getDiagonal(board, 1)):
-            return True
-        return same(getDiagonal(board, -1))
-    
-    if not empty_positions: return None, None # No place to move
-
-
-    for i in empty_positions: # Iterate over possible placements
-        new_board = list(board)
-        new_board[i] = piece_to_place # Place the piece
+    # Security if bug in algorithm
+    if best_piece_to_give is None and available_to_give: # If no piece chosen and pieces are available
+        best_piece_to_give = available_to_give[0] # Pick first available
 
+    if ctx is not None:
+        ctx.best_score = best_score
+        best_move = (best_move_pos, best_piece_to_give)
+        ctx.pv = pvs.get(best_move) or principal_variation(state, best_move, ctx.tt)
+    return best_move_pos, best_piece_to_give
 
-        if winnerF(new_board) is True:
-             move_score = float('inf')
-             try:
-                chosen_piece_for_next = random.choice(available_to_give)
-             except:
-                move_score = 0
-                chosen_piece_for_next = None 
+# ---------------------------------------------------------------------------
+# Exact endgame solver. Once few squares are left the whole tree is searched
+# without heuristic: a win on a board with e empty squares (before placing)
+# scores ENDGAME_WIN + e, so quicker wins and slower losses score better.
+# ---------------------------------------------------------------------------
+ENDGAME_EMPTY_SQUARES = 8 # game() solves exactly from this many empty squares
+ENDGAME_WIN = 100
+ENDGAME_TIME_SHARE = 0.6 # Part of the move's time the solver may use before falling back
+ENDGAME_CACHE_SIZE = 1 << 18
+
+def solve(state, ctx, alpha=-float('inf'), beta=float('inf')):
+    # Exact value of a SearchState for the side to move (see ENDGAME_WIN), restored on return
+    occupied = state.occupied
+    available = state.available
+    ctx.nodes += 1
+    if not ctx.nodes & ctx.check_mask and time.monotonic() >= ctx.deadline:
+        raise SearchTimeout()
+
+    empties = bit_indices(FULL & ~occupied)
+    e = len(empties)
+    if winning_square(state) is not None:
+        return ENDGAME_WIN + e
+    if not available: # Last piece placed without winning
+        return 0
+
+    cache = ctx.endgame_tt
+    key = state.key
+    entry = cache.probe(key)
+    alpha_orig = alpha
+    if entry is not None:
+        _, _, value, flag, _ = entry
+        if flag == EXACT:
+            return value
+        if flag == LOWER:
+            alpha = max(alpha, value)
         else:
+            beta = min(beta, value)
+        if alpha >= beta:
+            return value
+    # No immediate win: at best we win two plies later
+    if alpha >= ENDGAME_WIN + e - 2:
+        return ENDGAME_WIN + e - 2
+
+    best = -float('inf')
+    best_move = None
+    for s in empties:
+        state.place(s)
+        safe = bit_indices(available & ~state.lines.unsafe())
+        if not safe: # Every piece lets the opponent win right away
+            if -(ENDGAME_WIN + e - 1) > best:
+                best = -(ENDGAME_WIN + e - 1)
+                best_move = (s, bit_indices(available)[0])
+        for p in safe:
+            state.give(p)
+            value = -solve(state, ctx, -beta, -max(alpha, best))
+            state.take_back(p)
+            if value > best:
+                best = value
+                best_move = (s, p)
+                if best >= beta:
+                    break
+        state.unplace(s)
+        if best >= beta:
+            break
+
+    flag = UPPER if best <= alpha_orig else LOWER if best >= beta else EXACT
+    cache.store(key, 0, best, flag, best_move)
+    return best
+
+def solve_endgame(state, ctx):
+    # Best (position, piece id) of a BitState by exact search; ctx.best_score gets its value
+    e = POPCOUNT[FULL & ~state.occupied]
+    available = state.available
+    win = winning_square(state)
+    if win is not None:
+        ctx.best_score = ENDGAME_WIN + e
+        return win, (bit_indices(available)[0] if available else None)
+    search_state = SearchState(state)
+    best = -float('inf')
+    best_move = None
+    for s in bit_indices(FULL & ~state.occupied):
+        if not available: # Last piece, no win: draw
+            if 0 > best:
+                best, best_move = 0, (s, None)
+            continue
+        search_state.place(s)
+        unsafe = search_state.lines.unsafe()
+        for p in bit_indices(available):
+            if unsafe >> p & 1:
+                value = -(ENDGAME_WIN + e - 1)
+            else:
+                search_state.give(p)
+                value = -solve(search_state, ctx, -float('inf'), -best)
+                search_state.take_back(p)
+            if value > best:
+                best, best_move = value, (s, p)
+        search_state.unplace(s)
+    ctx.best_score = best
+    return best_move
+
+# ---------------------------------------------------------------------------
+# Proof-number search (df-pn). Proves or disproves a forced win of the side
+# to move, with no depth limit and no heuristic. Positions where that side
+# moves are OR nodes (one winning move is enough) and the opponent's are AND
+# nodes (every reply must lose). A node's proof number is the least number of
+# leaves still to prove for a win, its disproof number the same for "no win",
+# a draw included. The depth-first variant searches a child until its numbers
+# pass thresholds derived from its siblings, and keeps them in a ProofTable.
+# ---------------------------------------------------------------------------
+PROOF_SEARCH = True # game() looks for a forced win before the depth-limited search
+PROOF_MIN_PIECES = 6 # ... with at least this many pieces on the board (fewer hardly ever finish in time)
+PROOF_TIME_SHARE = 0.25 # Part of the move's time the proof search may use
+PROOF_TABLE_SIZE = 1 << 17
+PROOF_INF = 1 << 30 # Proof or disproof number of a solved node
+
+class ProofTable(TranspositionTable):
+    # Same buckets as the transposition table, entries are (key, work, pn, dn, move, size):
+    # the nodes spent under the entry play the part of the depth in the replacement, and
+    # 'size' is the proof (or disproof) tree size of a solved node
+    def __init__(self, size=None):
+        super().__init__(size or PROOF_TABLE_SIZE)
+        self.attacker = None # Player whose win the entries are about
+
+    def store(self, key, work, pn, dn, move, size=1):
+        i = (key & self.mask) << 1
+        slots = self.slots
+        deep = slots[i]
+        entry = (key, work, pn, dn, move, size)
+        if deep is None or deep[0] == key or work >= deep[1]:
+            slots[i] = entry # Most work slot
+        else:
+            slots[i + 1] = entry # Always-replace slot
+
+def proof_moves(state):
+    # The (square, piece to give) moves of a SearchState that don't hand the opponent a win
+    moves = []
+    available = state.available
+    for s in bit_indices(FULL & ~state.occupied):
+        state.place(s)
+        safe = available & ~state.lines.unsafe()
+        state.unplace(s)
+        moves.extend((s, p) for p in bit_indices(safe))
+    return moves
+
+def _dfpn(state, attacker, th_pn, th_dn, ctx, table):
+    # Searches a SearchState until its proof number reaches th_pn or its disproof number th_dn,
+    # stores its numbers in 'table' and returns them as (pn, dn)
+    ctx.nodes += 1
+    if not ctx.nodes & ctx.check_mask and time.monotonic() >= ctx.deadline:
+        raise SearchTimeout()
+    key = state.key
+    or_node = state.current == attacker
+    if winning_square(state) is not None: # The side to move wins on the spot
+        pn, dn = (0, PROOF_INF) if or_node else (PROOF_INF, 0)
+        table.store(key, 1, pn, dn, None)
+        return pn, dn
+    moves = proof_moves(state)
+    if not moves: # No piece left (a draw), or every piece lets the opponent win
+        pn, dn = (0, PROOF_INF) if state.available and not or_node else (PROOF_INF, 0)
+        table.store(key, 1, pn, dn, None)
+        return pn, dn
+    children = []
+    for move in moves:
+        state.make(move)
+        children.append(state.key)
+        state.unmake(move)
+
+    start = ctx.nodes
+    mine = 0 if or_node else 1 # Index of the number the mover wants to bring to zero
+    while True:
+        numbers = [] # (pn, dn, size) of every child, (1, 1, 1) when unknown
+        for child in children:
+            entry = table.probe(child)
+            numbers.append((1, 1, 1) if entry is None else (entry[2], entry[3], entry[5]))
+        best, first, second = 0, PROOF_INF + 1, PROOF_INF + 1
+        for n, number in enumerate(numbers):
+            if number[mine] < first:
+                best, first, second = n, number[mine], first
+            elif number[mine] < second:
+                second = number[mine]
+        total = min(PROOF_INF, sum(number[1 - mine] for number in numbers))
+        pn, dn = (first, total) if or_node else (total, first)
+        if pn >= th_pn or dn >= th_dn:
+            break
+        child_pn, child_dn, _ = numbers[best]
+        if or_node:
+            child_pn, child_dn = min(th_pn, second + 1), th_dn - dn + child_dn
+        else:
+            child_pn, child_dn = th_pn - pn + child_pn, min(th_dn, second + 1)
+        state.make(moves[best])
+        _dfpn(state, attacker, child_pn, child_dn, ctx, table)
+        state.unmake(moves[best])
+    if first == 0: # Solved by the mover's choice alone
+        size = 1 + numbers[best][2]
+    elif pn == 0 or dn == 0: # Solved whatever the mover does: every child is in the tree
+        size = 1 + sum(number[2] for number in numbers)
+    else:
+        size = 1
+    table.store(key, ctx.nodes - start + 1, pn, dn, moves[best], size)
+    return pn, dn
+
+def prove_win(bits, ctx):
+    # df-pn search for a forced win of the side to move of a BitState, until ctx.deadline
+    # Returns the winning (position, piece id) once proven, None once disproven (a draw or a
+    # loss with best play); raises SearchTimeout before. ctx.proof gets the search's sizes.
+    table = ctx.proof_table
+    if table.attacker != bits.current: # The entries are about the other player's win
+        table.clear()
+        table.attacker = bits.current
+    state = SearchState(bits)
+    start_nodes, started = ctx.nodes, time.monotonic()
+    ctx.proof = {"result": None, "nodes": 0, "proof_size": 0, "seconds": 0.0}
+    try:
+        pn, dn = _dfpn(state, bits.current, PROOF_INF, PROOF_INF, ctx, table)
+    finally:
+        ctx.proof["nodes"] = ctx.nodes - start_nodes
+        ctx.proof["seconds"] = time.monotonic() - started
+    entry = table.probe(state.key)
+    ctx.proof["result"] = pn == 0
+    ctx.proof["proof_size"] = entry[5] if entry is not None else 0
+    if pn != 0:
+        return None
+    win = winning_square(state)
+    if win is not None:
+        return win, (bit_indices(bits.available)[0] if bits.available else None)
+    return entry[4]
+
+# ---------------------------------------------------------------------------
+# Perft: counts the game tree without evaluating it, to check the move
+# generation (and make/unmake) against a reference and to time it alone.
+# A move is a placement and the piece given; a placement that wins, or the
+# last piece placed, is one move (square, None) ending the game. At the very
+# start the only moves are the pieces that can be given, (None, piece).
+# ---------------------------------------------------------------------------
+def perft(state, depth, divide=False):
+    # Number of move sequences of length 'depth' from a BitState
+    # With divide=True, returns {move: count} for the moves of 'state' instead
+    search_state = SearchState(state)
+    if not divide:
+        return _perft(search_state, depth)
+    counts = {}
+    for sq, p in perft_moves(search_state):
+        if sq is not None:
+            search_state.place(sq)
+        search_state.give(p)
+        counts[(sq, p)] = _perft(search_state, depth - 1)
+        search_state.take_back(p)
+        if sq is not None:
+            search_state.unplace(sq)
+    return counts
+
+def perft_moves(state):
+    # Moves of a BitState or SearchState, as counted by perft
+    if state.piece is None:
+        return [] if state.occupied else [(None, p) for p in bit_indices(state.available)]
+    moves = []
+    pieces = bit_indices(state.available)
+    for sq in bit_indices(FULL & ~state.occupied):
+        if not pieces or wins_at(state.board | state.piece << (4 * sq), state.occupied | 1 << sq, sq):
+            moves.append((sq, None))
+        else:
+            moves.extend((sq, p) for p in pieces)
+    return moves
+
+def _perft(state, depth):
+    if depth == 0:
+        return 1
+    if state.piece is None:
+        if state.occupied: # Game over
+            return 0
+        count = 0
+        for p in bit_indices(state.available):
+            state.give(p)
+            count += _perft(state, depth - 1)
+            state.take_back(p)
+        return count
+    board, occupied, piece = state.board, state.occupied, state.piece
+    pieces = bit_indices(state.available)
+    count = 0
+    for sq in bit_indices(FULL & ~occupied):
+        if not pieces or wins_at(board | piece << (4 * sq), occupied | 1 << sq, sq):
+            count += depth == 1 # The game ends here
+        elif depth == 1:
+            count += len(pieces)
+        else:
+            state.place(sq)
+            for p in pieces:
+                state.give(p)
+                count += _perft(state, depth - 1)
+                state.take_back(p)
+            state.unplace(sq)
+    return count
+
+def perft_unique(state, depth):
+    # Number of different positions after 'depth' moves from a BitState, counting
+    # positions equal up to a symmetry (see canonical_form) once
+    level = {canonical_form(state)[0]}
+    for _ in range(depth):
+        next_level = set()
+        for board, occupied, available, piece, current in level:
+            if piece is None:
+                if not occupied:
+                    for p in bit_indices(available):
+                        next_level.add(canonical_form(BitState(board, occupied, available & ~(1 << p), p, 1 - current))[0])
+                continue
+            for sq in bit_indices(FULL & ~occupied):
+                new_board, new_occupied = board | piece << (4 * sq), occupied | 1 << sq
+                if not available or wins_at(new_board, new_occupied, sq):
+                    next_level.add(canonical_form(BitState(new_board, new_occupied, available, None, 1 - current))[0])
+                    continue
+                for p in bit_indices(available):
+                    next_level.add(canonical_form(BitState(new_board, new_occupied, available & ~(1 << p), p, 1 - current))[0])
+        level = next_level
+    return len(level)
+
+# ---------------------------------------------------------------------------
+# Opening book. book.py searches the canonical early positions offline and
+# writes fixed-size records sorted by key; game() maps the file and finds a
+# position by binary search, without reading it into Python objects.
+# ---------------------------------------------------------------------------
+OPENING_BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'opening_book.bin')
+BOOK_MAGIC = b'QUARTOB1'
+BOOK_RECORD = struct.Struct('<QBBh') # canonical key, square, piece given (255: none), score
+BOOK_NONE = 255
+BOOK_SCORE_LIMIT = 32767 # Scores are clamped to the int16 range (a won position is stored as the limit)
+OPENING_BOOK = None # Opened by open_opening_book()
+
+def book_key(state):
+    # Returns (key, transform): the key is the same for every symmetric version of 'state'
+    # and for both sides to move, the moves of the book are stored in the canonical frame
+    canonical, transform = canonical_form(state._replace(current=0))
+    return zobrist_hash(canonical), transform
+
+class OpeningBook:
+    # Read-only view of a book file through mmap
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(BOOK_MAGIC)] != BOOK_MAGIC or (len(self.data) - len(BOOK_MAGIC)) % BOOK_RECORD.size:
+            self.data.close()
+            raise ValueError(f"{path} is not an opening book")
+        self.count = (len(self.data) - len(BOOK_MAGIC)) // BOOK_RECORD.size
+
+    def __len__(self):
+        return self.count
+
+    def find(self, key):
+        # Returns (square, piece, score) stored for 'key', or None
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            record = BOOK_RECORD.unpack_from(self.data, len(BOOK_MAGIC) + mid * BOOK_RECORD.size)
+            if record[0] < key:
+                lo = mid + 1
+            elif record[0] > key:
+                hi = mid
+            else:
+                return record[1:]
+        return None
 
-            temp_best_recursive_score = -float('inf')
-            temp_chosen_piece = None
-            for next_piece in available_to_give: # Try giving each available piece
-                 next_state = {
-                     "players": state["players"],
-                     "current": opponent_player_index_str,
-                     "board": tuple(new_board), 
-                     "piece": next_piece
-                 }
-                # eval_opponent is score from opponent's view. Negate for player's view
-                 eval_opponent = -negamax(next_state, opponent_player_index_str, depth - 1, -float('inf'), float('inf')) 
-
-
-                 if eval_opponent > temp_best_recursive_score:
-                     temp_best_recursive_score = eval_opponent
-                     temp_chosen_piece = next_piece
-
-            move_score = temp_best_recursive_score
-            chosen_piece_for_next = temp_chosen_piece
-
-        # Update overall best score and move found
-        if move_score > best_score:
-            best_score = move_score
-            best_move_pos = i
-            best_piece_to_give = chosen_piece_for_next
+    def move(self, state):
+        # Returns the book's (position, piece id) for a BitState, or None if the position isn't in it
+        key, transform = book_key(state)
+        record = self.find(key)
+        if record is None:
+            return None
+        sq, p, _ = record
+        sq, p = untransform_move((sq, None if p == BOOK_NONE else p), transform)
+        if state.occupied >> sq & 1 or (p is None) != (not state.available) or (p is not None and not state.available >> p & 1):
+            return None # Key collision with a position of another shape
+        return sq, p
+
+    def close(self):
+        self.data.close()
+
+def write_opening_book(path, entries):
+    # Writes {key: (square, piece, score)} as a book file, records sorted by key
+    with open(path, 'wb') as f:
+        f.write(BOOK_MAGIC)
+        for key in sorted(entries):
+            sq, p, score = entries[key]
+            score = max(-BOOK_SCORE_LIMIT, min(BOOK_SCORE_LIMIT, score))
+            f.write(BOOK_RECORD.pack(key, sq, BOOK_NONE if p is None else p, int(score)))
+
+def open_opening_book(path=None):
+    # Maps the book (once, at program start) and returns it, None if there is no usable book
+    global OPENING_BOOK
+    if OPENING_BOOK is None:
+        try:
+            OPENING_BOOK = OpeningBook(path or OPENING_BOOK_PATH)
+        except (OSError, ValueError) as e:
+            print(f"No opening book: {e}")
+    return OPENING_BOOK
+
+# ---------------------------------------------------------------------------
+# Search trace. When a sink is installed with set_search_trace(), game()
+# writes one record per move: where the move came from, the counters of every
+# depth and the final PV. Without a sink the cost is one test per move.
+# ---------------------------------------------------------------------------
+SEARCH_TRACE = None # Sink of the per-move records, see set_search_trace()
+
+class RingBufferTrace:
+    # Keeps the last 'size' records in memory
+    def __init__(self, size=256):
+        self.records = deque(maxlen=size)
+
+    def write(self, record):
+        self.records.append(record)
+
+    def close(self):
+        pass
+
+class JsonlTrace:
+    # Appends the records to a file, one JSON object per line
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a')
+        self._lock = threading.Lock() # game() may run in several threads
+
+    def write(self, record):
+        line = json.dumps(record, allow_nan=False) + '\n'
+        with self._lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        with self._lock:
+            self.file.close()
+
+def set_search_trace(sink):
+    # Installs 'sink' (anything with write(record)), None turns the trace off; returns the previous sink
+    global SEARCH_TRACE
+    previous, SEARCH_TRACE = SEARCH_TRACE, sink
+    return previous
+
+_last_move = threading.local() # Summary of the last game() call of each thread
+
+def last_move_info():
+    # {"match", "source", "depth", "score"} of this thread's last game() call, None before any
+    return getattr(_last_move, "info", None)
+
+def record_score(score):
+    # Score as written to the JSON logs: JSON has no Infinity, decided positions are "win" or "loss"
+    if score == float('inf'):
+        return "win"
+    if score == -float('inf'):
+        return "loss"
+    return score
+
+def completed_depth(ctx, source):
+    # Deepest completed iteration of the move's search, 0 when it didn't search
+    iterations = ctx.iterations if source == "search" else []
+    return max((it["depth"] for it in iterations if it["complete"]), default=0)
+
+def trace_record(state, bits, ctx, source, move, counters, seconds):
+    # Record of one game() call; 'counters' are search_counters(ctx) before the move
+    nodes, cutoffs, first_move_cutoffs, tt_hits, tt_probes = (b - a for a, b in zip(counters, search_counters(ctx)))
+    iterations = ctx.iterations if source == "search" else []
+    return {
+        "time": time.time(),
+        "players": list(state.get("players") or ()),
+        "pieces": POPCOUNT[bits.occupied],
+        "source": source, # "book", "endgame", "proof", "search", "random" (opening) or None (no search finished)
+        "match": ctx.match_id,
+        "depth": completed_depth(ctx, source),
+        "seconds": seconds,
+        "nodes": nodes,
+        "cutoff_rate": cutoffs / nodes if nodes else 0,
+        "first_move_cutoff_rate": first_move_cutoffs / cutoffs if cutoffs else 0,
+        "tt_hits": tt_hits,
+        "tt_hit_rate": tt_hits / tt_probes if tt_probes else 0,
+        "score": record_score(ctx.best_score) if source in ("endgame", "search") else None,
+        "iterations": [dict(it, move=list(it["move"]), score=record_score(it["score"])) for it in iterations],
+        "pv": [list(m) for m in ctx.pv] if source == "search" else [],
+        "proof": ctx.proof, # Result, nodes and proof tree size of the proof search, None if it didn't run
+        "move": list(move),
+    }
+
+ASPIRATION_WINDOW = 16 # Half width of the first root window around the previous score (a threat is 15)
+
+def mtdf(bits, player, depth, ctx, guess=0, pool=None):
+    # MTD(f): null-window root searches around 'guess' until the bounds meet; the table keeps
+    # the work of one pass for the next. Returns the best (position, piece id), ctx.best_score
+    # gets the value. Running out of time in any pass raises SearchTimeout.
+    if not bits.occupied: # Opening moves are not searched
+        return find_best_negamax_move(bits, player, depth, ctx, pool=pool)
+    lower, upper = -float('inf'), float('inf')
+    g = guess
+    move = None
+    while lower < upper:
+        beta = max(g, lower + 1)
+        result = find_best_negamax_move(bits, player, depth, ctx, beta - 1, beta, pool)
+        if ctx.aborted: # A partial pass bounds nothing
+            raise SearchTimeout()
+        g = ctx.best_score
+        if g < beta:
+            upper = g
+        else:
+            lower = g
+            move = result # Proved at least as good as every other root move
+        if move is None and upper == -float('inf'): # Every move loses
+            move = result
+    ctx.best_score = g
+    ctx.pv = principal_variation(bits, move, ctx.tt)
+    return move
+
+def iterative_deepening(bits, player, ctx, max_depth=None, pool=None):
+    # Searches depth 2, 3, ... until ctx.deadline, each depth ordered by the previous one and
+    # started with a narrow window around its score. Returns the best (position, piece id).
+    move = (None, None)
+    ctx.iterations = []
+    empty_count = POPCOUNT[FULL & ~bits.occupied]
+    for depth in range(2, min(max_depth or MAX_SEARCH_DEPTH, max(empty_count, 2)) + 1):
+        start = time.monotonic()
+        counters = search_counters(ctx)
+        previous = ctx.best_score
+        pv = ctx.pv
+        try:
+            if ctx.algorithm == "mtdf":
+                result = mtdf(bits, player, depth, ctx, 0 if previous is None else previous, pool)
+            elif previous is None or previous in (float('inf'), -float('inf')):
+                result = find_best_negamax_move(bits, player, depth, ctx, pool=pool)
+            else:
+                alpha, beta = previous - ASPIRATION_WINDOW, previous + ASPIRATION_WINDOW
+                result = find_best_negamax_move(bits, player, depth, ctx, alpha, beta, pool)
+                if not ctx.aborted and not alpha < ctx.best_score < beta: # Outside the window: full search
+                    if ctx.best_score >= beta:
+                        move = result # Already better than the previous best if time runs out
+                        previous, pv = ctx.best_score, ctx.pv
+                    result = find_best_negamax_move(bits, player, depth, ctx, pool=pool)
+                elif ctx.aborted and ctx.best_score <= alpha:
+                    ctx.best_score, ctx.pv = previous, pv # Score and PV of the move we keep
+                    break # The partial search only knows the moves got worse
+        except SearchTimeout:
+            ctx.best_score, ctx.pv = previous, pv
+            break # Keep the move of the last completed depth
+        move = result
+        nodes, cutoffs, first_move_cutoffs, tt_hits, tt_probes = (b - a for a, b in zip(counters, search_counters(ctx)))
+        ctx.iterations.append({"depth": depth, "seconds": time.monotonic() - start, "nodes": nodes,
+                               "cutoffs": cutoffs, "first_move_cutoffs": first_move_cutoffs,
+                               "tt_hits": tt_hits, "tt_probes": tt_probes,
+                               "score": ctx.best_score, "move": move, "complete": not ctx.aborted})
+        print(f'profondeur : {depth} ({time.monotonic() - start:.3f}s)')
+        if not bits.occupied or ctx.aborted or ctx.best_score in (float('inf'), -float('inf')):
+            break # Opening move, out of time (the partial move includes the previous best) or game decided
+    return move
+
+# ---------------------------------------------------------------------------
+# Pondering. After we answer, the opponent's position (our piece placed, the
+# given piece in their hand) is searched in a background thread with the
+# match's tables, so the replies we will face are already in them. Small
+# trees are solved exactly. Any game() call stops it first: the ponder
+# context's deadline is moved to the past, which the search notices within
+# PONDER_CHECK_MASK nodes. With a search pool, the depth-limited search runs
+# in the workers and never sees the main process's tables, so only the
+# positions our exact solver will get are pondered.
+# ---------------------------------------------------------------------------
+_ponder = None # The running Ponder, at most one
+_ponder_lock = threading.Lock()
+_games_running = 0 # game() calls in progress, no pondering meanwhile
+
+class Ponder:
+    # Searches 'bits' (the opponent to move) in a daemon thread until stop(), PONDER_TIME_LIMIT at most
+    def __init__(self, ctx, bits):
+        self.ctx = ctx.ponder_context()
+        self.bits = bits
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        ctx = self.ctx
+        try:
+            if POPCOUNT[FULL & ~self.bits.occupied] <= ENDGAME_EMPTY_SQUARES + 1: # Our next position gets solved
+                solve_endgame(self.bits, ctx)
+            else:
+                iterative_deepening(self.bits, str(self.bits.current), ctx)
+        except SearchTimeout:
+            pass
+        except Exception as e:
+            print(f"Error in ponder: {e}")
 
-    # Security if bug in algorithm
-    if best_piece_to_give is None and available_to_give: # If no piece chosen and pieces are available
-        best_piece_to_give = next(iter(available_to_give)) # Pick first available 
+    def stop(self):
+        self.ctx.deadline = -float('inf')
+        self.thread.join()
 
-    if best_move_pos is None and state["board"] != [None]*16: # If no position chosen and board not empty
-         return random.choice(empty_positions), best_piece_to_give
-    return best_move_pos, best_piece_to_give
+def start_pondering(state, pos, piece):
+    # Ponders the position after our move (pos, piece name) in 'state', returns the Ponder or None
+    global _ponder
+    try:
+        bits = to_bitstate(state)
+        piece_id = PIECE_CODES[piece]
+    except (KeyError, TypeError, ValueError):
+        return None
+    if pos is None or bits.piece is None or bits.occupied >> pos & 1 or not bits.available >> piece_id & 1:
+        return None
+    board, occupied = bits.board | bits.piece << (4 * pos), bits.occupied | 1 << pos
+    if wins_at(board, occupied, pos): # Our move ended the match
+        return None
+    if SEARCH_POOL is not None and POPCOUNT[FULL & ~occupied] > ENDGAME_EMPTY_SQUARES + 1:
+        return None # The next search runs in the workers, with their own tables: only the solver runs here
+    with _match_contexts_lock:
+        ctx = MATCH_CONTEXTS.get(tuple(state.get("players") or ()))
+    if ctx is None:
+        return None
+    stop_pondering()
+    with _ponder_lock:
+        if _games_running: # Another match is searching, it gets the whole CPU
+            return None
+        _ponder = Ponder(ctx, BitState(board, occupied, bits.available & ~(1 << piece_id), piece_id, 1 - bits.current))
+        return _ponder
+
+def stop_pondering():
+    # Stops the ponder search, if any, and waits for its thread
+    global _ponder
+    with _ponder_lock:
+        ponder, _ponder = _ponder, None
+    if ponder is not None:
+        ponder.stop()
+
+def _game_started(started):
+    # Counts the running game() calls; the first one stops the ponder search
+    global _games_running
+    with _ponder_lock:
+        _games_running += 1 if started else -1
+    if started:
+        stop_pondering()
+
+def fallback_move(bits):
+    # Move of a BitState without search: a win on the spot, else a placement after which some
+    # piece doesn't let the opponent win, and that piece; any legal move if every piece does
+    available = bits.available
+    if bits.piece is None: # First move: only a piece to give
+        return None, bit_indices(available)[0] if available else None
+    win = winning_square(bits)
+    if win is not None:
+        return win, bit_indices(available)[0] if available else None
+    empty = bit_indices(FULL & ~bits.occupied)
+    for sq in empty:
+        safe = available & ~unsafe_pieces(bits.board | bits.piece << (4 * sq), bits.occupied | 1 << sq)
+        if safe:
+            return sq, bit_indices(safe)[0]
+    return empty[0], bit_indices(available)[0] if available else None
 
 def shufflepiece(piece_final):
     piece = list(piece_final)
@@ -346,48 +1782,79 @@ def shufflepiece(piece_final):
     piece = ''.join(piece)
     return piece
 
-import threading
-def game(state,start_time):
-    # Standardize input state
-    state = deepcopy(state)
-    state["piece"] = conversion_piece(state["piece"])
-    state["board"] = [conversion_piece(p) for p in state["board"]]
-    player = str(state["current"])
-    
-    # For regular game play, use threading with timeout
-    
-    # Flag to stop the calculation thread
-    stop_calculation = threading.Event()
-    def calculation_thread(result):
+def game(state,start_time,algorithm=None):
+    # Convert the server state once, the search only works on the bitboard
+    # 'algorithm' is one of SEARCH_ALGORITHMS, SEARCH_ALGORITHM by default
+    algorithm = algorithm or SEARCH_ALGORITHM
+    if algorithm not in SEARCH_ALGORITHMS:
+        raise ValueError(f"unknown search algorithm {algorithm}")
+    bits = to_bitstate(state)
+    player = str(bits.current)
+    _game_started(True) # The ponder search leaves the CPU and the tables to us
+    try:
+        ctx = match_context(state, bits) # Warm table and history from our previous moves
+        ctx.new_search()
+        ctx.algorithm = algorithm
+        # The search runs in this thread and checks the deadline itself, so nothing keeps running after we answer
+        elapsed = min(max(time.time() - start_time, 0), SEARCH_TIME_BUDGET)
+        ctx.deadline = time.monotonic() + SEARCH_TIME_BUDGET - elapsed
+        started = time.monotonic()
+        counters = search_counters(ctx)
+
+        pos, piece_id = None, None
+        source = None
         try:
-            # Start with depth 1 and increase gradually
-            current_depth = 2
-            empty_positions = [i for i in range(16) if state["board"][i] is None]
-            if len(empty_positions) < 13:
-                while not stop_calculation.is_set() and current_depth <= 15:  # Max depth 15
-                    move = find_best_negamax_move(deepcopy(state), player, current_depth)
-                    print(f'profondeur : {current_depth}')
-                    if move[0] is not None:
-                        result[0] = move[0]  # Position
-                        result[1] = shufflepiece(move[1])  # Piece to give
-                        
-                    current_depth += 1
-            else:
-                move = find_best_negamax_move(deepcopy(state), player, current_depth)
-                result[0] = move[0]  # Position
-                result[1] = shufflepiece(move[1])  # Piece to give
-
+            if elapsed >= SEARCH_TIME_BUDGET: # The request waited too long: answer right away
+                raise SearchTimeout()
+            if OPENING_BOOK is not None and bits.occupied:
+                pos, piece_id = OPENING_BOOK.move(bits) or (None, None)
+                if pos is not None:
+                    source = "book"
+                    print('ouverture : livre')
+            if pos is None and bits.piece is not None and POPCOUNT[FULL & ~bits.occupied] <= ENDGAME_EMPTY_SQUARES:
+                deadline = ctx.deadline
+                ctx.deadline = time.monotonic() + ENDGAME_TIME_SHARE * (deadline - time.monotonic())
+                try:
+                    pos, piece_id = solve_endgame(bits, ctx)
+                    source = "endgame"
+                    print(f'finale résolue : {ctx.best_score}')
+                except SearchTimeout:
+                    pass # Too big after all: the normal search gets the rest of the time
+                ctx.deadline = deadline
+            elif pos is None and PROOF_SEARCH and bits.piece is not None and POPCOUNT[bits.occupied] >= PROOF_MIN_PIECES:
+                deadline = ctx.deadline
+                ctx.deadline = time.monotonic() + PROOF_TIME_SHARE * (deadline - time.monotonic())
+                try:
+                    move = prove_win(bits, ctx)
+                    if move is not None: # A forced win: no need to search any further
+                        pos, piece_id = move
+                        source = "proof"
+                        print(f'gain forcé prouvé : {ctx.proof["proof_size"]} positions')
+                except SearchTimeout:
+                    pass
+                ctx.deadline = deadline
+            if pos is None:
+                pos, piece_id = iterative_deepening(bits, player, ctx, pool=SEARCH_POOL)
+                if not bits.occupied: # Opening moves are random, nothing was searched
+                    source = "random"
+                else:
+                    source = "search" if ctx.iterations else None
+        except SearchTimeout:
+            print('temps écoulé : coup de secours')
         except Exception as e:
-            print(f"Error in calculation thread: {e}")
-
-    result = [None, None]  # Will store the final position and piece
-    # Start the calculation thread
-    thread = threading.Thread(target=calculation_thread, args=(result,))
-    thread.daemon = True
-    thread.start()
-    # Wait for the thread with timeout
-    thread.join(timeout=2.5)  # Slightly less than 3s to ensure safe return
-    
-    # Signal the thread to stop if it's still running
-    stop_calculation.set()
-    return result[0], result[1]  # No move possible
+            print(f"Error in calculation: {e}")
+
+        if pos is None and piece_id is None: # No depth completed: a quick move that doesn't throw the match
+            pos, piece_id = fallback_move(bits)
+        if pos is not None and (piece_id is None or wins_at(bits.board | bits.piece << (4 * pos), bits.occupied | 1 << pos, pos)):
+            end_match(state.get("players")) # Our move ends the match
+        if SEARCH_TRACE is not None:
+            try:
+                SEARCH_TRACE.write(trace_record(state, bits, ctx, source, (pos, piece_id), counters, time.monotonic() - started))
+            except Exception as e: # The trace never costs us the move
+                print(f"Trace error: {e}")
+        _last_move.info = {"match": ctx.match_id, "source": source, "depth": completed_depth(ctx, source),
+                           "score": record_score(ctx.best_score) if source in ("endgame", "search") else None}
+        return pos, None if piece_id is None else shufflepiece(PIECES[piece_id])
+    finally: # Even when the search fails, or pondering would stay off for good
+        _game_started(False)
@@ -0,0 +1,248 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from algo import PIECE_CODES, PIECES, to_bitstate, wins_at
+from connect import read_message
+
+# Local stand-in for the tournament server: bots subscribe, then the arena
+# connects back to them for every ping and play request, as the real server
+# does. A bad or late move costs a life and the request is sent again with
+# the error; the player without lives left loses the match.
+MOVE_TIME_LIMIT = 3.0 # Seconds a bot has to answer a play request
+LIVES = 3
+BOT_START_TIMEOUT = 60.0 # Seconds we wait for the bot processes to subscribe
+CONNECT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'connect.py')
+
+def check_move(state, move):
+    # Plays 'move' (the bot's {"pos", "piece"}) on 'state', returns (next state, True if it wins)
+    # Raises ValueError with the reason for a bad move
+    if not isinstance(move, dict):
+        raise ValueError("no move")
+    pos, given = move.get("pos"), move.get("piece")
+    board = list(state["board"])
+    hand = state["piece"]
+    if hand is None: # First move: only a piece is given
+        if pos is not None:
+            raise ValueError("nothing to place")
+    else:
+        if not isinstance(pos, int) or not 0 <= pos < 16 or board[pos] is not None:
+            raise ValueError(f"bad position {pos!r}")
+        board[pos] = hand
+    bits = to_bitstate({"board": board, "piece": None})
+    won = pos is not None and wins_at(bits.board, bits.occupied, pos)
+    if given is None:
+        if not won and bits.available:
+            raise ValueError("no piece given")
+    else:
+        given_id = PIECE_CODES.get(given) if isinstance(given, str) else None
+        if given_id is None or not bits.available >> given_id & 1:
+            raise ValueError(f"bad piece {given!r}")
+        given = PIECES[given_id]
+    next_state = {"players": state["players"], "current": 1 - state["current"], "board": board, "piece": given}
+    return next_state, won
+
+def percentiles(values, qs=(50, 90, 99)):
+    # Nearest-rank percentiles of 'values', and the maximum
+    ordered = sorted(values)
+    if not ordered:
+        return {}
+    stats = {f"p{q}": ordered[min(len(ordered) - 1, max(0, -(-q * len(ordered) // 100) - 1))] for q in qs}
+    stats["max"] = ordered[-1]
+    return stats
+
+class Arena:
+    # Registered bots and their results
+    def __init__(self, move_time_limit=MOVE_TIME_LIMIT, lives=LIVES):
+        self.move_time_limit = move_time_limit
+        self.lives = lives
+        self.players = {} # name -> (host, port)
+        self.subscribed = asyncio.Event()
+        self.stats = {}
+
+    def register(self, name, host, port):
+        self.players[name] = (host, port)
+        self.stats.setdefault(name, {"games": 0, "wins": 0, "losses": 0, "draws": 0, "latencies": [],
+                                     "timeouts": 0, "bad_moves": 0})
+        self.subscribed.set()
+
+    async def handle_subscribe(self, reader, writer):
+        # Answers a bot's subscribe request; the bot is called back on its port at its address
+        try:
+            request = await read_message(reader)
+            if not request or request.get("request") != "subscribe" or not isinstance(request.get("port"), int):
+                response = {"response": "error", "error": "bad subscribe request"}
+            elif request.get("name") in self.players:
+                response = {"response": "error", "error": "name already used"}
+            else:
+                self.register(request.get("name"), writer.get_extra_info("peername")[0], request["port"])
+                response = {"response": "ok"}
+            writer.write(json.dumps(response).encode('utf-8'))
+            await writer.drain()
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError) as e:
+            print(f"Bad subscribe: {e}")
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=3000):
+        return await asyncio.start_server(self.handle_subscribe, host, port)
+
+    async def request(self, name, message, timeout=None):
+        # Sends 'message' to bot 'name' on a new connection, returns its reply (None if it closed)
+        # 'timeout' covers the whole exchange, from connecting to the end of the reply
+        return await asyncio.wait_for(self._exchange(name, message), timeout)
+
+    async def _exchange(self, name, message):
+        host, port = self.players[name]
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write((json.dumps(message) + '\n').encode('utf-8'))
+            await writer.drain()
+            return await read_message(reader)
+        finally:
+            writer.close()
+
+    async def ping(self, name):
+        # True if bot 'name' answers pong in time
+        try:
+            reply = await self.request(name, {"request": "ping"}, self.move_time_limit)
+        except (asyncio.TimeoutError, ValueError, OSError, asyncio.IncompleteReadError):
+            return False
+        return isinstance(reply, dict) and reply.get("response") == "pong"
+
+    async def play_match(self, first, second):
+        # One match, 'first' moves first; returns the winner's name, None for a draw
+        names = (first, second)
+        state = {"players": list(names), "current": 0, "board": [None] * 16, "piece": None}
+        lives = [self.lives, self.lives]
+        errors = [[], []]
+        winner = None
+        while True:
+            current = state["current"]
+            name = names[current]
+            stats = self.stats[name]
+            message = {"request": "play", "lives": lives[current], "errors": errors[current], "state": state}
+            start = time.monotonic()
+            try:
+                reply = await self.request(name, message, self.move_time_limit)
+                stats["latencies"].append(time.monotonic() - start)
+                if not isinstance(reply, dict) or reply.get("response") != "move":
+                    raise ValueError(f"bad reply {reply!r}")
+                next_state, won = check_move(state, reply.get("move"))
+            except (asyncio.TimeoutError, ValueError, OSError, asyncio.IncompleteReadError) as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    stats["timeouts"] += 1
+                    e = "timeout"
+                stats["bad_moves"] += 1
+                lives[current] -= 1
+                errors[current] = errors[current] + [{"message": str(e), "state": state}]
+                if lives[current] <= 0:
+                    winner = names[1 - current]
+                    break
+                continue
+            errors[current] = []
+            state = next_state
+            if won:
+                winner = name
+                break
+            if None not in state["board"]:
+                break # Draw
+        for name in names:
+            stats = self.stats[name]
+            stats["games"] += 1
+            if winner is None:
+                stats["draws"] += 1
+            elif winner == name:
+                stats["wins"] += 1
+            else:
+                stats["losses"] += 1
+        return winner
+
+    async def run(self, games, names=None):
+        # Plays 'games' matches between the first two bots, alternating who starts
+        names = names or list(self.players)[:2]
+        results = []
+        for i in range(games):
+            first, second = names if i % 2 == 0 else names[::-1]
+            winner = await self.play_match(first, second)
+            results.append({"first": first, "winner": winner})
+            print(f"{i + 1}/{games} : {winner or 'draw'}", file=sys.stderr)
+        return results
+
+    def report(self, results=()):
+        bots = {}
+        for name, stats in self.stats.items():
+            games = stats["games"]
+            bots[name] = {
+                "games": games,
+                "wins": stats["wins"],
+                "losses": stats["losses"],
+                "draws": stats["draws"],
+                "win_rate": stats["wins"] / games if games else 0,
+                "score_rate": (stats["wins"] + stats["draws"] / 2) / games if games else 0,
+                "moves": len(stats["latencies"]),
+                "latency": percentiles(stats["latencies"]),
+                "timeouts": stats["timeouts"],
+                "bad_moves": stats["bad_moves"],
+            }
+        return {"bots": bots, "matches": list(results)}
+
+def start_bot(name, port, server_port, settings=(), workers=0):
+    # Starts connect.py as a bot process subscribing to the arena on 'server_port'
+    command = [sys.executable, CONNECT_PATH, "--server", f"127.0.0.1:{server_port}", "--port", str(port),
+               "--name", name, "--workers", str(workers)]
+    for setting in settings:
+        command += ["--set", setting]
+    return subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+async def run_arena(bots, games, port, workers, wait):
+    # Starts the arena and the bot processes, plays the matches and returns the report
+    arena = Arena()
+    server = await arena.start("127.0.0.1", port)
+    port = server.sockets[0].getsockname()[1]
+    processes = [start_bot(name, port + 1 + i, port, settings, workers) for i, (name, settings) in enumerate(bots)]
+    try:
+        async with server:
+            deadline = time.monotonic() + (BOT_START_TIMEOUT if processes else float('inf'))
+            while len(arena.players) < wait:
+                arena.subscribed.clear()
+                await asyncio.wait_for(arena.subscribed.wait(), max(0, deadline - time.monotonic()))
+            names = [name for name, _ in bots] or list(arena.players)[:2]
+            for name in names: # A bot subscribes before it listens
+                while not await arena.ping(name):
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(f"{name} doesn't answer the ping")
+                    await asyncio.sleep(0.1)
+            results = await arena.run(games, names)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+    return arena.report(results)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local tournament server: matches between two bots, reported as JSON")
+    parser.add_argument("--bot", action="append", nargs="+", default=[], metavar=("NAME", "SETTING"),
+                        help="starts connect.py as bot NAME, with SETTING=VALUE overrides of algo.py (twice)")
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--port", type=int, default=3000, help="subscribe port; bots listen on the next ones")
+    parser.add_argument("--workers", type=int, default=0, help="search processes of each bot (0: none)")
+    parser.add_argument("--output", help="write the report to this file instead of printing it")
+    args = parser.parse_args(argv)
+    if len(args.bot) not in (0, 2):
+        parser.error("give two bots, or none to wait for two bots to subscribe")
+
+    bots = [(bot[0], bot[1:]) for bot in args.bot]
+    report = asyncio.run(run_arena(bots, args.games, args.port, args.workers, wait=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import random
+import sys
+import time
+import algo
+from telemetry import TELEMETRY_PATH, read_records
+from algo import BitState, FULL, SearchContext, SearchState, bit_indices, has_winner, negamax, to_bitstate
+
+# Fixed positions of the search benchmark, as the server sends them
+BENCH_POSITIONS = [
+    ("early-1", {"current": 1, "board": [None] * 5 + ['BLEP'] + [None] * 10, "piece": "SDFC"}),
+    ("early-3", {"current": 1, "board": ['BLEP', None, None, None,
+                                         None, 'SDFC', None, None,
+                                         None, None, 'BDEP', None,
+                                         None, None, None, None], "piece": "SLFC"}),
+    ("middle-6", {"current": 0, "board": ['BLEP', 'BDFC', 'SLEP', None,
+                                          'SDFC', None, None, None,
+                                          None, 'SDEC', None, None,
+                                          None, None, 'BLFP', None], "piece": "BLFC"}),
+    ("middle-8", {"current": 0, "board": ['BLEP', 'BDFC', 'SLEP', 'SDEC',
+                                          'SDFC', None, 'BLFP', None,
+                                          None, None, 'SLFC', None,
+                                          None, 'BDEC', None, None], "piece": "SDFP"}),
+    ("end-10", {"current": 0, "board": [None, None, 'SDEP', 'SLEP',
+                                        'SDFC', None, 'BDFP', 'BDEC',
+                                        'BDEP', 'BLFC', 'SDEC', None,
+                                        None, None, 'BLEP', 'SLEC'], "piece": "SLFP"}),
+    ("end-11", {"current": 1, "board": ['SLEP', 'BLEP', None, None,
+                                        'SDEC', 'BDFC', None, 'BLFP',
+                                        'BDEP', None, 'BDEC', None,
+                                        'SLFC', 'SDFP', 'BDFP', 'BLEC'], "piece": "BLFC"}),
+]
+TIMES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'times.json') # Errors logged before the telemetry
+
+def logged_positions(path=TIMES_PATH, telemetry_path=None):
+    # Distinct states found in the error records of times.json, and of a telemetry log if given, as (name, state)
+    # The live log changes with every error, so it is left out of the default suite to keep its totals comparable
+    try:
+        with open(path) as f:
+            records = json.load(f)
+    except (OSError, ValueError):
+        records = []
+    if telemetry_path is not None:
+        records = itertools.chain(records, (record["errors"] for record in read_records(telemetry_path) if record.get("errors")))
+    positions = {}
+    for record in records:
+        for entry in record if isinstance(record, list) else [record]:
+            state = entry.get("state") if isinstance(entry, dict) else None
+            if state:
+                bits = to_bitstate(state)
+                positions.setdefault((bits.board, bits.piece), state)
+    return [(f"logged-{i + 1}", state) for i, state in enumerate(positions.values())]
+
+def position_report(name, bits, ctx, seconds, depth, move):
+    tt = ctx.tt.stats()
+    probes = tt["hits"] + tt["misses"]
+    return {
+        "name": name,
+        "pieces": algo.POPCOUNT[bits.occupied],
+        "depth": depth,
+        "nodes": ctx.nodes,
+        "nps": ctx.nodes / seconds if seconds else 0,
+        "tt_hit_rate": tt["hits"] / probes if probes else 0,
+        "seconds": seconds,
+        "score": algo.record_score(ctx.best_score),
+        "move": list(move),
+    }
+
+def bench_depth(name, bits, depth, algorithm="alphabeta"):
+    # One root search at a fixed depth with 'algorithm', with a fresh context
+    ctx = SearchContext()
+    ctx.algorithm = algorithm
+    start = time.perf_counter()
+    if algorithm == "mtdf":
+        move = algo.mtdf(bits, str(bits.current), depth, ctx)
+    else:
+        move = algo.find_best_negamax_move(bits, str(bits.current), depth, ctx)
+    return position_report(name, bits, ctx, time.perf_counter() - start, depth, move)
+
+def bench_time(name, bits, budget, algorithm="alphabeta"):
+    # Iterative deepening until 'budget' seconds, as game() does; depth is the last completed one
+    ctx = SearchContext()
+    ctx.algorithm = algorithm
+    ctx.deadline = time.monotonic() + budget
+    start = time.perf_counter()
+    move = algo.iterative_deepening(bits, str(bits.current), ctx)
+    completed = [it["depth"] for it in ctx.iterations if it["complete"]]
+    return position_report(name, bits, ctx, time.perf_counter() - start, max(completed, default=0), move)
+
+def run_suite(positions, depths=(3, 4), budgets=(1.0,), algorithm="alphabeta"):
+    # Runs every position at every fixed depth and time budget, returns the JSON report
+    random.seed(23383) # find_best_negamax_move picks a random piece when the game is already won
+    report = {"positions": len(positions), "algorithm": algorithm, "depth": {}, "time": {}}
+    for depth in depths:
+        report["depth"][str(depth)] = [bench_depth(name, to_bitstate(state), depth, algorithm) for name, state in positions]
+    for budget in budgets:
+        report["time"][str(budget)] = [bench_time(name, to_bitstate(state), budget, algorithm) for name, state in positions]
+    for runs in list(report["depth"].values()) + list(report["time"].values()):
+        nodes = sum(run["nodes"] for run in runs)
+        seconds = sum(run["seconds"] for run in runs)
+        runs.append({"name": "total", "nodes": nodes, "seconds": seconds, "nps": nodes / seconds if seconds else 0})
+    return report
+
+def random_positions(count, seed=23383, min_pieces=1, max_pieces=14):
+    # Positions without a winner and with a piece in hand, drawn with a fixed seed
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        k = rng.randint(min_pieces, max_pieces)
+        squares = rng.sample(range(16), k)
+        pieces = rng.sample(range(16), k + 1)
+        board, occupied = 0, 0
+        for sq, p in zip(squares, pieces):
+            board |= p << (4 * sq)
+            occupied |= 1 << sq
+        if has_winner(board, occupied):
+            continue
+        available = FULL & ~sum(1 << p for p in pieces)
+        positions.append(BitState(board, occupied, available, pieces[k], 0))
+    return positions
+
+def bench_leaves(positions, batched, repeat=3):
+    # Leaves/s of the depth-1 nodes of 'positions' (full window, so every placement is scored)
+    ctx = SearchContext(tt_size=1)
+    ctx.leaf_batching = batched
+    states = [SearchState(state) for state in positions]
+    leaves = sum(len(bit_indices(FULL & ~state.occupied)) for state in positions)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for state in states:
+            negamax(state, state.current, 1, ctx=ctx)
+        best = min(best, time.perf_counter() - start)
+    return {"nodes": len(states), "leaves": leaves, "seconds": best, "leaves_per_second": leaves / best}
+
+def bench_search(positions, depth, batched):
+    # Nodes and time of a fixed-depth root search of each position
+    nodes, seconds = 0, 0.0
+    for state in positions:
+        ctx = SearchContext()
+        ctx.leaf_batching = batched
+        start = time.perf_counter()
+        algo.find_best_negamax_move(state, str(state.current), depth, ctx)
+        seconds += time.perf_counter() - start
+        nodes += ctx.nodes
+    return {"nodes": nodes, "seconds": seconds}
+
+def run_leaves(count, depth):
+    # Scalar against NumPy-batched leaf evaluation
+    positions = random_positions(count)
+    searched = random_positions(8, seed=1, min_pieces=4, max_pieces=8)
+    return {
+        "leaves": {"scalar": bench_leaves(positions, False), "batched": bench_leaves(positions, True)},
+        "search": {"scalar": bench_search(searched, depth, False), "batched": bench_search(searched, depth, True)},
+    }
+
+def run_perft(positions, depth):
+    # Pure move generation: perft counts and leaves/s of each position
+    runs = []
+    for name, state in positions:
+        bits = to_bitstate(state)
+        start = time.perf_counter()
+        leaves = algo.perft(bits, depth)
+        seconds = time.perf_counter() - start
+        runs.append({"name": name, "depth": depth, "leaves": leaves, "seconds": seconds,
+                     "leaves_per_second": leaves / seconds if seconds else 0})
+    return {"perft": runs}
+
+def run_proof(positions, budget):
+    # Proof search of each position for at most 'budget' seconds: result and proof tree size
+    runs = []
+    for name, state in positions:
+        bits = to_bitstate(state)
+        ctx = SearchContext()
+        ctx.deadline = time.monotonic() + budget
+        try:
+            move = algo.prove_win(bits, ctx)
+        except algo.SearchTimeout:
+            move = None
+        proof = ctx.proof
+        result = {True: "win", False: "no win", None: "unknown"}[proof["result"]]
+        runs.append({"name": name, "pieces": algo.POPCOUNT[bits.occupied], "result": result,
+                     "nodes": proof["nodes"], "proof_size": proof["proof_size"], "seconds": proof["seconds"],
+                     "nps": proof["nodes"] / proof["seconds"] if proof["seconds"] else 0,
+                     "move": list(move) if move is not None else None})
+    return {"proof": runs}
+
+def main(argv=None):
+    output = argparse.ArgumentParser(add_help=False) # --output before or after the command
+    output.add_argument("--output", default=argparse.SUPPRESS, help="write the report to this file instead of printing it")
+    parser = argparse.ArgumentParser(description="Search benchmarks, reported as JSON", parents=[output])
+    commands = parser.add_subparsers(dest="command")
+    search = commands.add_parser("search", parents=[output],
+                                 help="fixed positions at fixed depths and time budgets (default)")
+    search.add_argument("--depth", type=int, nargs="*", default=[3, 4])
+    search.add_argument("--time", type=float, nargs="*", default=[1.0], help="time budgets in seconds")
+    search.add_argument("--no-logged", action="store_true", help="leave out the states of times.json")
+    search.add_argument("--telemetry", nargs="?", const=TELEMETRY_PATH, metavar="PATH",
+                        help="add the states of the errors in a telemetry log (telemetry.jsonl by default)")
+    search.add_argument("--algorithm", choices=algo.SEARCH_ALGORITHMS, default="alphabeta")
+    leaves = commands.add_parser("leaves", parents=[output], help="scalar against NumPy-batched leaf evaluation")
+    leaves.add_argument("--positions", type=int, default=2000)
+    leaves.add_argument("--depth", type=int, default=4, help="depth of the root searches")
+    perft = commands.add_parser("perft", parents=[output], help="move generation only, on the fixed positions")
+    perft.add_argument("--depth", type=int, default=3)
+    proof = commands.add_parser("proof", parents=[output],
+                                help="proof-number search for a forced win on the fixed positions")
+    proof.add_argument("--seconds", type=float, default=1.0, help="time budget of each position")
+    args = parser.parse_args(argv)
+
+    if args.command == "leaves" and algo.np is None:
+        parser.error("NumPy is not installed")
+    with contextlib.redirect_stdout(sys.stderr): # The search's own prints stay out of the report
+        if args.command == "leaves":
+            report = run_leaves(args.positions, args.depth)
+        elif args.command == "perft":
+            report = run_perft(BENCH_POSITIONS, args.depth)
+        elif args.command == "proof":
+            report = run_proof([(name, state) for name, state in BENCH_POSITIONS if state["piece"]], args.seconds)
+        else:
+            positions = list(BENCH_POSITIONS)
+            if not getattr(args, "no_logged", False):
+                positions += logged_positions(telemetry_path=getattr(args, "telemetry", None))
+            report = run_suite(positions, getattr(args, "depth", [3, 4]), getattr(args, "time", [1.0]),
+                               getattr(args, "algorithm", "alphabeta"))
+    if getattr(args, "output", None):
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
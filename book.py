@@ -0,0 +1,61 @@
+import argparse
+import time
+from algo import (BitState, FULL, POPCOUNT, SearchContext, bit_indices, book_key, canonical_form, iterative_deepening,
+                  transform_move, start_search_pool, stop_search_pool, write_opening_book, OPENING_BOOK_PATH)
+
+def book_positions(max_pieces):
+    # Canonical positions with 1..max_pieces pieces on the board and a piece to place, in game order
+    level = {canonical_form(BitState(0, 0, FULL, None, 0))[0]}
+    positions = []
+    while level:
+        next_level = set()
+        for board, occupied, available, hand, current in level:
+            if hand is None: # Choose the piece to give
+                for p in bit_indices(available):
+                    next_level.add(canonical_form(BitState(board, occupied, available & ~(1 << p), p, 0))[0])
+            elif POPCOUNT[occupied] < max_pieces: # Place it and give another one
+                for sq in bit_indices(FULL & ~occupied):
+                    for p in bit_indices(available):
+                        child = BitState(board | hand << (4 * sq), occupied | 1 << sq, available & ~(1 << p), p, 0)
+                        next_level.add(canonical_form(child)[0])
+        level = next_level
+        positions.extend(sorted(state for state in level if state.occupied and state.piece is not None))
+    return positions
+
+def build_book(positions, seconds, max_depth, pool=None):
+    # Searches every position for 'seconds' and returns {key: (square, piece, score)}
+    entries = {}
+    for i, state in enumerate(positions):
+        ctx = SearchContext()
+        ctx.deadline = time.monotonic() + seconds
+        pos, piece_id = iterative_deepening(state, str(state.current), ctx, max_depth, pool)
+        if pos is None:
+            continue
+        key, transform = book_key(state) # The state is canonical, but may be symmetric to itself
+        sq, p = transform_move((pos, piece_id), transform)
+        entries[key] = (sq, p, ctx.best_score)
+        depth = ctx.iterations[-1]["depth"] if ctx.iterations else 0
+        print(f"{i + 1}/{len(positions)} : {pos} {piece_id} (profondeur {depth}, score {ctx.best_score})")
+    return entries
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Builds the opening book read by game()")
+    parser.add_argument("--pieces", type=int, default=2, help="largest number of pieces on the board")
+    parser.add_argument("--seconds", type=float, default=5.0, help="search time per position")
+    parser.add_argument("--depth", type=int, default=15, help="largest search depth")
+    parser.add_argument("--workers", type=int, default=None, help="search processes (default: one per core)")
+    parser.add_argument("--output", default=OPENING_BOOK_PATH)
+    args = parser.parse_args(argv)
+
+    positions = book_positions(args.pieces)
+    print(f"{len(positions)} positions")
+    pool = start_search_pool(args.workers)
+    try:
+        entries = build_book(positions, args.seconds, args.depth, pool)
+    finally:
+        stop_search_pool()
+    write_opening_book(args.output, entries)
+    print(f"{len(entries)} positions written to {args.output}")
+
+if __name__ == "__main__":
+    main()
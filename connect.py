@@ -1,31 +1,23 @@
+import argparse
+import ast
+import asyncio
 import socket
 import json
 import time
-import threading
-from algo import game,find_best_negamax_move  # Imports game logic and AI decision making.
+from concurrent.futures import ThreadPoolExecutor
+import algo
+from telemetry import TelemetryLog
+from algo import game,to_bitstate,wins_at,FULL,last_move_info,start_search_pool,open_opening_book,set_search_trace,JsonlTrace,start_pondering  # Imports game logic and AI decision making.
 import json
 import os
 
-def save_time(seconds): # Saves timing data or errors to a JSON file.
-    file_path = os.path.join(os.path.dirname(__file__), 'times.json')
-    times = []
-    try:
-        with open(file_path, 'r') as f:
-            times = json.load(f)
-    except FileNotFoundError:
-        pass
-    times.append(seconds)
-    try:
-        with open(file_path, 'w') as f:
-            json.dump(times, f)
-    except Exception as e:
-        print(e)
+SERVER_ADDRESS = "192.168.1.101:3000" # Tournament server
+LISTEN_PORT = 54345 # Port the server connects back to
+BOT_NAME = "BotBotBot"
 
-def connection(): # Establishes and returns a socket connection to the game server.
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+def connection(host="192.168.1.101", port=3000): # Establishes and returns a socket connection to the game server.
     while True:
-        host = "192.168.1.101" # Server IP address
-        port = 3000 # Server port
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # A failed socket can't connect again
         try:
             port = int(port) 
             s.connect((host, port))
@@ -33,14 +25,16 @@ def connection(): # Establishes and returns a socket connection to the game serv
             break
         except socket.error as e:
             print(f"Connection error: {e}. Please check the server address and port.")
+            s.close()
+            time.sleep(1)
             continue
     return host, s
 
-def identification(s): # Sends identification to server, returns the port for server to connect back.
+def identification(s, port=LISTEN_PORT, name=BOT_NAME): # Sends identification to server, returns the port for server to connect back.
     try:
         identifiant = {"request": "subscribe", 
-                        "port": 54345, # Port this client will listen on for server messages.
-                        "name": "BotBotBot", # Name of the client
+                        "port": port, # Port this client will listen on for server messages.
+                        "name": name, # Name of the client
                         "matricules": ["23383"]} # Matricule
         json_identifiant = json.dumps(identifiant)
         s.sendall(json_identifiant.encode('utf-8'))
@@ -59,74 +53,172 @@ def identification(s): # Sends identification to server, returns the port for se
         return None
     return identifiant['port']
 
-def ponganswer(ping_data,conn):
-    try:
-            pong = {"response": "pong"}
-            conn.sendall(json.dumps(pong).encode('utf-8'))
-    except Exception as e:
-        print(f'2{e}')
-    finally:
-        conn.close()
-def play(ping_data,conn,start_time):
-    state_game = ping_data.get('state')
-    start_time = time.time()  # Définir start_time ici
+MAX_MESSAGE_SIZE = 1 << 20 # Bytes; a request is a few hundred
+SEARCH_THREADS = 4 # Moves of different matches searched at the same time
+
+async def read_message(reader): # Reads one JSON request, None if the connection closed first.
+    # Accepts "<length>\n" followed by the JSON text, or the JSON text alone, which ends at its closing
+    # brace whether a newline, the end of the connection or nothing follows (the server may wait for us).
+    data = b''
+    decoder = json.JSONDecoder()
+    while True:
+        chunk = await reader.read(4096)
+        data += chunk
+        if len(data) > MAX_MESSAGE_SIZE:
+            raise ValueError("message too large")
+        text = data.lstrip()
+        if text[:1].isdigit(): # Length prefix
+            header, newline, rest = text.partition(b'\n')
+            if newline:
+                size = int(header)
+                if size > MAX_MESSAGE_SIZE:
+                    raise ValueError("message too large")
+                if len(rest) < size:
+                    rest += await reader.readexactly(size - len(rest))
+                return json.loads(rest[:size].decode('utf-8'))
+        elif text:
+            try:
+                message, _ = decoder.raw_decode(text.decode('utf-8'))
+                return message
+            except (json.JSONDecodeError, UnicodeDecodeError): # Incomplete: wait for the rest
+                if not chunk:
+                    raise
+        if not chunk: # Closed
+            if text:
+                raise ValueError("incomplete message")
+            return None
+
+TELEMETRY = None # TelemetryLog of the moves, opened by the main program
+
+def move_outcome(state_game, move): # What our move does: "give" (first move), "move", "win", "draw" or "bad move".
+    bits = to_bitstate(state_game)
+    pos = move["pos"]
+    if pos is None:
+        return "give" if not bits.occupied else "bad move"
+    if not isinstance(pos, int) or not 0 <= pos < 16 or bits.occupied >> pos & 1 or bits.piece is None:
+        return "bad move"
+    occupied = bits.occupied | 1 << pos
+    if wins_at(bits.board | bits.piece << (4 * pos), occupied, pos):
+        return "win"
+    return "draw" if occupied == FULL else "move"
+
+def move_record(request, response, info, latency): # Telemetry record of one answered play request.
+    state_game = request.get('state') or {}
+    info = info or {}
+    record = {
+        "time": time.time(),
+        "match": info.get("match"),
+        "players": state_game.get("players"),
+        "latency": latency, # Seconds from the request to our answer
+        "depth": info.get("depth"),
+        "source": info.get("source"),
+        "score": info.get("score"),
+        "move": response["move"],
+        "outcome": move_outcome(state_game, response["move"]),
+        "lives": request.get('lives'),
+    }
+    if request.get('errors'): # The states we got wrong, read back by bench.py
+        record["errors"] = request['errors']
+    return record
+
+def move_response(state_game, start_time): # Runs in the search executor, returns the move message.
+    pos, piece_to_give = game(state_game,start_time) # AI calculates the best move, always a legal one.
+    move_payload = { "pos": pos, "piece": piece_to_give }
+    return { "response": "move", "move": move_payload, "message": f"^^)" }, last_move_info()
+
+async def handle_request(reader, writer, executor): # Answers one request of the game server.
     try:
-        pos, piece_to_give = game(state_game,start_time) # AI calculates the best move.
-        while pos is None and state_game["board"] != [None]*16 and time.time() - start_time < 3: # Retry logic if move calculation failed initially.
-            depth = 6
-            player = str(state_game["current"])
-            pos, piece_to_give = find_best_negamax_move(state_game, player, depth+1)
-        move_payload = { "pos": pos, "piece": piece_to_give }
-        move_response = { "response": "move", "move": move_payload, "message": f"^^)" }
-        conn.sendall((json.dumps(move_response) + '\n').encode('utf-8')) # Send the calculated move.
+        request = await read_message(reader)
+        start_time = time.time()
+        received = time.monotonic()
+        if request is None:
+            return
+        if request.get('request') == 'ping': # Answered here, even while a search is running
+            response = {"response": "pong"}
+        elif request.get('request') == 'play':
+            state_game = request.get('state')
+            loop = asyncio.get_running_loop()
+            response, info = await loop.run_in_executor(executor, move_response, state_game, start_time)
+        else:
+            return
+        writer.write((json.dumps(response) + '\n').encode('utf-8'))
+        await writer.drain()
+        if response["response"] == "move":
+            if TELEMETRY is not None:
+                TELEMETRY.write(move_record(request, response, info, time.monotonic() - received))
+            start_pondering(state_game, response["move"]["pos"], response["move"]["piece"]) # Search the opponent's position until the next request
+    except (ValueError, ConnectionError, asyncio.IncompleteReadError) as e:
+        print(f'Bad request: {e}')
     except Exception as e:
         print(f'1{e}')
     finally:
-        conn.close()
-def refreshdata(conn, addr,ping_data):
-    try:
-        if ping_data.get('request') == 'ping': # Answer pong in json if receive ping from server
-            pong_thread = threading.Thread(target=ponganswer, args=(ping_data,conn)) 
-            pong_thread.start()
-        if ping_data.get('request') == 'play': # Play if server requests a move.
-            start_time = time.time()
-            game_thread = threading.Thread(target=play, args=(ping_data,conn,start_time)) 
-            game_thread.start()
-    except:
-        pass
+        writer.close()
+
+async def start_server(host, port, executor): # Starts listening, returns the asyncio server.
+    return await asyncio.start_server(lambda reader, writer: handle_request(reader, writer, executor), host, port)
+
+async def serve(host, port): # Answers the game server's requests forever.
+    with ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix="search") as executor:
+        server = await start_server(host, port, executor)
+        print(f"Server listening on {(host, port)}...")
+        async with server:
+            await server.serve_forever()
 
 def main(port, host): # Sets up this client's server to listen for game server's requests.
     address = (host, port)
     print(address)
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
-        s.bind(address)
-        s.listen() # Listen for incoming connections from the game server.
-        print(f"Server listening on {address}...")
-        while True:
-            try:
-                conn, addr = s.accept() # Accept connection from game server.
-                ping = conn.recv(1024).decode('utf-8')
-                ping_data = json.loads(ping)
-                refresh_thread = threading.Thread(target=refreshdata, args=(conn,addr, ping_data)) 
-                refresh_thread.start()
-            except socket.timeout:
-                continue
+        asyncio.run(serve(host, port))
     except Exception as e:
         print(e)
 
-# Main program execution
-try:
-    _, s = connection() # Connect to the main game server.
-    host = "0.0.0.0" # Listen on all available interfaces.
-    if s:
-        port_to_listen = identification(s) # Identify and get the port to listen on.
-        s.close() # Close initial connection; server will connect back.
-        if port_to_listen:
-            main(port_to_listen, host) # Start this client's listening server.
+# Settings of algo.py read when they are used, so an override at program start takes effect
+# (the precomputed tables and the encoding constants are not settings)
+SETTINGS = frozenset((
+    "SEARCH_TIME_BUDGET", "MAX_SEARCH_DEPTH", "SEARCH_ALGORITHM", "ASPIRATION_WINDOW", "NODE_CHECK_MASK",
+    "TT_SIZE", "TT_MIN_DEPTH", "SYMMETRY_MAX_PIECES", "LEAF_BATCHING",
+    "PONDER_CHECK_MASK", "PONDER_TIME_LIMIT", "MAX_MATCH_CONTEXTS", "MATCH_IDLE_TIMEOUT", "POOL_GRACE",
+    "ENDGAME_EMPTY_SQUARES", "ENDGAME_TIME_SHARE", "ENDGAME_CACHE_SIZE",
+    "PROOF_SEARCH", "PROOF_MIN_PIECES", "PROOF_TIME_SHARE", "PROOF_TABLE_SIZE", "OPENING_BOOK_PATH"))
+
+def configure(settings): # Applies "NAME=VALUE" overrides of algo settings, e.g. SEARCH_TIME_BUDGET=1.0
+    for setting in settings:
+        name, _, value = setting.partition('=')
+        if name not in SETTINGS:
+            raise ValueError(f"unknown setting {name}")
+        setattr(algo, name, ast.literal_eval(value))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Quarto bot, plays the matches of a tournament server")
+    parser.add_argument("--server", default=SERVER_ADDRESS, help="host:port of the tournament server")
+    parser.add_argument("--port", type=int, default=LISTEN_PORT, help="port the server connects back to")
+    parser.add_argument("--name", default=BOT_NAME)
+    parser.add_argument("--workers", type=int, default=None, help="search processes (default: one per core, 0: none)")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", help="overrides a setting of algo.py")
+    return parser.parse_args(argv)
+
+# Main program execution (guarded: the search worker processes re-import this module)
+if __name__ == "__main__":
+    try:
+        args = parse_args()
+        configure(args.set)
+        if args.workers != 0:
+            start_search_pool(args.workers) # Worker processes for the root-parallel search, started once
+        open_opening_book() # Mapped once, game() looks the early positions up in it
+        TELEMETRY = TelemetryLog() # Latency, depth and outcome of every move, appended to telemetry.jsonl
+        if os.environ.get("QUARTO_TRACE"): # Per-move search statistics, one JSON line per move
+            set_search_trace(JsonlTrace(os.environ["QUARTO_TRACE"]))
+        server_host, server_port = args.server.rsplit(":", 1)
+        _, s = connection(server_host, server_port) # Connect to the main game server.
+        host = "0.0.0.0" # Listen on all available interfaces.
+        if s:
+            port_to_listen = identification(s, args.port, args.name) # Identify and get the port to listen on.
+            s.close() # Close initial connection; server will connect back.
+            if port_to_listen:
+                main(port_to_listen, host) # Start this client's listening server.
+            else:
+                print("Failed to get a port from identification. Exiting.")
         else:
-            print("Failed to get a port from identification. Exiting.")
-    else:
-        print("Failed to establish initial connection. Exiting.")
-except Exception as e:
-    print(f"An unexpected error occurred in main execution: {e}")
\ No newline at end of file
+            print("Failed to establish initial connection. Exiting.")
+    except Exception as e:
+        print(f"An unexpected error occurred in main execution: {e}")
@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import queue
+import threading
+
+# Move telemetry: one JSON line per move, appended by a background thread so
+# the caller never waits for the disk. The log rotates by size like
+# logging's RotatingFileHandler: telemetry.jsonl, then .1 (newest) to .N.
+TELEMETRY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'telemetry.jsonl')
+TELEMETRY_MAX_BYTES = 1 << 20 # Size at which the log is rotated
+TELEMETRY_BACKUPS = 5 # Rotated files kept
+TELEMETRY_QUEUE_SIZE = 1024 # Records waiting for the writer; more are dropped
+LATENCY_BUCKET = 0.001 # Seconds per histogram bucket of the percentile reader
+LATENCY_BUCKETS = 60000 # Up to a minute, slower moves share the last bucket
+
+class TelemetryLog:
+    # Appends records to 'path' as JSON lines from its own thread; write() never blocks
+    def __init__(self, path=TELEMETRY_PATH, max_bytes=TELEMETRY_MAX_BYTES, backups=TELEMETRY_BACKUPS,
+                 queue_size=TELEMETRY_QUEUE_SIZE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue = queue.Queue(queue_size)
+        self.dropped = 0 # Records lost because the queue was full
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Writes the records still queued, then stops the thread
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        f = open(self.path, 'a')
+        try:
+            while True:
+                record = self.queue.get()
+                if record is None:
+                    break
+                try:
+                    line = json.dumps(record, allow_nan=False) + '\n' # Strict JSON readers reject Infinity
+                except (TypeError, ValueError) as e:
+                    print(f"Telemetry error: {e}")
+                    continue
+                if f.tell() and f.tell() + len(line) > self.max_bytes:
+                    f.close()
+                    self._rotate()
+                    f = open(self.path, 'a')
+                f.write(line)
+                if self.queue.empty(): # Flushed once per burst
+                    f.flush()
+        finally:
+            f.close()
+
+    def _rotate(self):
+        # telemetry.jsonl -> .1 -> .2 ... the oldest is dropped
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+def log_files(path=TELEMETRY_PATH):
+    # The log and its rotated files that exist, oldest first
+    rotated = []
+    i = 1
+    while os.path.exists(f"{path}.{i}"):
+        rotated.append(f"{path}.{i}")
+        i += 1
+    return rotated[::-1] + ([path] if os.path.exists(path) else [])
+
+def read_records(path=TELEMETRY_PATH):
+    # Every record of the log and its rotated files, oldest first, one at a time
+    for file_path in log_files(path):
+        with open(file_path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError: # Line cut by a crash
+                    continue
+
+class LatencyHistogram:
+    # Percentiles of a stream of latencies in constant memory, to the nearest LATENCY_BUCKET
+    def __init__(self):
+        self.counts = [0] * LATENCY_BUCKETS
+        self.total = 0
+
+    def add(self, seconds):
+        self.counts[min(LATENCY_BUCKETS - 1, max(0, int(seconds / LATENCY_BUCKET)))] += 1
+        self.total += 1
+
+    def percentile(self, q):
+        # Upper bound of the bucket holding the nearest-rank q-th percentile, None when empty
+        if not self.total:
+            return None
+        rank = max(1, -(-q * self.total // 100))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return (i + 1) * LATENCY_BUCKET
+
+def latency_percentiles(path=TELEMETRY_PATH, qs=(50, 90, 99)):
+    # Move latency percentiles over the log and its rotated files, read in one pass
+    histogram = LatencyHistogram()
+    for record in read_records(path):
+        if isinstance(record.get("latency"), (int, float)):
+            histogram.add(record["latency"])
+    stats = {"moves": histogram.total}
+    stats.update({f"p{q}": histogram.percentile(q) for q in qs})
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move latency percentiles of the telemetry log")
+    parser.add_argument("path", nargs="?", default=TELEMETRY_PATH)
+    args = parser.parse_args(argv)
+    print(json.dumps(latency_percentiles(args.path), indent=2))
+
+if __name__ == "__main__":
+    main()
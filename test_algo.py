@@ -1,7 +1,6 @@
 import pytest
 from unittest.mock import patch, MagicMock
 import random
-import copy
 import sys
 sys.path.append('.')  # Add current directory to path if needed
 
@@ -40,6 +39,16 @@ class TestAlgo:
         # Non-standard order should be standardized
         mixed_piece = 'PBEL'  # Pyramid Big Empty Light in non-standard order
         assert algo.conversion_piece(mixed_piece) == 'BLEP'  # Should reorder to standard
+        assert algo.conversion_piece('CSLF') == 'SLFC'  # As the server sends them
+
+        # Every letter order of every piece has a code, and nothing else
+        assert len(algo.PIECE_CODES) == 16 * 24
+        for code, pid in algo.PIECE_CODES.items():
+            assert sorted(code) == sorted(algo.PIECES[pid])
+            assert algo.conversion_piece(code) == algo.PIECES[pid]
+        for bad in ('BSEP', 'BLE', 'BLEPC', 'blep', ''):
+            with pytest.raises(KeyError):
+                algo.conversion_piece(bad)
     
     def test_same(self):
         # Test if pieces share at least one attribute
@@ -145,17 +154,14 @@ class TestAlgo:
         board = ['BLEP', 'SDFC', 'BDFC', 'SLEP'] * 4
         assert algo.isFull(board) == True
     
-    @patch('copy.deepcopy')
-    def test_apply(self, mock_deepcopy):
+    def test_apply(self):
         # Test move application
         state = {
             "current": "0",
             "board": [None] * 16,
             "piece": "BLEP"
         }
-        # Setup the mock to return a copy of the state
-        mock_deepcopy.return_value = copy.deepcopy(state)
-        
+
         # Apply a valid move
         result = algo.apply(state, (5, "BLEP", "SDFC"))
         
@@ -163,6 +169,7 @@ class TestAlgo:
         assert result["board"][5] == "BLEP"
         assert result["current"] == "1"  # Player changed from 0 to 1
         assert result["piece"] == "SDFC"
+        assert state["board"][5] is None and state["current"] == "0" # The original state is untouched
     
     def test_check_threat(self):
         # Test threat detection (3 pieces with a common attribute)
@@ -200,70 +207,996 @@ class TestAlgo:
         # Score should increase with threats and center control
         assert score_with_threat_and_center > score_empty
     
-    @patch('algo.evaluate_heuristic')
-    @patch('algo.utility')
-    def test_negamax(self, mock_utility, mock_evaluate):
-        # Test negamax algorithm with various scenarios
+    def test_to_bitstate(self):
+        # Test conversion of a server state (shuffled letters) into the bitboard
         state = {
             "players": ["Player1", "Player2"],
-            "current": "0",
-            "board": [None] * 16, 
-            "piece": "BLEP"
+            "current": 1,
+            "board": ['PBEL', None, 'None', None] + [None] * 11 + ['SDFC'],
+            "piece": "FBCD"
         }
+        bits = algo.to_bitstate(state)
+        assert bits.board & 15 == algo.PIECE_IDS['BLEP']
+        assert bits.board >> 60 == algo.PIECE_IDS['SDFC']
+        assert bits.occupied == (1 << 0) | (1 << 15)
+        assert bits.piece == algo.PIECE_IDS['BDFC']
+        assert bits.current == 1
+        # Pieces on the board and in hand are not available anymore
+        assert bin(bits.available).count('1') == 13
+        assert not bits.available & (1 << algo.PIECE_IDS['BDFC'])
+
+        # Converting back gives the canonical names
+        back = algo.from_bitstate(bits, state["players"])
+        assert back["board"][0] == 'BLEP'
+        assert back["board"][15] == 'SDFC'
+        assert back["piece"] == 'BDFC'
+
+    def test_wins_at(self):
+        # Test bitboard win detection on rows and the anti-diagonal
+        state = {"current": 0, "board": ['BLEP', 'BLFC', 'BDEP', 'BDFC'] + [None] * 12, "piece": None}
+        bits = algo.to_bitstate(state)
+        assert algo.wins_at(bits.board, bits.occupied, 3) == True
+        assert algo.has_winner(bits.board, bits.occupied) == True
+
+        # Shared absent attribute (all Small) also wins
+        board = [None] * 16
+        for sq, p in zip((3, 6, 9, 12), ['SLEP', 'SDFC', 'SLFC', 'SDEP']):
+            board[sq] = p
+        bits = algo.to_bitstate({"current": 0, "board": board, "piece": None})
+        assert algo.wins_at(bits.board, bits.occupied, 12) == True
+
+        # Nothing in common
+        board[12] = 'BDEC'
+        board[6] = 'SLFP'
+        bits = algo.to_bitstate({"current": 0, "board": board, "piece": None})
+        assert algo.has_winner(bits.board, bits.occupied) == False
+
+    def test_evaluate_bits(self):
+        # Test that the bitboard heuristic matches evaluate_heuristic
+        state = {"board": [None] * 16, "current": 0, "piece": None}
+        state["board"][0] = 'BLEP'
+        state["board"][1] = 'BDFC'
+        state["board"][2] = 'BLFC'  # Creates a threat in first row (all big)
+        state["board"][5] = 'SDFC'  # Center piece
+        bits = algo.to_bitstate(state)
+        assert algo.evaluate_bits(bits.board, bits.occupied) == algo.evaluate_heuristic(state, 0)
+
+    @patch('algo.LineTracker.evaluate')
+    def test_negamax(self, mock_evaluate):
+        # Test negamax algorithm with various scenarios
         player = "0"
-        depth = 2
-        
-        # Terminal state case
-        with patch('algo.winner', return_value=0):
-            with patch('algo.isFull', return_value=True):
-                mock_utility.return_value = float('inf')
-                result = algo.negamax(state, player, depth)
-                assert result == float('inf')
-        
+
+        # Terminal state case: a full board without winner is a draw
+        full_board = ['BLEP', 'SDFC', 'BDFC', 'SLEP',
+                      'SDEP', 'BLFC', 'SLFC', 'BDEP',
+                      'BLEC', 'SDEC', 'BDEC', 'SLEC',
+                      'SDFP', 'BLFP', 'SLFP', 'BDFP']
+        state = algo.to_bitstate({"current": 0, "board": full_board, "piece": None})
+        assert algo.negamax(state, player, 2) == 0
+
         # Non-terminal state at depth 0
-        with patch('algo.winner', return_value=False):
-            with patch('algo.isFull', return_value=False):
-                mock_evaluate.return_value = 42
-                result = algo.negamax(state, player, 0)
-                assert result == 42
-    
+        state = algo.to_bitstate({"current": 0, "board": [None] * 16, "piece": "BLEP"})
+        mock_evaluate.return_value = 42
+        result = algo.negamax(state, player, 0)
+        assert result == 42
+
+    def test_zobrist_hash(self):
+        # Test that the incremental hash matches a full recomputation
+        state = algo.to_bitstate({"current": 0, "board": ['BLEP', 'SDFC'] + [None] * 14, "piece": "BLFC"})
+        given = algo.PIECE_IDS['SLEC']
+        child = algo.BitState(state.board | (state.piece << 8), state.occupied | (1 << 2),
+                              state.available & ~(1 << given), given, 1)
+        search_state = algo.SearchState(state)
+        search_state.make((2, given))
+        assert search_state.key == algo.zobrist_hash(child)
+        search_state.unmake((2, given))
+        assert search_state.key == algo.zobrist_hash(state)
+        # The side to move is part of the key
+        assert algo.zobrist_hash(child) != algo.zobrist_hash(child._replace(current=0))
+
+    def test_perft(self):
+        # Test the bitboard perft against a count made with the list-based helpers
+        def list_wins(board):
+            lines = [algo.getLine(board, i) for i in range(4)] + [algo.getColumn(board, i) for i in range(4)]
+            lines += [algo.getDiagonal(board, 1), [board[3], board[6], board[9], board[12]]]
+            return any(algo.same(line) for line in lines)
+
+        def list_perft(state, depth):
+            if depth == 0:
+                return 1
+            used = {p for p in state["board"] if p is not None} | {state["piece"]}
+            pieces = [p for p in algo.piece() if p not in used]
+            count = 0
+            for pos in range(16):
+                if state["board"][pos] is not None:
+                    continue
+                placed = algo.apply(state, (pos, state["piece"], None))
+                if not pieces or list_wins(placed["board"]):
+                    count += depth == 1
+                    continue
+                for p in pieces:
+                    count += list_perft(dict(placed, piece=p), depth - 1)
+            return count
+
+        states = [
+            {"current": "0", "board": ['BLEP', 'BLFC', 'BDEP'] + [None] * 13, "piece": "SDFC"},
+            {"current": "0", "board": ['BLEP', 'BDFC', 'SLEP', 'SDEC',
+                                       'SDFC', None, 'BLFP', None,
+                                       None, None, 'SLFC', None,
+                                       None, 'BDEC', None, None], "piece": "SDFP"},
+            {"current": "1", "board": [None, None, 'SDEP', 'SLEP',
+                                       'SDFC', None, 'BDFP', 'BDEC',
+                                       'BDEP', 'BLFC', 'SDEC', None,
+                                       None, None, 'BLEP', 'SLEC'], "piece": "SLFP"},
+        ]
+        for state in states:
+            bits = algo.to_bitstate(state)
+            for depth in (1, 2, 3) if algo.POPCOUNT[bits.occupied] > 4 else (1, 2): # The list count is slow
+                assert algo.perft(bits, depth) == list_perft(state, depth)
+            divide = algo.perft(bits, 2, divide=True)
+            assert sorted(divide) == sorted(algo.perft_moves(bits))
+            assert sum(divide.values()) == algo.perft(bits, 2)
+            assert algo.perft_unique(bits, 2) <= algo.perft(bits, 2)
+
+        # From the empty board: 16 pieces to give, then 16 squares x 15 pieces
+        start = algo.BitState(0, 0, algo.FULL, None, 0)
+        assert [algo.perft(start, d) for d in (1, 2, 3)] == [16, 3840, 806400]
+        assert [algo.perft_unique(start, d) for d in (1, 2, 3)] == [1, 8, 148]
+        # A winning placement is one move that ends the game
+        bits = algo.to_bitstate({"current": 0, "board": ['BLEP', 'BLFC', 'BDEP'] + [None] * 13, "piece": "BDFC"})
+        assert algo.perft(bits, 2, divide=True)[(3, None)] == 0
+        assert algo.perft(bits, 1, divide=True)[(3, None)] == 1
+
+    def test_search_state(self):
+        # Test that make/unmake keep the key and line counters right and restore the position
+        bits = algo.to_bitstate({"current": 0, "board": ['BLEP', 'SDFC', 'BLFC'] + [None] * 13, "piece": "BDEC"})
+        state = algo.SearchState(bits)
+        assert state.key == algo.zobrist_hash(bits)
+        moves = [(3, algo.PIECE_IDS['SLEC']), (7, algo.PIECE_IDS['BDFP']), (11, None)]
+        for move in moves:
+            state.make(move)
+            current = state.bits()
+            assert state.key == algo.zobrist_hash(current)
+            assert state.lines.words == algo.LineTracker(current.board, current.occupied).words
+        assert state.current == 1 and state.piece is None
+        assert current.board >> (4 * 3) & 15 == algo.PIECE_IDS['BDEC']
+        for move in reversed(moves):
+            state.unmake(move)
+        assert state.bits() == bits
+        assert state.key == algo.zobrist_hash(bits)
+
+        # negamax gives the position back as it found it
+        state.make((3, algo.PIECE_IDS['SLEC']))
+        before = state.bits()
+        algo.negamax(state, 1, 3, ctx=algo.SearchContext())
+        assert state.bits() == before
+
+    def test_transposition_table(self):
+        # Test probe/store, counters and the two-slot replacement policy
+        tt = algo.TranspositionTable(size=4)
+        assert len(tt.slots) == 4
+        assert tt.probe(1) is None
+        assert tt.misses == 1
+
+        tt.store(1, 5, 10, algo.EXACT, (3, 4))
+        assert tt.probe(1) == (1, 5, 10, algo.EXACT, (3, 4))
+        assert tt.hits == 1
+
+        # Same bucket, shallower: goes in the always-replace slot and keeps the deep one
+        tt.store(3, 2, 7, algo.LOWER, None)
+        tt.store(5, 1, 8, algo.UPPER, None)
+        assert tt.probe(1) is not None
+        assert tt.probe(3) is None
+        assert tt.probe(5) == (5, 1, 8, algo.UPPER, None)
+        assert tt.collisions == 1
+
+        # Deeper result takes the depth-preferred slot
+        tt.store(7, 9, 1, algo.EXACT, None)
+        assert tt.probe(1) is None
+        assert tt.stats()["used"] == 2
+
+        tt.clear()
+        assert tt.stats() == {"size": 4, "used": 0, "hits": 0, "misses": 0, "collisions": 0}
+
+    def test_negamax_with_tt(self):
+        # Test that the transposition table doesn't change the search result
+        state = algo.to_bitstate({
+            "current": 0,
+            "board": ['BLEP', 'BDFC', 'SLEP', None,
+                      'SDFC', None, None, None,
+                      None, 'SDEC', None, None,
+                      None, None, 'BLFP', None],
+            "piece": "BLFC"})
+        ctx = algo.SearchContext()
+        assert algo.negamax(state, 0, 3, ctx=ctx) == algo.negamax(state, 0, 3)
+        assert ctx.tt.stats()["used"] > 0
+
+    def test_negamax_fail_soft(self):
+        # Test that a search outside its window returns a bound on the exact value, on either side
+        random.seed(23383)
+        for _ in range(30):
+            board, occupied, available = 0, 0, algo.FULL
+            for sq in random.sample(range(16), 6):
+                piece = random.choice(algo.bit_indices(available))
+                board |= piece << (4 * sq)
+                occupied |= 1 << sq
+                available &= ~(1 << piece)
+            piece = random.choice(algo.bit_indices(available))
+            state = algo.BitState(board, occupied, available & ~(1 << piece), piece, 0)
+            exact = algo.negamax(state, 0, 3)
+            for alpha, beta in ((-100, -50), (-20, 20), (50, 100), (exact - 1, exact + 1)):
+                value = algo.negamax(state, 0, 3, alpha, beta, algo.SearchContext())
+                if value <= alpha:
+                    assert exact <= value
+                elif value >= beta:
+                    assert exact >= value
+                else:
+                    assert value == exact
+
+    def test_unsafe_pieces(self):
+        # Test that the unsafe mask lists exactly the pieces winning on the spot
+        bits = algo.to_bitstate({
+            "current": 0,
+            "board": ['BLEP', 'BDFC', 'BLFP', None,
+                      'SDFC', 'SLEP', None, None,
+                      None, 'SDEC', None, None,
+                      'SLFC', None, 'BLFP', None],
+            "piece": None})
+        unsafe = algo.unsafe_pieces(bits.board, bits.occupied)
+        for p in range(16):
+            wins = any(algo.wins_at(bits.board | p << (4 * sq), bits.occupied | 1 << sq, sq)
+                       for sq in range(16) if not bits.occupied >> sq & 1)
+            assert bool(unsafe >> p & 1) == wins
+        assert algo.unsafe_pieces(0, 0) == 0
+
+    def test_line_tracker(self):
+        # Test that the incremental counters agree with a full scan after any place/remove
+        rng = random.Random(7)
+        for _ in range(20):
+            board, occupied = 0, 0
+            lines = algo.LineTracker(0, 0)
+            placed = []
+            for _ in range(rng.randint(4, 16)):
+                sq = rng.choice(algo.bit_indices(algo.FULL & ~occupied))
+                p = rng.randrange(16)
+                board |= p << (4 * sq)
+                occupied |= 1 << sq
+                lines.place(sq, p)
+                placed.append((sq, p))
+                assert lines.evaluate(occupied) == algo.evaluate_bits(board, occupied)
+                assert lines.unsafe() == algo.unsafe_pieces(board, occupied)
+            assert lines.words == algo.LineTracker(board, occupied).words
+            for sq, p in reversed(placed[rng.randint(0, len(placed) - 1):]):
+                board &= ~(15 << (4 * sq))
+                occupied &= ~(1 << sq)
+                lines.remove(sq, p)
+                assert lines.evaluate(occupied) == algo.evaluate_bits(board, occupied)
+                assert lines.unsafe() == algo.unsafe_pieces(board, occupied)
+
+    @pytest.mark.skipif(algo.np is None, reason="NumPy is not installed")
+    def test_batch_leaf_value(self):
+        # Test that the batched depth-1 evaluation matches the scalar one
+        rng = random.Random(5)
+        ctx = algo.SearchContext(tt_size=1)
+        checked = 0
+        while checked < 300:
+            k = rng.randint(1, 14)
+            squares, pieces = rng.sample(range(16), k), rng.sample(range(16), k + 1)
+            board = sum(p << (4 * sq) for sq, p in zip(squares, pieces))
+            occupied = sum(1 << sq for sq in squares)
+            if algo.has_winner(board, occupied):
+                continue
+            state = algo.SearchState(algo.BitState(board, occupied, algo.FULL & ~sum(1 << p for p in pieces), pieces[k], 0))
+            ctx.leaf_batching = False
+            scalar = algo.negamax(state, 0, 1, ctx=ctx)
+            ctx.leaf_batching = True
+            assert algo.negamax(state, 0, 1, ctx=ctx) == scalar
+            checked += 1
+
+        # Last piece placed without winning
+        state = algo.SearchState(algo.to_bitstate({"current": 0, "board": [None] + [algo.PIECES[p] for p in (
+            1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15)], "piece": algo.PIECES[0]}))
+        assert algo.batch_leaf_value(state) == algo.negamax(state, 0, 1)
+
+    def test_move_ordering(self):
+        # Test the order of the placements and of the pieces to give
+        killers = [(7, 2), None]
+        history = [0] * 16
+        history[9] = 50
+        assert algo.order_placements((1, 5, 7, 9), (5, 3), killers, history) == [5, 7, 9, 1]
+        assert algo.order_placements((1, 7, 9), (5, 3), killers, history) == [7, 9, 1]
+
+        piece_history = [0] * 16
+        piece_history[4] = 10
+        piece_history[6] = 20
+        assert algo.order_pieces((1, 2, 4, 6), 7, (5, 3), killers, piece_history) == [2, 6, 4, 1]
+        assert algo.order_pieces((1, 2, 4, 6), 5, (5, 1), killers, piece_history) == [1, 6, 4, 2]
+
+    def test_move_ordering_nodes(self):
+        # Test that the ordered search finds the same value and counts its cutoffs
+        state = algo.to_bitstate({
+            "current": 0,
+            "board": ['BLEP', 'BDFC', 'SLEP', None,
+                      'SDFC', None, None, None,
+                      None, 'SDEC', None, None,
+                      None, None, 'BLFP', None],
+            "piece": "BLFC"})
+        ctx = algo.SearchContext()
+        ctx.tt = algo.TranspositionTable(1) # Hardly any help from the table
+        assert algo.negamax(state, 0, 3, ctx=ctx) == algo.negamax(state, 0, 3)
+        assert ctx.cutoffs > 0
+        assert 0 < ctx.first_move_cutoffs <= ctx.cutoffs
+        assert any(k[0] is not None for k in ctx.killers)
+
+    def test_match_context(self):
+        # Test that a match keeps its context between moves and that old matches are evicted
+        algo.MATCH_CONTEXTS.clear()
+        state = {"players": ["A", "B"], "current": 0, "board": ['BLEP'] + [None] * 15, "piece": "SDFC"}
+        ctx = algo.match_context(state, algo.to_bitstate(state))
+        state["board"][1] = 'SLEP'
+        assert algo.match_context(state, algo.to_bitstate(state)) is ctx
+
+        # Fewer pieces on the board: a new match between the same players
+        state["board"] = [None] * 16
+        assert algo.match_context(state, algo.to_bitstate(state)) is not ctx
+
+        # Least recently used matches go first
+        with patch('algo.MAX_MATCH_CONTEXTS', 2):
+            for players in (["C", "D"], ["E", "F"]):
+                other = dict(state, players=players)
+                algo.match_context(other, algo.to_bitstate(other))
+        assert list(algo.MATCH_CONTEXTS) == [("C", "D"), ("E", "F")]
+
+        # Idle matches are dropped, finished ones can be dropped explicitly
+        algo.MATCH_CONTEXTS[("C", "D")].last_used -= algo.MATCH_IDLE_TIMEOUT + 1
+        algo.match_context(state, algo.to_bitstate(state))
+        assert list(algo.MATCH_CONTEXTS) == [("E", "F"), ("A", "B")]
+        algo.end_match(["A", "B"])
+        assert list(algo.MATCH_CONTEXTS) == [("E", "F")]
+        algo.MATCH_CONTEXTS.clear()
+
+    def test_principal_variation(self):
+        # Test that the search leaves a playable principal variation in its context
+        state = algo.to_bitstate({
+            "current": 0,
+            "board": ['BLEP', 'BDFC', 'SLEP', None,
+                      'SDFC', None, None, None,
+                      None, 'SDEC', None, None,
+                      None, None, 'BLFP', None],
+            "piece": "BLFC"})
+        ctx = algo.SearchContext()
+        move = algo.find_best_negamax_move(state, "0", 3, ctx)
+        assert ctx.pv[0] == move
+        assert len(ctx.pv) >= 1
+        squares = [sq for sq, _ in ctx.pv]
+        assert len(set(squares)) == len(squares)
+
+    def test_board_symmetries(self):
+        # Test that the 32 board maps are distinct and keep the winning lines
+        assert len(algo.BOARD_SYMMETRIES) == 32
+        assert len(set(algo.BOARD_SYMMETRIES)) == 32
+        lines = {frozenset(line) for line in algo.LINES}
+        for sym in algo.BOARD_SYMMETRIES:
+            assert {frozenset(sym[sq] for sq in line) for line in algo.LINES} == lines
+
+    def test_canonical_form(self):
+        # Test that symmetric positions share the same canonical form
+        state = algo.to_bitstate({
+            "current": 1,
+            "board": ['BLEP', None, None, 'SDFC',
+                      None, 'BDEC', None, None,
+                      None, None, None, None,
+                      'SLFP', None, None, None],
+            "piece": "BLFC"})
+        canonical, transform = algo.canonical_form(state)
+
+        # Rotate the board and swap the Big/Small and Light/Dark letters
+        sym = algo.BOARD_SYMMETRIES[1]
+        table = algo.PERM_TABLES[5]
+        board = occupied = available = 0
+        for sq in algo.bit_indices(state.occupied):
+            board |= (table[(state.board >> (4 * sq) & 15) ^ 0b1100]) << (4 * sym[sq])
+            occupied |= 1 << sym[sq]
+        for p in algo.bit_indices(state.available):
+            available |= 1 << table[p ^ 0b1100]
+        other = algo.BitState(board, occupied, available, table[state.piece ^ 0b1100], 1)
+        assert algo.canonical_form(other)[0] == canonical
+        assert algo.canonical_hash(other) == algo.canonical_hash(state)
+
+        # The transform sends the position and its moves to the canonical frame
+        assert canonical.piece == algo.transform_move((None, state.piece), transform)[1]
+        sq, p = algo.transform_move((0, state.board & 15), transform)
+        assert canonical.board >> (4 * sq) & 15 == p
+        assert algo.untransform_move((sq, p), transform) == (0, state.board & 15)
+
+    def test_search_symmetries(self):
+        # Test that the heuristic search only shares values between positions of equal value
+        assert len(algo.SEARCH_SYMMETRIES) == 16
+        for s in algo.SEARCH_SYMMETRIES:
+            assert {algo.BOARD_SYMMETRIES[s][sq] for sq in algo.bit_indices(algo.CENTER)} == set(algo.bit_indices(algo.CENTER))
+        random.seed(23383)
+        for _ in range(60):
+            k = random.randint(2, algo.SYMMETRY_MAX_PIECES)
+            board, occupied, available = 0, 0, algo.FULL
+            for sq in random.sample(range(16), k):
+                piece = random.choice(algo.bit_indices(available))
+                board |= piece << (4 * sq)
+                occupied |= 1 << sq
+                available &= ~(1 << piece)
+            piece = random.choice(algo.bit_indices(available))
+            state = algo.BitState(board, occupied, available & ~(1 << piece), piece, 0)
+            canonical, _ = algo.canonical_form(state, algo.SEARCH_SYMMETRIES)
+            assert algo.negamax(canonical, 0, 2) == algo.negamax(state, 0, 2)
+            # The table of a search shared through the symmetries doesn't change its value
+            assert algo.negamax(state, 0, 3, ctx=algo.SearchContext()) == algo.negamax(state, 0, 3)
+        # The root, the table and negamax fold the same positions, up to SYMMETRY_MAX_PIECES included
+        state = algo.to_bitstate({"current": 1, "board": ['BLEP'] + [None] * 15, "piece": "SDFC"})
+        with patch('algo.SYMMETRY_MAX_PIECES', 1):
+            assert algo.uses_symmetry(state.occupied) and not algo.uses_symmetry(state.occupied | 2)
+            assert len(algo.root_moves(state)) < 15 * 14 // 4
+
+    @patch('algo.negamax', return_value=0)
+    def test_find_best_negamax_move_symmetries(self, mock_negamax):
+        # Test that symmetric root moves are only searched once
+        state = algo.to_bitstate({"current": 1, "board": ['BLEP'] + [None] * 15, "piece": "SDFC"})
+        algo.find_best_negamax_move(state, "1", 2)
+        # 15 placements x 14 pieces without the symmetries
+        assert 0 < mock_negamax.call_count < 15 * 14 // 4
+
     @patch('algo.negamax')
     def test_find_best_negamax_move(self, mock_negamax):
         # Test move selection
-        state = {
+        state = algo.to_bitstate({
                 "players": ["LUR", "FKY"],
                 "current": 0,
                 "board": [
                     'BDEP', 'SDEP', None,  None,
-                    'BLEP', 'BLEC', 'BLFP', None,
+                    'SLEP', 'BLEC', 'BLFP', None,
                     'SLEC', 'SLFP', 'SLFC', None,
                     None,   None,  None,   None
                 ],
-                "piece": "BLEP"}
+                "piece": "BLEP"})
+        # Only two pieces left to give
+        state = state._replace(available=(1 << algo.PIECE_IDS['SDFC']) | (1 << algo.PIECE_IDS['BDFC']))
         player = "0"
         depth = 2
-        
-        # Mock negamax to return higher score for position 3
-        def mock_negamax_side_effect(next_state, opponent, depth, alpha, beta):
-            pos = next_state["board"].index("BLEP")
+
+        # Mock negamax to return higher score for position 7
+        def mock_negamax_side_effect(next_state, opponent, depth, alpha, beta, ctx=None):
+            pos = (next_state.occupied & ~state.occupied).bit_length() - 1
             if pos == 7:
                 return -100  # Higher negated score for opponent means better for current player
             return -50
-        
+
         mock_negamax.side_effect = mock_negamax_side_effect
-        
+
         # Find best move with mocked evaluation
-        with patch('algo.piece', return_value=['SDFC', 'BDFC']):
-            pos, piece = algo.find_best_negamax_move(state, player, depth)
-            print(pos,piece)
-            assert pos == 7
-            assert piece in ['SDFC', 'BDFC']
-    
+        pos, piece = algo.find_best_negamax_move(state, player, depth)
+        assert pos == 7
+        assert algo.PIECES[piece] in ['SDFC', 'BDFC']
+
+    def test_search_deadline(self):
+        # Test that the search stops by itself once the deadline is reached
+        state = algo.to_bitstate({
+            "current": 0,
+            "board": ['BLEP', 'BDFC', 'SLEP', None,
+                      'SDFC', None, None, None,
+                      None, 'SDEC', None, None,
+                      None, None, 'BLFP', None],
+            "piece": "BLFC"})
+        ctx = algo.SearchContext()
+        ctx.deadline = 0  # Already over
+        with pytest.raises(algo.SearchTimeout):
+            algo.negamax(state, 0, 6, ctx=ctx)
+
+        # At the root, the moves searched before the deadline are kept
+        ctx = algo.SearchContext()
+        ctx.deadline = algo.time.monotonic() + 0.2
+        start = algo.time.monotonic()
+        pos, piece = algo.find_best_negamax_move(state, "0", 5, ctx)
+        assert algo.time.monotonic() - start < 1
+        assert ctx.aborted
+        assert not state.occupied >> pos & 1
+        assert state.available >> piece & 1
+
+    def test_game_time_budget(self):
+        # Test that game() answers within its budget and leaves no thread behind
+        import threading
+        state = {
+            "players": ["Budget1", "Budget2"],
+            "current": 0,
+            "board": ['BLEP', None, None, None,
+                      None, 'SDFC', None, None,
+                      None, None, None, None,
+                      None, None, None, None],
+            "piece": "BDEC"}
+        threads = threading.active_count()
+        with patch('algo.SEARCH_TIME_BUDGET', 0.3):
+            start = algo.time.monotonic()
+            pos, piece = algo.game(state, algo.time.time())
+            assert algo.time.monotonic() - start < 1
+        assert threading.active_count() == threads
+        assert state["board"][pos] is None
+        assert algo.conversion_piece(piece) not in ('BLEP', 'SDFC', 'BDEC')
+        algo.end_match(state["players"])
+
+        # A request that waited past the budget is answered at once with a legal move
+        start = algo.time.monotonic()
+        pos, piece = algo.game(state, algo.time.time() - algo.SEARCH_TIME_BUDGET - 0.1)
+        assert algo.time.monotonic() - start < 0.1
+        assert state["board"][pos] is None
+        assert algo.conversion_piece(piece) not in ('BLEP', 'SDFC', 'BDEC')
+        algo.end_match(state["players"])
+
+        # ... and the quick move still takes a win on the spot
+        won = {"players": ["Late1", "Late2"], "current": 0, "board": ['BLEP', 'BLFC', 'BDEP'] + [None] * 13, "piece": "BDFC"}
+        pos, piece = algo.game(won, algo.time.time() - algo.SEARCH_TIME_BUDGET - 0.1)
+        assert pos == 3
+
+        # ... and doesn't give a piece that wins: BLEP would, placed on the first empty square
+        late = {"players": ["Late3", "Late4"], "current": 0,
+                "board": ['SLFP', None, 'BDEC', None,
+                          'SLEC', None, None, None,
+                          'BLEC', 'BDFP', 'SLFC', 'SDFC',
+                          None, 'BDEP', 'BLFP', None],
+                "piece": "SDEP"}
+        bits = algo.to_bitstate(late)
+        assert algo.winning_square(bits) is None
+        assert algo.unsafe_pieces(bits.board | bits.piece << 4, bits.occupied | 1 << 1) >> algo.PIECE_IDS['BLEP'] & 1
+        pos, piece = algo.game(late, algo.time.time() - algo.SEARCH_TIME_BUDGET - 0.1)
+        after = bits.board | bits.piece << (4 * pos), bits.occupied | 1 << pos
+        assert late["board"][pos] is None
+        assert not algo.unsafe_pieces(*after) >> algo.PIECE_CODES[piece] & 1
+        algo.end_match(late["players"])
+
+    def test_search_trace(self, tmp_path):
+        # Test the per-move records of game() in both sinks
+        state = {
+            "players": ["Trace1", "Trace2"],
+            "current": 0,
+            "board": ['BLEP', 'BDFC', 'SLEP', None,
+                      'SDFC', None, None, None,
+                      None, 'SDEC', None, None,
+                      None, None, 'BLFP', None],
+            "piece": "BLFC"}
+        ring = algo.RingBufferTrace(size=2)
+        previous = algo.set_search_trace(ring)
+        try:
+            with patch('algo.SEARCH_TIME_BUDGET', 0.3), patch('algo.OPENING_BOOK', None):
+                pos, piece = algo.game(state, algo.time.time())
+        finally:
+            assert algo.set_search_trace(previous) is ring
+        record, = ring.records
+        assert record["source"] == "search"
+        assert record["pieces"] == 6
+        assert record["move"] == [pos, algo.PIECE_IDS[algo.conversion_piece(piece)]]
+        assert record["depth"] >= 2 and record["depth"] == max(it["depth"] for it in record["iterations"] if it["complete"])
+        assert record["nodes"] >= sum(it["nodes"] for it in record["iterations"]) > 0 # Plus the depth cut short
+        assert 0 < record["cutoff_rate"] <= 1 and 0 <= record["first_move_cutoff_rate"] <= 1
+        assert record["pv"][0] == record["move"]
+        algo.end_match(state["players"])
+
+        # Book moves are traced too, to a JSONL file
+        book = MagicMock()
+        book.move.return_value = (3, algo.PIECE_IDS['SLEC'])
+        path = tmp_path / "trace.jsonl"
+        trace = algo.JsonlTrace(str(path))
+        previous = algo.set_search_trace(trace)
+        try:
+            with patch('algo.OPENING_BOOK', book):
+                algo.game(state, algo.time.time())
+                algo.game(state, algo.time.time())
+        finally:
+            algo.set_search_trace(previous)
+            trace.close()
+        records = [algo.json.loads(line) for line in path.read_text().splitlines()]
+        assert [r["source"] for r in records] == ["book", "book"]
+        assert records[0]["move"] == [3, algo.PIECE_IDS['SLEC']] and records[0]["iterations"] == []
+        algo.end_match(state["players"])
+
+        # A lost position: every piece left lets the opponent win, and the record is still strict JSON
+        lost = {"players": ["Trace3", "Trace4"], "current": 0,
+                "board": ['SLFP', 'SLEC', 'BDEC', 'SLFC',
+                          'SDEP', None, 'BDEP', 'BLEP',
+                          'BDFC', 'SDEC', None, None,
+                          'BLEC', 'SLEP', None, 'BDFP'],
+                "piece": "BLFC"}
+        def reject(constant):
+            raise ValueError(f"not JSON: {constant}")
+        path = tmp_path / "lost.jsonl"
+        trace = algo.JsonlTrace(str(path))
+        previous = algo.set_search_trace(trace)
+        try:
+            with patch('algo.ENDGAME_EMPTY_SQUARES', 0), patch('algo.PROOF_SEARCH', False), patch('algo.OPENING_BOOK', None):
+                algo.game(lost, algo.time.time())
+        finally:
+            algo.set_search_trace(previous)
+            trace.close()
+        record = algo.json.loads(path.read_text(), parse_constant=reject)
+        assert record["source"] == "search" and record["score"] == "loss"
+        assert all(it["score"] == "loss" for it in record["iterations"])
+        assert algo.last_move_info()["score"] == "loss"
+        algo.json.loads(algo.json.dumps(algo.last_move_info()), parse_constant=reject)
+
+        # The opening moves are random, not a search of depth 2
+        for piece in (None, "SDFC"):
+            opening = {"players": ["Trace5", "Trace6"], "current": 0, "board": [None] * 16, "piece": piece}
+            with patch('algo.OPENING_BOOK', None):
+                algo.game(opening, algo.time.time())
+            info = algo.last_move_info()
+            assert info["source"] == "random" and info["depth"] == 0 and info["score"] is None
+            algo.end_match(opening["players"])
+
+    def test_pondering(self):
+        # Test that the ponder search fills the match's table and stops within milliseconds
+        state = {
+            "players": ["Ponder1", "Ponder2"],
+            "current": 0,
+            "board": ['BLEP', None, None, None,
+                      None, 'SDFC', None, None,
+                      None, None, 'BDEC', None,
+                      None, None, None, 'SLFP'],
+            "piece": "BLFC"}
+        with patch('algo.SEARCH_TIME_BUDGET', 0.2), patch('algo.OPENING_BOOK', None):
+            pos, piece = algo.game(state, algo.time.time())
+        ctx = algo.MATCH_CONTEXTS[("Ponder1", "Ponder2")]
+        used = ctx.tt.stats()["used"]
+        ponder = algo.start_pondering(state, pos, piece)
+        try:
+            assert ponder is not None and ponder.ctx.tt is ctx.tt
+            assert ponder.bits.piece == algo.PIECE_IDS[algo.conversion_piece(piece)] and ponder.bits.current == 1
+            algo.time.sleep(0.3)
+            assert ponder.thread.is_alive() and ponder.ctx.nodes > 0
+            start = algo.time.monotonic()
+        finally:
+            algo.stop_pondering()
+        assert algo.time.monotonic() - start < 0.05
+        assert not ponder.thread.is_alive()
+        assert ctx.tt.stats()["used"] > used
+
+        # Nothing to ponder: unknown match, winning move, bad piece
+        assert algo.start_pondering(dict(state, players=["Other1", "Other2"]), pos, piece) is None
+        assert algo.start_pondering(state, 0, piece) is None # Occupied square
+        assert algo.start_pondering(state, pos, 4) is None
+        won = dict(state, board=['BLEP', 'BLFC', 'BDEP'] + [None] * 13, piece="BDFC")
+        assert algo.start_pondering(won, 3, "SLEC") is None
+        algo.end_match(state["players"])
+
+        # A game() call stops the ponder search before searching
+        with patch('algo.SEARCH_TIME_BUDGET', 0.2), patch('algo.OPENING_BOOK', None):
+            pos, piece = algo.game(state, algo.time.time())
+            ponder = algo.start_pondering(state, pos, piece)
+            algo.game(state, algo.time.time())
+        assert not ponder.thread.is_alive() and algo._ponder is None and algo._games_running == 0
+        algo.end_match(state["players"])
+
+        # A failing game() still lets the next one ponder
+        with patch('algo.match_context', side_effect=RuntimeError("broken")):
+            with pytest.raises(RuntimeError):
+                algo.game(state, algo.time.time())
+        assert algo._games_running == 0
+
+        # A ponder search that no request stops ends by itself
+        with patch('algo.SEARCH_TIME_BUDGET', 0.2), patch('algo.OPENING_BOOK', None):
+            pos, piece = algo.game(state, algo.time.time())
+        with patch('algo.PONDER_TIME_LIMIT', 0.2):
+            ponder = algo.start_pondering(state, pos, piece)
+        ponder.thread.join(1)
+        assert not ponder.thread.is_alive()
+        algo.stop_pondering()
+
+        # With a search pool, the middle game isn't pondered, the endgame still is
+        with patch('algo.SEARCH_POOL', object()):
+            assert algo.start_pondering(state, pos, piece) is None
+            end = {"players": state["players"], "current": 0,
+                   "board": ['BLEP', 'BLFC', None, 'SDFC',
+                             'SLEP', None, 'BDEC', 'SLFP',
+                             None, None, None, None,
+                             None, 'SDEC', None, None],
+                   "piece": "BDFP"}
+            with patch('algo.OPENING_BOOK', None):
+                algo.match_context(end, algo.to_bitstate(end))
+                ponder = algo.start_pondering(end, 2, "SLEC")
+            assert ponder is not None
+            algo.stop_pondering()
+        algo.end_match(state["players"])
+
+    def test_root_moves(self):
+        # Test root move generation and immediate wins
+        state = algo.to_bitstate({"current": 0, "board": ['BLEP', 'BLFC', 'BDEP'] + [None] * 13, "piece": "BDFC"})
+        assert algo.winning_square(state) == 3
+        moves = algo.root_moves(state)
+        assert len(moves) == len(set(moves))
+        assert all(not state.occupied >> sq & 1 and state.available >> p & 1 for sq, p in moves)
+
+        state = state._replace(piece=algo.PIECE_IDS['SDFC'])
+        assert algo.winning_square(state) is None
+        # Unless square 3 is blocked, giving a Big piece lets the opponent win: not listed
+        moves = algo.root_moves(state)
+        assert all(algo.PIECES[p][0] == 'S' for sq, p in moves if sq != 3)
+        assert any(algo.PIECES[p][0] == 'B' for sq, p in moves if sq == 3)
+
+    def test_iterative_deepening(self):
+        # Test that each depth is recorded and that aspiration windows don't change the result
+        state = algo.to_bitstate({
+            "current": 0,
+            "board": ['BLEP', 'BDFC', 'SLEP', 'SDEC',
+                      'SDFC', None, 'BLFP', None,
+                      None, None, 'SLFC', None,
+                      None, 'BDEC', None, None],
+            "piece": "SDFP"})
+        ctx = algo.SearchContext()
+        with patch('algo.ASPIRATION_WINDOW', 1):
+            move = algo.iterative_deepening(state, "0", ctx, max_depth=4)
+        assert [it["depth"] for it in ctx.iterations] == [2, 3, 4]
+        assert all(it["complete"] and it["seconds"] >= 0 for it in ctx.iterations)
+        assert move == ctx.iterations[-1]["move"]
+        # Every root move got a score, used to order the next depth
+        assert len(ctx.root_scores) == len(algo.root_moves(state))
+
+        fresh = algo.SearchContext()
+        algo.find_best_negamax_move(state, "0", 4, fresh)
+        assert fresh.best_score == ctx.best_score
+
+    def test_search_algorithms(self):
+        # Test that PVS and MTD(f) find the value of the plain alpha-beta search
+        state = algo.to_bitstate({
+            "current": 0,
+            "board": ['BLEP', 'BDFC', 'SLEP', None,
+                      'SDFC', None, None, None,
+                      None, 'SDEC', None, None,
+                      None, None, 'BLFP', None],
+            "piece": "BLFC"})
+        reference = algo.SearchContext()
+        algo.find_best_negamax_move(state, "0", 4, reference)
+        for algorithm in ("pvs", "mtdf"):
+            ctx = algo.SearchContext()
+            ctx.algorithm = algorithm
+            if algorithm == "mtdf":
+                move = algo.mtdf(state, "0", 4, ctx, guess=0)
+            else:
+                move = algo.find_best_negamax_move(state, "0", 4, ctx)
+            assert ctx.best_score == reference.best_score
+            assert ctx.pv[0] == move
+            if algorithm == "pvs":
+                assert ctx.nodes < reference.nodes
+
+            # Through iterative deepening as game() runs it
+            ctx = algo.SearchContext()
+            ctx.algorithm = algorithm
+            algo.iterative_deepening(state, "0", ctx, max_depth=4)
+            assert ctx.best_score == reference.best_score
+            assert all(it["complete"] for it in ctx.iterations)
+
+        with pytest.raises(ValueError):
+            algo.game({"players": ["A", "B"], "current": 0, "board": [None] * 16, "piece": None},
+                      algo.time.time(), algorithm="minimax")
+
+    def test_parallel_search(self):
+        # Test that the root-parallel search agrees with the sequential one
+        state = algo.to_bitstate({
+            "current": 0,
+            "board": ['BLEP', 'BDFC', 'SLEP', 'SDEC',
+                      'SDFC', None, 'BLFP', None,
+                      None, None, 'SLFC', None,
+                      None, 'BDEC', None, None],
+            "piece": "SDFP"})
+        pool = algo.start_search_pool(2)
+        try:
+            assert algo.start_search_pool() is pool  # Started once
+            ctx = algo.SearchContext()
+            move = algo.find_best_negamax_move(state, "0", 3, ctx, pool=pool)
+            sequential = algo.SearchContext()
+            assert algo.find_best_negamax_move(state, "0", 3, sequential) == move
+            assert ctx.best_score == sequential.best_score
+            assert ctx.nodes > 0 and ctx.cutoffs > 0 # The workers' counters are added up
+            assert ctx.pv[0] == move and len(ctx.pv) > 1 # From the worker's table
+
+            # The workers stop at the deadline too
+            ctx = algo.SearchContext()
+            ctx.deadline = algo.time.monotonic() + 0.3
+            start = algo.time.monotonic()
+            try:
+                algo.find_best_negamax_move(state, "0", 7, ctx, pool=pool)
+            except algo.SearchTimeout:
+                pass
+            assert algo.time.monotonic() - start < 1
+        finally:
+            algo.stop_search_pool()
+        assert algo.SEARCH_POOL is None
+
+    def test_search_root_chunk(self):
+        # Test the worker side of the parallel search in this process: one context per match, absolute deadline
+        state = algo.to_bitstate({
+            "current": 0,
+            "board": ['BLEP', 'BDFC', 'SLEP', 'SDEC',
+                      'SDFC', None, 'BLFP', None,
+                      None, None, 'SLFC', None,
+                      None, 'BDEC', None, None],
+            "piece": "SDFP"})
+        moves = algo.root_moves(state)
+        algo._worker_contexts.clear()
+        try:
+            scores, timed_out, counters, pv = algo._search_root_chunk(tuple(state), 3, moves, algo.time.time() + 60,
+                                                                      -float('inf'), float('inf'), "alphabeta", "match-a")
+            assert len(scores) == len(moves) and not timed_out and counters[0] > 0
+            assert pv[0] == max(dict(scores).items(), key=lambda item: item[1])[0] and len(pv) > 1
+            algo._search_root_chunk(tuple(state), 2, moves, algo.time.time() + 60, -float('inf'), float('inf'),
+                                    "alphabeta", "match-b")
+            assert list(algo._worker_contexts) == ["match-a", "match-b"]
+            assert algo._worker_contexts["match-a"] is not algo._worker_contexts["match-b"]
+            for i in range(algo.MAX_MATCH_CONTEXTS):
+                algo._worker_match_context(f"other-{i}")
+            assert "match-a" not in algo._worker_contexts
+
+            # A chunk that starts after the deadline gives up at once
+            scores, timed_out, counters, pv = algo._search_root_chunk(tuple(state), 3, moves, algo.time.time() - 1,
+                                                                      -float('inf'), float('inf'), "alphabeta", "match-b")
+            assert scores == [] and timed_out and counters[0] == 0
+        finally:
+            algo._worker_contexts.clear()
+
+    def test_solve_endgame(self):
+        # Test the exact solver on small endgames
+        # Immediate win: placing BDFC on square 3 completes a row of Big pieces
+        state = algo.to_bitstate({
+            "current": 0,
+            "board": ['BLEP', 'BLFC', 'BDEP', None,
+                      'SDFC', 'SLEP', 'SDEP', 'BDEC',
+                      'SLFC', 'BLFP', None, 'SDEC',
+                      'SLEC', 'BLEC', None, 'SLFP'],
+            "piece": "BDFC"})
+        ctx = algo.SearchContext()
+        pos, _ = algo.solve_endgame(state, ctx)
+        assert pos == 3
+        assert ctx.best_score == algo.ENDGAME_WIN + 3
+
+        # The solver agrees with a full-depth negamax on who wins
+        state = state._replace(piece=algo.PIECE_IDS['SDFP'], available=state.available | (1 << algo.PIECE_IDS['BDFC']))
+        state = state._replace(available=state.available & ~(1 << algo.PIECE_IDS['SDFP']))
+        ctx = algo.SearchContext()
+        pos, piece = algo.solve_endgame(state, ctx)
+        exact = algo.negamax(state, 0, 3)
+        assert (ctx.best_score > 0) == (exact == float('inf'))
+        assert (ctx.best_score < 0) == (exact == -float('inf'))
+        assert not state.occupied >> pos & 1
+
+    @patch('algo.iterative_deepening')
+    def test_game_endgame(self, mock_deepening):
+        # Test that game() solves small endgames without the iterative deepening
+        state = {
+            "players": ["End1", "End2"],
+            "current": 0,
+            "board": ['BLEP', 'BLFC', 'BDEP', None,
+                      'SDFC', 'SLEP', 'SDEP', 'BDEC',
+                      'SLFC', 'BLFP', None, 'SDEC',
+                      'SLEC', 'BLEC', None, 'SLFP'],
+            "piece": "BDFC"}
+        pos, piece = algo.game(state, algo.time.time())
+        assert pos == 3
+        mock_deepening.assert_not_called()
+
+    def test_prove_win(self):
+        # Test that the proof search agrees with the exact solver and proves with a winning move
+        random.seed(23383)
+        results = set()
+        for _ in range(40):
+            board, occupied, available = 0, 0, algo.FULL
+            for sq in random.sample(range(16), 9):
+                piece = random.choice(algo.bit_indices(available))
+                board |= piece << (4 * sq)
+                occupied |= 1 << sq
+                available &= ~(1 << piece)
+            piece = random.choice(algo.bit_indices(available))
+            state = algo.BitState(board, occupied, available & ~(1 << piece), piece, 0)
+            if algo.has_winner(board, occupied) or algo.winning_square(state) is not None:
+                continue
+            exact = algo.SearchContext()
+            algo.solve_endgame(state, exact)
+            ctx = algo.SearchContext()
+            move = algo.prove_win(state, ctx)
+            assert (move is not None) == (exact.best_score > 0)
+            assert ctx.proof["result"] == (move is not None)
+            assert ctx.proof["nodes"] > 0 and ctx.proof["proof_size"] > 0
+            results.add(ctx.proof["result"])
+            if move is not None: # Every reply of the opponent loses
+                search_state = algo.SearchState(state)
+                search_state.make(move)
+                assert algo.solve(search_state, algo.SearchContext()) < 0
+        assert results == {True, False}
+
+        # A midgame win, out of the solver's reach
+        state = algo.to_bitstate({
+            "current": 0,
+            "board": [None, None, None, None,
+                      'BDEP', 'SLEC', None, 'BLEP',
+                      'SLFC', None, None, None,
+                      None, 'BDEC', 'BLFC', 'SDEP'],
+            "piece": "BDFP"})
+        ctx = algo.SearchContext()
+        assert algo.prove_win(state, ctx) == (2, algo.PIECE_IDS['SDFP'])
+        assert ctx.proof["proof_size"] > 2
+        table = ctx.proof_table
+        assert table.stats()["used"] <= table.stats()["size"]
+
+        # Out of time
+        ctx = algo.SearchContext()
+        ctx.deadline = algo.time.monotonic()
+        ctx.check_mask = 0
+        with pytest.raises(algo.SearchTimeout):
+            algo.prove_win(state, ctx)
+        assert ctx.proof["result"] is None
+
+    @patch('algo.iterative_deepening')
+    def test_game_proof(self, mock_deepening):
+        # Test that game() plays a proven win without the depth-limited search
+        state = {
+            "players": ["Proof1", "Proof2"],
+            "current": 0,
+            "board": [None, None, None, None,
+                      'BDEP', 'SLEC', None, 'BLEP',
+                      'SLFC', None, None, None,
+                      None, 'BDEC', 'BLFC', 'SDEP'],
+            "piece": "BDFP"}
+        pos, piece = algo.game(state, algo.time.time())
+        assert pos == 2 and algo.PIECE_CODES[piece] == algo.PIECE_IDS['SDFP']
+        assert algo.last_move_info()["source"] == "proof"
+        mock_deepening.assert_not_called()
+
+        # Turned off, the search runs as before
+        mock_deepening.return_value = (2, algo.PIECE_IDS['SDFP'])
+        with patch('algo.PROOF_SEARCH', False):
+            algo.game(dict(state, players=["Proof3", "Proof4"]), algo.time.time())
+        mock_deepening.assert_called_once()
+
+    def test_opening_book(self, tmp_path):
+        # Test that a book entry is found for every symmetric version of its position
+        state = algo.to_bitstate({"current": 0, "board": ['BLEP'] + [None] * 15, "piece": "SDFC"})
+        canonical, transform = algo.canonical_form(state)
+        key, book_transform = algo.book_key(state)
+        move = (5, algo.PIECE_IDS['BDFC'])
+        path = tmp_path / "book.bin"
+        algo.write_opening_book(str(path), {key: algo.transform_move(move, book_transform) + (float('inf'),),
+                                            key ^ 1: (0, None, -3)})
+        book = algo.OpeningBook(str(path))
+        try:
+            assert len(book) == 2
+            assert book.find(key)[2] == algo.BOOK_SCORE_LIMIT
+            assert book.find(key ^ 1) == (0, algo.BOOK_NONE, -3)
+            assert book.find(key ^ 2) is None
+            assert book.move(state) == move
+            assert book.move(state._replace(current=1)) == move
+            # Mirrored board (square 0 -> 3), same piece relations: the mirrored move
+            mirrored = algo.to_bitstate({"current": 0, "board": [None] * 3 + ['BLEP'] + [None] * 12, "piece": "SDFC"})
+            sq, p = book.move(mirrored)
+            play = lambda s, m: algo.BitState(s.board | s.piece << (4 * m[0]), s.occupied | 1 << m[0],
+                                              s.available & ~(1 << m[1]), m[1], 1)
+            assert algo.canonical_form(play(mirrored, (sq, p)))[0] == algo.canonical_form(play(state, move))[0]
+            assert book.move(algo.to_bitstate({"current": 0, "board": ['BLEP', 'SDFC'] + [None] * 14, "piece": "BDFC"})) is None
+        finally:
+            book.close()
+
+        path.write_bytes(b'not a book')
+        with pytest.raises(ValueError):
+            algo.OpeningBook(str(path))
+
+    @patch('algo.iterative_deepening')
+    def test_game_opening_book(self, mock_deepening):
+        # Test that game() answers from the book without searching
+        book = MagicMock()
+        book.move.return_value = (9, algo.PIECE_IDS['SLEC'])
+        state = {"players": ["Book1", "Book2"], "current": 0, "board": ['BLEP'] + [None] * 15, "piece": "SDFC"}
+        with patch('algo.OPENING_BOOK', book):
+            pos, piece = algo.game(state, algo.time.time())
+        assert pos == 9
+        assert algo.conversion_piece(piece) == 'SLEC'
+        mock_deepening.assert_not_called()
+
     @patch('algo.find_best_negamax_move')
     def test_game(self, mock_find_best):
         # Test main game function with different board states
-        mock_find_best.return_value = (3, 'SDFC')
-        start_time = 0
+        mock_find_best.return_value = (3, algo.PIECE_IDS['SDFC'])
+        start_time = algo.time.time()
         # Empty board
         state = {
             "players": ["Player1", "Player2"],
@@ -273,6 +1206,7 @@ class TestAlgo:
         }
         pos, piece = algo.game(state,start_time)
         assert pos == 3
+        assert algo.conversion_piece(piece) == 'SDFC'  # Returned as a shuffled name
         
         # Mid-game (7-9 pieces on board should increase depth)
         state["board"] = ['BLEP', 'BDFC', 'BLFC', None,
@@ -0,0 +1,144 @@
+import pytest
+import asyncio
+import json
+import sys
+from unittest.mock import patch
+sys.path.append('.')  # Add current directory to path if needed
+
+import algo
+import arena
+
+def first_legal_move(state):
+    # Empty square and available piece with the lowest indices
+    bits = algo.to_bitstate(state)
+    pos = None if bits.piece is None else algo.bit_indices(algo.FULL & ~bits.occupied)[0]
+    available = bits.available & ~(0 if pos is None else 1 << bits.piece)
+    return {"pos": pos, "piece": algo.PIECES[algo.bit_indices(available)[0]] if available else None}
+
+async def start_bot(play):
+    # In-process bot answering pings, and play requests with play(state) (a coroutine); returns (server, port)
+    async def handle(reader, writer):
+        request = await arena.read_message(reader)
+        if request["request"] == "ping":
+            response = {"response": "pong"}
+        else:
+            response = {"response": "move", "move": await play(request["state"])}
+        writer.write(json.dumps(response).encode('utf-8'))
+        await writer.drain()
+        writer.close()
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+class TestArena:
+
+    def test_check_move(self):
+        # Test the move rules of the stand-in server
+        state = {"players": ["A", "B"], "current": 0, "board": [None] * 16, "piece": None}
+        state, won = arena.check_move(state, {"pos": None, "piece": "PELB"}) # Any letter order
+        assert state == {"players": ["A", "B"], "current": 1, "board": [None] * 16, "piece": "BLEP"} and not won
+        with pytest.raises(ValueError):
+            arena.check_move(state, {"pos": 0, "piece": "BLEP"}) # The piece just placed
+        for move in (None, {"pos": 16, "piece": "SDFC"}, {"pos": "0", "piece": "SDFC"}, {"pos": 0, "piece": None},
+                     {"pos": 0, "piece": "XXXX"}, {"pos": 0, "piece": "BBEP"}, {"pos": 0, "piece": "SDF"}):
+            with pytest.raises(ValueError):
+                arena.check_move(state, move)
+        state, won = arena.check_move(state, {"pos": 0, "piece": "SDFC"})
+        assert state["board"][0] == "BLEP" and state["piece"] == "SDFC" and state["current"] == 0
+        with pytest.raises(ValueError):
+            arena.check_move(state, {"pos": 0, "piece": "BDFC"}) # Occupied
+
+        # A winning move needs no piece
+        state = {"players": ["A", "B"], "current": 1, "board": ['BLEP', 'BLFC', 'BDEP'] + [None] * 13, "piece": "BDFC"}
+        state, won = arena.check_move(state, {"pos": 3, "piece": None})
+        assert won and state["board"][3] == "BDFC"
+
+    def test_percentiles(self):
+        # Test the nearest-rank percentiles
+        assert arena.percentiles([]) == {}
+        stats = arena.percentiles(list(range(100, 0, -1)))
+        assert stats == {"p50": 50, "p90": 90, "p99": 99, "max": 100}
+        assert arena.percentiles([0.5]) == {"p50": 0.5, "p90": 0.5, "p99": 0.5, "max": 0.5}
+
+    def test_match(self):
+        # Test matches between in-process bots: results, bad moves, timeouts and the report
+        async def legal(state):
+            return first_legal_move(state)
+        async def cheater(state): # Always places on square 0
+            move = first_legal_move(state)
+            if state["piece"] is not None:
+                move["pos"] = 0
+            return move
+        async def slow(state):
+            await asyncio.sleep(0.3)
+            return first_legal_move(state)
+
+        async def run():
+            match = arena.Arena(move_time_limit=0.2)
+            servers = []
+            for name, play in (("legal", legal), ("cheater", cheater), ("slow", slow)):
+                server, port = await start_bot(play)
+                servers.append(server)
+                match.register(name, "127.0.0.1", port)
+            assert await match.ping("legal")
+            results = await match.run(2, ["legal", "cheater"])
+            winner = await match.play_match("slow", "legal")
+            await asyncio.sleep(0.15) # The slow bot's last answer
+            for server in servers:
+                server.close()
+            return match, results, winner
+
+        match, results, winner = asyncio.run(run())
+        assert results == [{"first": "legal", "winner": "legal"}, {"first": "cheater", "winner": "legal"}]
+        assert winner == "legal"
+        report = match.report(results)
+        assert report["bots"]["legal"]["win_rate"] == 1.0 and report["bots"]["legal"]["games"] == 3
+        assert report["bots"]["cheater"]["bad_moves"] == 2 * arena.LIVES
+        assert report["bots"]["slow"]["timeouts"] == arena.LIVES
+        assert report["bots"]["slow"]["losses"] == 1
+        assert set(report["bots"]["legal"]["latency"]) == {"p50", "p90", "p99", "max"}
+
+    def test_request_deadline(self):
+        # Test that the time limit covers the connection and the reply together
+        async def slow(state):
+            await asyncio.sleep(0.15)
+            return first_legal_move(state)
+        open_connection = asyncio.open_connection
+        async def slow_open(*args, **kwargs): # Connecting takes most of the time too
+            await asyncio.sleep(0.15)
+            return await open_connection(*args, **kwargs)
+
+        async def run():
+            match = arena.Arena(move_time_limit=0.2)
+            server, port = await start_bot(slow)
+            match.register("slow", "127.0.0.1", port)
+            state = {"players": ["slow", "other"], "current": 0, "board": [None] * 16, "piece": None}
+            with patch('asyncio.open_connection', slow_open):
+                with pytest.raises(asyncio.TimeoutError):
+                    await match.request("slow", {"request": "play", "state": state}, 0.2)
+            reply = await match.request("slow", {"request": "play", "state": state}, 0.2)
+            await asyncio.sleep(0.1) # The first request's answer
+            server.close()
+            return reply
+
+        assert asyncio.run(run())["response"] == "move"
+
+    def test_subscribe(self):
+        # Test the subscribe handshake of connect.py's bots
+        async def run():
+            match = arena.Arena()
+            server = await match.start("127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            replies = []
+            for message in ({"request": "subscribe", "port": 5000, "name": "A", "matricules": ["1"]},
+                            {"request": "subscribe", "port": 5001, "name": "A", "matricules": ["2"]},
+                            {"request": "subscribe", "name": "B"}):
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(json.dumps(message).encode('utf-8'))
+                replies.append(json.loads(await reader.read()))
+                writer.close()
+            server.close()
+            return match, replies
+
+        match, replies = asyncio.run(run())
+        assert [reply["response"] for reply in replies] == ["ok", "error", "error"]
+        assert match.players == {"A": ("127.0.0.1", 5000)}
@@ -0,0 +1,83 @@
+import json
+import sys
+sys.path.append('.')  # Add current directory to path if needed
+
+import algo
+import bench
+
+class TestBench:
+
+    def test_positions(self):
+        # Test that the fixed positions are legal and still undecided
+        for name, state in bench.BENCH_POSITIONS:
+            bits = algo.to_bitstate(state)
+            assert not algo.has_winner(bits.board, bits.occupied), name
+            assert algo.winning_square(bits) is None, name
+        logged = bench.logged_positions()
+        assert len(logged) == len({tuple(state["board"]) for _, state in logged}) > 0
+
+    def test_logged_positions_missing_file(self, tmp_path):
+        # Test that a missing or broken times.json gives no positions
+        missing = str(tmp_path / "missing.jsonl")
+        assert bench.logged_positions(str(tmp_path / "missing.json"), missing) == []
+        path = tmp_path / "times.json"
+        path.write_text("not json")
+        assert bench.logged_positions(str(path), missing) == []
+
+    def test_logged_positions_telemetry(self, tmp_path):
+        # Test that the states of the errors in the telemetry log are read too, once each
+        state = dict(bench.BENCH_POSITIONS[2][1])
+        path = tmp_path / "telemetry.jsonl"
+        records = [{"latency": 1.0}, {"latency": 1.2, "errors": [{"message": "timeout", "state": state}]},
+                   {"latency": 1.1, "errors": [{"message": "timeout", "state": state}]}]
+        path.write_text("".join(json.dumps(record) + "\n" for record in records))
+        assert bench.logged_positions(str(tmp_path / "missing.json"), str(path)) == [("logged-1", state)]
+        # Only on request: the default suite stays the same while the bot plays
+        assert bench.logged_positions(str(tmp_path / "missing.json")) == []
+        report_path = tmp_path / "report.json"
+        bench.main(["--output", str(report_path), "search", "--depth", "2", "--time", "--telemetry", str(path)])
+        assert json.loads(report_path.read_text())["positions"] == len(bench.BENCH_POSITIONS + bench.logged_positions()) + 1
+
+    def test_run_suite(self):
+        # Test the report of a small run: same nodes at a fixed depth on every run
+        positions = bench.BENCH_POSITIONS[2:4]
+        report = bench.run_suite(positions, depths=(2,), budgets=(0.05,))
+        assert report["positions"] == 2
+        runs = report["depth"]["2"]
+        assert [run["name"] for run in runs] == ["middle-6", "middle-8", "total"]
+        for run in runs[:-1]:
+            assert run["depth"] == 2 and run["nodes"] > 0 and run["nps"] > 0
+            assert 0 <= run["tt_hit_rate"] <= 1
+        assert runs[-1]["nodes"] == sum(run["nodes"] for run in runs[:-1])
+        assert [run["nodes"] for run in bench.run_suite(positions, (2,), ())["depth"]["2"]] == [run["nodes"] for run in runs]
+        for run in report["time"]["0.05"][:-1]:
+            assert run["depth"] >= 2 and run["seconds"] < 1
+
+    def test_main_output(self, tmp_path):
+        # Test that the report is written as JSON
+        path = tmp_path / "report.json"
+        bench.main(["--output", str(path), "search", "--depth", "2", "--time", "--no-logged"])
+        report = json.loads(path.read_text())
+        assert report["positions"] == len(bench.BENCH_POSITIONS)
+        assert report["time"] == {}
+        # ... also with --output after the command
+        path = tmp_path / "perft.json"
+        bench.main(["perft", "--depth", "1", "--output", str(path)])
+        assert "perft" in json.loads(path.read_text())
+
+    def test_run_proof(self):
+        # Test the proof search report: the endgames are solved, the opening is not
+        report = bench.run_proof([bench.BENCH_POSITIONS[0]] + bench.BENCH_POSITIONS[4:], 0.2)
+        runs = report["proof"]
+        assert [run["name"] for run in runs] == ["early-1", "end-10", "end-11"]
+        assert runs[0]["result"] == "unknown" and runs[0]["move"] is None
+        for run in runs[1:]:
+            assert run["result"] in ("win", "no win") and run["proof_size"] > 0
+            assert (run["move"] is not None) == (run["result"] == "win")
+
+    def test_run_perft(self):
+        # Test the move generation report
+        report = bench.run_perft(bench.BENCH_POSITIONS[4:], 2)
+        assert [run["name"] for run in report["perft"]] == ["end-10", "end-11"]
+        for (name, state), run in zip(bench.BENCH_POSITIONS[4:], report["perft"]):
+            assert run["leaves"] == algo.perft(algo.to_bitstate(state), 2)
@@ -1,9 +1,11 @@
 import pytest
+import asyncio
 import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
 import json
-import os
 import threading
-from unittest.mock import patch, MagicMock, mock_open
+from unittest.mock import patch, MagicMock
 
 # Import the functions from your module
 # Note: You might need to adjust the import depending on the structure of your project
@@ -90,49 +92,74 @@ class TestClient:
         result = client.identification(mock_socket_instance)
         assert result is None
 
-    @patch('builtins.open', new_callable=mock_open, read_data='[]')
-    @patch('json.dump')
-    def test_save_time(self, mock_json_dump, mock_file):
-        # Test save_time function
-        client.save_time(1.23)
-        
-        # Check if file was opened for writing
-        mock_file.assert_called_with(os.path.join(os.path.dirname(client.__file__), 'times.json'), 'w')
-        
-        # Check if json.dump was called with the correct data
-        mock_json_dump.assert_called_once()
-        args, _ = mock_json_dump.call_args
-        assert 1.23 in args[0]
-
-    @patch('socket.socket')
-    def test_refreshdata_ping(self, mock_socket):
-        # Setup mock connection and address
-        mock_conn = MagicMock()
-        mock_addr = ('127.0.0.1', 12345)
-        
-        # Send ping
-        mock_ping_data = {"request": "ping"}
-        
-        # Call the function
-        client.refreshdata(mock_conn, mock_addr, mock_ping_data)
-        
-        # Assertions
-        mock_conn.sendall.assert_called_once()
-        sent_data = json.loads(mock_conn.sendall.call_args[0][0].decode('utf-8'))
-        assert sent_data['response'] == "pong"
-        mock_conn.close.assert_called_once()
-
-    @patch('socket.socket')
-    @patch('time.time')
-    def test_refreshdata_play(self, mock_time, mock_socket):
-        # Setup mock connection and address
-        mock_conn = MagicMock()
-        mock_addr = ('127.0.0.1', 12345)
-        
-        # Mock time.time for simulate time
-        mock_time.side_effect = [0, 1.5]  
-        
-        # Mock state for the game
+    def test_move_record(self):
+        # Test the telemetry record of a move and its outcome
+        state_game = {"players": ["BotBotBot", "FKY"], "current": 0,
+                      "board": ['BLEP', 'BLFC', 'BDEP'] + [None] * 13, "piece": "BDFC"}
+        request = {"request": "play", "lives": 2, "errors": [{"message": "timeout", "state": state_game}], "state": state_game}
+        info = {"match": "abc", "source": "search", "depth": 4, "score": 12}
+        record = client.move_record(request, {"move": {"pos": 3, "piece": None}}, info, 0.8)
+        assert {key: record[key] for key in ("match", "players", "latency", "depth", "source", "score", "outcome", "lives")} == \
+            {"match": "abc", "players": ["BotBotBot", "FKY"], "latency": 0.8, "depth": 4, "source": "search",
+             "score": 12, "outcome": "win", "lives": 2}
+        assert record["errors"] == request["errors"] and record["time"] > 0
+        request["errors"] = []
+        record = client.move_record(request, {"move": {"pos": 4, "piece": "SDFC"}}, None, 0.8)
+        assert record["outcome"] == "move" and record["depth"] is None and "errors" not in record
+        assert client.move_outcome(state_game, {"pos": 0, "piece": "SDFC"}) == "bad move"
+        assert client.move_outcome(dict(state_game, board=[None] * 16, piece=None), {"pos": None, "piece": "SDFC"}) == "give"
+        full = ['BLEC', 'SLEP', 'BLFC', 'SDFP', 'BDFP', 'BDEC', 'BLEP', 'SDFC',
+                'SLFC', 'BDFC', 'SLFP', 'SLEC', 'BLFP', 'SDEC', 'SDEP', None]
+        assert client.move_outcome(dict(state_game, board=full, piece='BDEP'), {"pos": 15, "piece": None}) == "draw"
+
+    def request(self, messages, game=None, eof=False):
+        # Runs a server on a free port, sends each raw message on its own connection, returns the replies
+        async def run():
+            executor = ThreadPoolExecutor(1)
+            server = await client.start_server("127.0.0.1", 0, executor)
+            port = server.sockets[0].getsockname()[1]
+            replies = []
+            async with server:
+                for message in messages:
+                    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                    writer.write(message) # The connection stays open, as the game server does
+                    if eof:
+                        writer.write_eof()
+                    replies.append(await reader.read())
+                    writer.close()
+            executor.shutdown()
+            return replies
+        with patch('connect.game', game or MagicMock(return_value=(3, 4))), patch('connect.start_pondering'):
+            return asyncio.run(run())
+
+    def test_read_message(self):
+        # Test the framings: JSON alone, in several chunks, newline-ended, length-prefixed
+        async def read(*chunks, eof=True):
+            reader = asyncio.StreamReader()
+            for chunk in chunks:
+                reader.feed_data(chunk)
+            if eof:
+                reader.feed_eof()
+            return await client.read_message(reader)
+        assert asyncio.run(read(b'{"request": "ping"}', eof=False)) == {"request": "ping"}
+        assert asyncio.run(read(b'{"request": "pl', b'ay", "state": {"board": [null]}}\n')) == {"request": "play", "state": {"board": [None]}}
+        assert asyncio.run(read(b'19\n{"request": "ping"}', eof=False)) == {"request": "ping"}
+        assert asyncio.run(read(b'19\n{"requ', b'est": "ping"}', eof=False)) == {"request": "ping"}
+        assert asyncio.run(read()) is None
+        with pytest.raises(ValueError):
+            asyncio.run(read(b'{"request": '))
+        with pytest.raises(asyncio.IncompleteReadError):
+            asyncio.run(read(b'30\n{"request": "ping"}'))
+        with pytest.raises(ValueError):
+            asyncio.run(read(b'%d\n' % (client.MAX_MESSAGE_SIZE + 1), eof=False))
+
+    def test_handle_ping(self):
+        # Test that a ping is answered with a pong
+        reply, = self.request([json.dumps({"request": "ping"}).encode('utf-8')])
+        assert json.loads(reply) == {"response": "pong"}
+
+    def test_handle_play(self):
+        # Test that a play request is answered with the move of game()
         state_game = {
             "players": ["BotBotBot", "FKY"],
             "current": 0,
@@ -142,84 +169,82 @@ class TestClient:
                       None, None, None, 'BDFP'],
             "piece": "BLEP"
         }
-
-        # Send request
-        mock_ping_data = {
-                "request": "play",
-                "lives": 3,
-                "errors": [],  
-                "state": state_game
-            }
-        
-        # Call the function
-        client.refreshdata(mock_conn, mock_addr,mock_ping_data)
-        
-        # Assertions
-        assert mock_conn.sendall.call_count == 1
-        
-        # Decode Json send by client
-        sent_data_raw = mock_conn.sendall.call_args[0][0].decode('utf-8').strip()
-        sent_data = json.loads(sent_data_raw)
+        message = json.dumps({"request": "play", "lives": 3, "errors": [], "state": state_game}).encode('utf-8')
+        game = MagicMock(return_value=(2, 'SLFP'))
+        with patch('connect.TELEMETRY') as mock_telemetry:
+            reply, = self.request([b'%d\n%s' % (len(message), message)], game=game)
+        sent_data = json.loads(reply)
         assert sent_data['response'] == "move"
-        assert sent_data['move']['pos'] == 3  
-        assert sent_data['move']['piece'] == 4 
-        mock_conn.close.assert_called_once()
-
-    @patch('socket.socket')
-    def test_refreshdata_with_errors(self, mock_socket):
-        # Setup mock connection and address
-        mock_conn = MagicMock()
-        mock_addr = ('127.0.0.1', 12345)
-        
-        # Mock state for the game with errors
-        state_game = {
-            "players": ["BotBotBot", "FKY"],
-            "current": 0,
-            "board": ['SDFC', 'BLEP', None, 'BLFC',
-                      None, 'BDEC', None, None,
-                      'SLEC', None, 'SLFC', None,
-                      None, None, None, 'BDFP'],
-            "piece": "BLEP"
-        }
-
-        mock_ping_data = {
-                "request": "play",
-                "lives": 2,
-                "errors": ["error1", "error2"],  # List of error for test
-                "state": state_game
-            }
-        
-
-        with patch('connect.save_time') as mock_save_time:
-            # Call the function
-            client.refreshdata(mock_conn, mock_addr,mock_ping_data)
-            
-            # If save_time is called when list of error
-            mock_save_time.assert_called_once_with(["error1", "error2"])
-            mock_conn.close.assert_called_once()
-
-    @patch('socket.socket')
-    @patch('threading.Thread')
-    def test_main(self, mock_thread, mock_socket):
-        # Setup mock socket
-        mock_socket_instance = MagicMock()
-        mock_socket.return_value = mock_socket_instance
-        
-        # Fake a connection
-        mock_socket_instance.accept.side_effect = [
-            (MagicMock(), ('127.0.0.1', 12345)),
-            Exception("Test end")
-        ]
-        
-        # Call the function with expected exception
-        with pytest.raises(Exception, match="Test end"):
+        assert sent_data['move'] == {"pos": 2, "piece": 'SLFP'}
+        assert game.call_args[0][0] == state_game
+        record, = mock_telemetry.write.call_args[0]
+        assert record["move"] == sent_data['move'] and record["outcome"] == "move" and 0 <= record["latency"] < 1
+
+    def test_handle_play_with_errors(self):
+        # Test that the errors sent with a play request are logged with the move
+        message = {"request": "play", "lives": 2, "errors": ["error1", "error2"],
+                   "state": {"players": ["BotBotBot", "FKY"], "current": 0, "board": [None] * 16, "piece": None}}
+        with patch('connect.TELEMETRY') as mock_telemetry:
+            reply, = self.request([json.dumps(message).encode('utf-8')], game=MagicMock(return_value=(None, 'BLEP')))
+        assert json.loads(reply)['response'] == "move"
+        record, = mock_telemetry.write.call_args[0]
+        assert record["errors"] == ["error1", "error2"] and record["outcome"] == "give" and record["lives"] == 2
+
+    def test_handle_bad_request(self):
+        # Test that broken or unknown requests close the connection without answer
+        assert self.request([b'{"request": ', b'{"request": "dance"}'], eof=True) == [b'', b'']
+
+    def test_ping_during_search(self):
+        # Test that pings are answered at once while a search is running
+        async def run():
+            executor = ThreadPoolExecutor(1)
+            server = await client.start_server("127.0.0.1", 0, executor)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(json.dumps({"request": "play", "state": {"board": [None] * 16, "current": 0}}).encode('utf-8'))
+                await asyncio.sleep(0.1) # The search is running
+                start = time.monotonic()
+                ping_reader, ping_writer = await asyncio.open_connection("127.0.0.1", port)
+                ping_writer.write(json.dumps({"request": "ping"}).encode('utf-8'))
+                pong = await ping_reader.read()
+                latency = time.monotonic() - start
+                move = await reader.read()
+            executor.shutdown()
+            return pong, latency, move
+        def slow_game(state, start_time): # Busy like a search, holding the interpreter
+            while time.time() - start_time < 0.5:
+                pass
+            return 3, 'BLEP'
+        with patch('connect.game', slow_game), patch('connect.start_pondering'):
+            pong, latency, move = asyncio.run(run())
+        assert json.loads(pong) == {"response": "pong"}
+        assert latency < 0.1
+        assert json.loads(move)['move'] == {"pos": 3, "piece": 'BLEP'}
+
+    def test_configure(self):
+        # Test the overrides of algo settings given on the command line
+        with patch('algo.SEARCH_TIME_BUDGET', 2.5), patch('algo.LEAF_BATCHING', False):
+            client.configure(["SEARCH_TIME_BUDGET=1.0", "LEAF_BATCHING=True"])
+            assert algo.SEARCH_TIME_BUDGET == 1.0 and algo.LEAF_BATCHING is True
+        for setting in ("UNKNOWN=1", "game=1", "SEARCH_TIME_BUDGET=fast", "FULL=255", "PIECES=()"):
+            with pytest.raises(ValueError):
+                client.configure([setting])
+        # Sizes are read when a table is made, not bound when algo.py is imported
+        with patch('algo.TT_SIZE', algo.TT_SIZE), patch('algo.PROOF_TABLE_SIZE', algo.PROOF_TABLE_SIZE):
+            client.configure(["TT_SIZE=16", "PROOF_TABLE_SIZE=16"])
+            ctx = algo.SearchContext()
+            assert len(ctx.tt.slots) == 16 and len(ctx.proof_table.slots) == 16
+        for name in client.SETTINGS:
+            assert hasattr(algo, name)
+        args = client.parse_args(["--server", "127.0.0.1:3400", "--name", "fast", "--set", "SEARCH_TIME_BUDGET=1.0"])
+        assert (args.server, args.port, args.name, args.set) == ("127.0.0.1:3400", 54345, "fast", ["SEARCH_TIME_BUDGET=1.0"])
+
+    def test_main(self):
+        # Test that main serves forever on the given address and reports errors
+        with patch('connect.serve', MagicMock(side_effect=OSError("address in use"))) as mock_serve:
             client.main(54345, "0.0.0.0")
-        
-        # Assertions
-        mock_socket_instance.bind.assert_called_once_with(("0.0.0.0", 54345))
-        mock_socket_instance.listen.assert_called_once()
-        mock_thread.assert_called_once()
-        mock_thread.return_value.start.assert_called_once()
+        mock_serve.assert_called_once_with("0.0.0.0", 54345)
 
 if __name__ == "__main__":
     pytest.main(["-v", "test_client.py"])
\ No newline at end of file
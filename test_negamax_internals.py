@@ -85,29 +85,25 @@ class TestNegamaxInternals:
     def test_negamax_win_detection(self):
         """Test the immediate win detection inside the negamax loop"""
         
-        # Mock the winnerF function that's defined inside negamax
-        with patch('algo.same') as mock_same:
-            
-            # Create a test state where placing BLFC at position 2 creates a win
-            test_state = {
-                "players": ["Player1", "Player2"],
-                "current": 0,
-                "board": [
-                    'BLEP', 'BDEP', 'BDFC', None,
-                    None, None, None, None,
-                    None, None, None, None,
-                    None, None, None, None
-                ],
-                "piece": "BLFC"  # Current piece to place 
-            }
-            
-            # Call negamax but don't recurse (depth=0)
-            # We're only testing the immediate win detection logic
-            result = algo.negamax(test_state, 0, 2)
-            
-            # Should detect the win and return positive infinity
-            assert result == float('inf')
-    
+        # Create a test state where placing BLFC at position 3 creates a win
+        test_state = algo.to_bitstate({
+            "players": ["Player1", "Player2"],
+            "current": 0,
+            "board": [
+                'BLEP', 'BDEP', 'BDFC', None,
+                None, None, None, None,
+                None, None, None, None,
+                None, None, None, None
+            ],
+            "piece": "BLFC"  # Current piece to place
+        })
+
+        # We're only testing the immediate win detection logic
+        result = algo.negamax(test_state, 0, 2)
+
+        # Should detect the win and return positive infinity
+        assert result == float('inf')
+
     @patch('algo.negamax')
     def test_negamax_recursive_evaluation(self, mock_negamax):
         """Test the recursive evaluation of positions and piece selection"""
@@ -169,35 +165,29 @@ class TestNegamaxInternals:
         
         # Create a nearly full board with only one empty spot
         board = [None] + ['BLEP', 'BDFC', 'SLEP', 'SDFC', 'BLFC', 'BDEC', 'SLEC',
-                         'SDEC', 'BLFP', 'BDFP', 'SLFP', 'SDFP', 'BLEP', 'BDEP']
-        
-        test_state = {
+                         'SDEC', 'BLFP', 'BDFP', 'SLFP', 'SDFP', 'BLEC', 'BDEP', 'SLFC']
+
+        # All pieces are either on the board or the current piece to place
+        test_state = algo.to_bitstate({
             "players": ["Player1", "Player2"],
             "current": "0",
             "board": board,
-            "piece": "SLEP"  # Last piece to place
-        }
-        
-        # All pieces are either on the board or the current piece to place
-        # Create a custom piece function that returns the exact pieces on the board
-        with patch('algo.piece') as mock_piece:
-            mock_piece.return_value = ['BLEP', 'BDFC', 'SLEP', 'SDFC', 'BLFC', 'BDEC', 'SLEC',
-                                      'SDEC', 'BLFP', 'BDFP', 'SLFP', 'SDFP', 'BLEP', 'BDEP', 'SLEP']
-            
-            # Mock winner to return False (no immediate win)
-            with patch('algo.winner', return_value=False):
-                # Run negamax with this state
-                result = algo.negamax(test_state, "0", 1)
-                
-                # Should handle the case where no pieces are available to give
-                # This may return 0 (draw) or some other value depending on implementation
-                assert isinstance(result, (int, float))
-    
+            "piece": "SDEP"  # Last piece to place
+        })
+        assert test_state.available == 0
+
+        # Run negamax with this state
+        result = algo.negamax(test_state, "0", 1)
+
+        # Should handle the case where no pieces are available to give:
+        # either the last placement wins or the game is a draw
+        assert result in (0, float('inf'))
+
     def test_negamax_integration(self):
         """Full integration test of the negamax function"""
         
         # Create a game state that requires strategic thinking
-        test_state = {
+        test_state = algo.to_bitstate({
             "players": ["Player1", "Player2"],
             "current": 0,
             "board": [
@@ -207,7 +197,7 @@ class TestNegamaxInternals:
                 None,  None,   None,  None
             ],
             "piece": "BLFC"  # Current piece to place
-        }
+        })
         
         # Run the actual negamax algorithm
         result = algo.negamax(test_state, 1, 3)
@@ -0,0 +1,76 @@
+import pytest
+import json
+import os
+import threading
+import sys
+from unittest.mock import patch
+sys.path.append('.')  # Add current directory to path if needed
+
+import telemetry
+
+class TestTelemetry:
+
+    def test_write_and_rotate(self, tmp_path):
+        # Test that the records are appended in order and rotated by size
+        path = str(tmp_path / "telemetry.jsonl")
+        log = telemetry.TelemetryLog(path, max_bytes=200, backups=2)
+        for i in range(40):
+            log.write({"move": i, "latency": 0.5})
+        log.close()
+        files = telemetry.log_files(path)
+        assert files == [path + ".2", path + ".1", path]
+        assert all(os.path.getsize(f) <= 200 for f in files)
+        moves = [record["move"] for record in telemetry.read_records(path)]
+        assert moves == list(range(40 - len(moves), 40)) # The oldest file was dropped
+        assert log.dropped == 0
+
+        # A new log appends to the existing file
+        log = telemetry.TelemetryLog(path, max_bytes=200, backups=2)
+        log.write({"move": 40})
+        log.close()
+        assert [record["move"] for record in telemetry.read_records(path)][-2:] == [39, 40]
+
+    def test_write_never_blocks(self, tmp_path):
+        # Test that records are dropped, not waited for, when the writer is behind
+        release = threading.Event()
+        dumps = json.dumps
+        def slow_dumps(record, **kwargs):
+            release.wait()
+            return dumps(record, **kwargs)
+        log = telemetry.TelemetryLog(str(tmp_path / "telemetry.jsonl"), queue_size=2)
+        with patch.object(telemetry.json, 'dumps', slow_dumps):
+            for i in range(10):
+                log.write({"move": i})
+            assert log.dropped >= 7 # One taken by the writer, two queued
+            release.set()
+            log.close()
+        assert len(list(telemetry.read_records(log.path))) == 10 - log.dropped
+
+    def test_read_records(self, tmp_path):
+        # Test that a line cut by a crash is skipped and a missing log has no records
+        path = tmp_path / "telemetry.jsonl"
+        assert list(telemetry.read_records(str(path))) == []
+        path.write_text('{"latency": 1.0}\n{"latency": 2.0}\n{"laten')
+        assert list(telemetry.read_records(str(path))) == [{"latency": 1.0}, {"latency": 2.0}]
+
+    def test_latency_percentiles(self, tmp_path):
+        # Test the streaming percentiles over rotated files
+        path = str(tmp_path / "telemetry.jsonl")
+        log = telemetry.TelemetryLog(path, max_bytes=500, backups=10)
+        for i in range(100):
+            log.write({"latency": (i + 1) * 0.01})
+        log.write({"outcome": "win"}) # No latency: not counted
+        log.close()
+        assert len(telemetry.log_files(path)) > 1
+        stats = telemetry.latency_percentiles(path)
+        assert stats["moves"] == 100
+        for q in (50, 90, 99): # The upper bound of the exact value's bucket
+            assert q / 100 < stats[f"p{q}"] <= q / 100 + telemetry.LATENCY_BUCKET + 1e-9
+        assert telemetry.latency_percentiles(str(tmp_path / "missing.jsonl")) == {"moves": 0, "p50": None, "p90": None, "p99": None}
+
+        histogram = telemetry.LatencyHistogram()
+        for seconds in (-1, 0.0004, 2.5, 1e9):
+            histogram.add(seconds)
+        assert histogram.percentile(50) == telemetry.LATENCY_BUCKET
+        assert histogram.percentile(75) == pytest.approx(2.501)
+        assert histogram.percentile(100) == telemetry.LATENCY_BUCKETS * telemetry.LATENCY_BUCKET